@@ -1,18 +1,30 @@
 # this script will add fade-in, fade-out effects and captions to a video
 # based on the input timed chapters (output from summary_chapters_blog.py file)
+#
+# Use --report (JSON), --prometheus and --profile (cProfile) to see where the time goes
+# (see profiling_utils.py).
 
 import argparse
 import json
 import subprocess
 import os
 
+from profiling_utils import (
+    add_profiling_arguments,
+    file_size,
+    profiler,
+    start_profiling,
+)
+
 # get the input video file and the output text file
 parser = argparse.ArgumentParser()
 parser.add_argument("input_video_file", help="input video file")
 parser.add_argument(
     "input_timed_chapters_file", help="input text file with timed chapters"
 )
+add_profiling_arguments(parser)
 args = parser.parse_args()
+start_profiling(args, "add_fades_captions_to_video")
 
 # get the input video file name and the output text file name
 input_video_file = args.input_video_file
@@ -102,21 +114,23 @@ with open(output_srt_file, "w") as f:
 
 # get the duration of the video
 print("Getting the duration of the video...")
-result = subprocess.run(
-    [
-        "ffprobe",
-        "-v",
-        "error",
-        "-show_entries",
-        "format=duration",
-        "-of",
-        "default=noprint_wrappers=1:nokey=1",
-        input_video_file,
-    ],
-    stdout=subprocess.PIPE,
-    stderr=subprocess.STDOUT,
-)
+with profiler.stage("ffprobe"):
+    result = subprocess.run(
+        [
+            "ffprobe",
+            "-v",
+            "error",
+            "-show_entries",
+            "format=duration",
+            "-of",
+            "default=noprint_wrappers=1:nokey=1",
+            input_video_file,
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+    )
 duration = int(float(result.stdout))
+profiler.add_audio_seconds(float(result.stdout))
 
 print(f"Video duration: {duration} seconds.")
 
@@ -124,21 +138,24 @@ output_video_file_path = os.path.splitext(input_video_file)[0] + "_with_captions
 
 # add the captions to the video with ffmpeg
 print("Adding captions and fades to the video...")
-subprocess.run(
-    [
-        "ffmpeg",
-        "-i",
-        input_video_file,
-        "-vf",
-        f"subtitles={output_srt_file}:force_style='Fontsize=24,PrimaryColour=&Hffffff&'[v];[v]fade=in:st=0:n=30,fade=out:st={duration-30}:n=30",
-        "-c:v",
-        "libx264",
-        "-c:a",
-        "copy",
-        "-y",
-        output_video_file_path,
-    ]
-)
+with profiler.stage("encode"):
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-i",
+            input_video_file,
+            "-vf",
+            f"subtitles={output_srt_file}:force_style='Fontsize=24,PrimaryColour=&Hffffff&'[v];[v]fade=in:st=0:n=30,fade=out:st={duration-30}:n=30",
+            "-c:v",
+            "libx264",
+            "-c:a",
+            "copy",
+            "-y",
+            output_video_file_path,
+        ]
+    )
+profiler.add_bytes_read(file_size(input_video_file))
+profiler.add_bytes_written(file_size(output_video_file_path))
 
 # delete the temporary files
 print("Deleting the temporary files...")
@@ -0,0 +1,326 @@
+# helpers to decode the audio track of a video with ffmpeg straight into memory
+# the audio is read as raw 16-bit PCM from the ffmpeg stdout pipe, so nothing is written to disk
+#
+# Example:
+# from audio_utils import read_audio, iter_audio_chunks
+# audio = read_audio("input_video.mp4")  # float32 numpy array, mono, 16 kHz
+# for chunk_start_time, chunk in iter_audio_chunks("input_video.mp4", chunk_seconds=300):
+#     ...
+#
+# the input can also be "-" (stdin) or any ffmpeg input URL, and with follow_timeout a local
+# file that is still being written (e.g. a recording in progress) is read as it grows.
+
+import hashlib
+import queue
+import subprocess
+import threading
+
+import numpy as np
+
+from profiling_utils import file_size, profiler
+
+# whisper models expect 16 kHz mono audio
+SAMPLE_RATE = 16000
+
+# raw PCM is signed 16-bit little endian, i.e. 2 bytes per sample
+BYTES_PER_SAMPLE = 2
+
+# size of a single read from the ffmpeg pipe (~2 seconds of audio)
+PIPE_READ_SIZE = 64 * 1024
+
+
+def is_local_file(input_file):
+    return input_file != "-" and "://" not in input_file
+
+
+def count_bytes_read(input_file):
+    # ffmpeg reads the input file, not this process, so count its size for the profiler
+    if is_local_file(input_file):
+        profiler.add_bytes_read(file_size(input_file))
+
+
+def build_ffmpeg_pcm_cmd(
+    input_file, sample_rate=SAMPLE_RATE, start_time=None, follow_timeout=None
+):
+    # decode the audio of the input file to raw mono PCM on stdout
+    # with follow_timeout, ffmpeg keeps reading a local file as it grows and only stops
+    # once no new data arrived for follow_timeout seconds
+    cmd = ["ffmpeg", "-nostdin", "-loglevel", "quiet"]
+    if start_time:
+        cmd += ["-ss", str(start_time)]
+    if follow_timeout and is_local_file(input_file):
+        cmd += ["-follow", "1", "-rw_timeout", str(int(follow_timeout * 1000000))]
+    cmd += [
+        "-i",
+        "pipe:0" if input_file == "-" else input_file,
+        "-vn",
+        "-ac",
+        "1",
+        "-ar",
+        str(sample_rate),
+        "-f",
+        "s16le",
+        "-acodec",
+        "pcm_s16le",
+        "pipe:1",
+    ]
+    return cmd
+
+
+def pcm_to_float32(pcm_bytes):
+    # convert raw signed 16-bit PCM bytes to a float32 array in [-1, 1]
+    return np.frombuffer(pcm_bytes, dtype=np.int16).astype(np.float32) / 32768.0
+
+
+@profiler.timed("decode_audio")
+def read_audio(input_file, sample_rate=SAMPLE_RATE, start_time=None):
+    # read the whole audio track into a single float32 numpy array
+    process = subprocess.Popen(
+        build_ffmpeg_pcm_cmd(input_file, sample_rate, start_time),
+        stdout=subprocess.PIPE,
+    )
+    pcm = bytearray()
+    while True:
+        block = process.stdout.read(PIPE_READ_SIZE)
+        if not block:
+            break
+        pcm += block
+    process.stdout.close()
+    if process.wait() != 0 and len(pcm) == 0:
+        raise RuntimeError(f'ffmpeg could not decode the audio of "{input_file}"')
+
+    count_bytes_read(input_file)
+
+    # drop a trailing odd byte, if any
+    pcm = pcm[: len(pcm) - len(pcm) % BYTES_PER_SAMPLE]
+    return pcm_to_float32(pcm)
+
+
+@profiler.timed("hash_audio")
+def hash_audio(input_file, sample_rate=SAMPLE_RATE):
+    # sha256 of the decoded audio stream (not of the file), so that a renamed or re-muxed
+    # video with identical audio gets the same hash
+    process = subprocess.Popen(
+        build_ffmpeg_pcm_cmd(input_file, sample_rate),
+        stdout=subprocess.PIPE,
+    )
+    audio_hash = hashlib.sha256()
+    n_bytes = 0
+    while True:
+        block = process.stdout.read(PIPE_READ_SIZE)
+        if not block:
+            break
+        audio_hash.update(block)
+        n_bytes += len(block)
+    process.stdout.close()
+    if process.wait() != 0 and n_bytes == 0:
+        raise RuntimeError(f'ffmpeg could not decode the audio of "{input_file}"')
+    count_bytes_read(input_file)
+    return audio_hash.hexdigest()
+
+
+def iter_audio_chunks(
+    input_file,
+    chunk_seconds,
+    sample_rate=SAMPLE_RATE,
+    start_time=None,
+    max_queued=2,
+    follow_timeout=None,
+):
+    # yield (chunk_start_time, chunk) tuples of fixed-size float32 chunks
+    # a background thread keeps reading the ffmpeg pipe, so decoding of the next chunks
+    # overlaps with whatever the caller does with the current one.
+    # the queue is bounded so at most `max_queued` chunks are held in memory.
+    chunk_bytes = int(chunk_seconds * sample_rate) * BYTES_PER_SAMPLE
+    if chunk_bytes <= 0:
+        raise ValueError("chunk_seconds must be positive")
+
+    process = subprocess.Popen(
+        build_ffmpeg_pcm_cmd(input_file, sample_rate, start_time, follow_timeout),
+        stdout=subprocess.PIPE,
+    )
+    chunks = queue.Queue(maxsize=max_queued)
+    stop = threading.Event()
+
+    def reader():
+        pcm = bytearray()
+        try:
+            while not stop.is_set():
+                block = process.stdout.read(PIPE_READ_SIZE)
+                if not block:
+                    break
+                pcm += block
+                while len(pcm) >= chunk_bytes:
+                    chunks.put(bytes(pcm[:chunk_bytes]))
+                    del pcm[:chunk_bytes]
+            # the last (partial) chunk
+            pcm = pcm[: len(pcm) - len(pcm) % BYTES_PER_SAMPLE]
+            if len(pcm) > 0 and not stop.is_set():
+                chunks.put(bytes(pcm))
+        finally:
+            chunks.put(None)
+
+    thread = threading.Thread(target=reader, daemon=True)
+    thread.start()
+
+    chunk_start_time = float(start_time or 0.0)
+    try:
+        while True:
+            pcm = chunks.get()
+            if pcm is None:
+                break
+            chunk = pcm_to_float32(pcm)
+            yield chunk_start_time, chunk
+            chunk_start_time += len(chunk) / sample_rate
+        count_bytes_read(input_file)
+    finally:
+        # stop the reader early if the caller did not consume all the chunks
+        stop.set()
+        if process.poll() is None:
+            process.kill()
+        while thread.is_alive():
+            try:
+                chunks.get_nowait()
+            except queue.Empty:
+                thread.join(0.1)
+        process.stdout.close()
+        process.wait()
+
+
+def frame_energy(audio, frame_length):
+    # mean energy (power) of consecutive non-overlapping frames of the audio
+    n_frames = len(audio) // frame_length
+    frames = audio[: n_frames * frame_length].reshape(n_frames, frame_length)
+    return np.mean(np.square(frames, dtype=np.float32), axis=1)
+
+
+def find_split_points(
+    audio,
+    n_chunks,
+    sample_rate=SAMPLE_RATE,
+    search_seconds=15.0,
+    frame_seconds=0.02,
+    smooth_frames=15,
+):
+    # split the audio in n_chunks of roughly equal length, moving each split point to the
+    # quietest spot within +-search_seconds of the ideal position, so that the splits fall
+    # in pauses between words rather than in the middle of one.
+    # returns the sample offsets of the chunk boundaries, including 0 and len(audio).
+    frame_length = int(frame_seconds * sample_rate)
+    search_length = int(search_seconds * sample_rate)
+    split_points = [0]
+    for k in range(1, n_chunks):
+        ideal = k * len(audio) // n_chunks
+        lo = max(split_points[-1] + frame_length, ideal - search_length)
+        hi = min(len(audio), ideal + search_length)
+        if hi - lo < frame_length * smooth_frames:
+            continue
+        # smooth the energy so that a run of quiet frames wins over a single quiet frame
+        energy = frame_energy(audio[lo:hi], frame_length)
+        energy = np.convolve(energy, np.ones(smooth_frames) / smooth_frames, mode="same")
+        split_points.append(lo + int(np.argmin(energy)) * frame_length + frame_length // 2)
+    split_points.append(len(audio))
+    return split_points
+
+
+@profiler.timed("find_silences")
+def find_silences(
+    input_file,
+    threshold_db=-40.0,
+    min_duration=1.0,
+    frame_seconds=0.02,
+    block_seconds=60.0,
+    sample_rate=SAMPLE_RATE,
+):
+    # find the (start, end) time ranges where the audio stays below threshold_db (relative
+    # to full scale) for at least min_duration seconds.
+    # the audio is decoded once and analyzed in blocks of block_seconds, so memory use stays
+    # bounded no matter how long the file is. a silence can span several blocks.
+    frame_length = int(frame_seconds * sample_rate)
+    # make the blocks a whole number of frames
+    block_seconds = max(1, round(block_seconds / frame_seconds)) * frame_length / sample_rate
+    threshold = 10 ** (threshold_db / 10)
+
+    silences = []
+    run_start = None
+    previous_silent = False
+    n_frames = 0
+    for _, block in iter_audio_chunks(input_file, block_seconds, sample_rate):
+        silent = frame_energy(block, frame_length) < threshold
+        if len(silent) == 0:
+            continue
+        # frames where the audio switches between silent and not silent
+        changes = np.flatnonzero(np.diff(silent, prepend=previous_silent))
+        for k in changes.tolist():
+            if silent[k]:
+                run_start = n_frames + k
+            elif run_start is not None:
+                silences.append((run_start, n_frames + k))
+                run_start = None
+        previous_silent = bool(silent[-1])
+        n_frames += len(silent)
+    if run_start is not None:
+        silences.append((run_start, n_frames))
+
+    return [
+        (start * frame_seconds, end * frame_seconds)
+        for start, end in silences
+        if (end - start) * frame_seconds >= min_duration
+    ]
+
+
+def find_speech_regions(
+    audio,
+    threshold_db=-40.0,
+    min_silence=0.5,
+    padding=0.2,
+    frame_seconds=0.02,
+    sample_rate=SAMPLE_RATE,
+):
+    # energy-based voice activity detection: the (start, end) sample offsets of the parts of
+    # the audio between the silences (below threshold_db) of at least min_silence seconds.
+    # every region keeps `padding` seconds of the silence around it, so that the quiet
+    # beginnings and ends of the words are not cut off.
+    frame_length = int(frame_seconds * sample_rate)
+    threshold = 10 ** (threshold_db / 10)
+    loud_frames = np.flatnonzero(frame_energy(audio, frame_length) >= threshold)
+    if len(loud_frames) == 0:
+        return []
+
+    # a gap of at least min_silence between two loud frames ends a region
+    gaps = np.flatnonzero(np.diff(loud_frames) > int(min_silence / frame_seconds))
+    starts = loud_frames[np.concatenate(([0], gaps + 1))] * frame_length
+    ends = (loud_frames[np.concatenate((gaps, [len(loud_frames) - 1]))] + 1) * frame_length
+
+    # pad the regions, and merge the ones that the padding makes overlap
+    pad = int(padding * sample_rate)
+    regions = []
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        start = max(0, start - pad)
+        end = min(len(audio), end + pad)
+        if len(regions) > 0 and start <= regions[-1][1]:
+            regions[-1] = (regions[-1][0], end)
+        else:
+            regions.append((start, end))
+    return regions
+
+
+def concatenate_regions(audio, regions, sample_rate=SAMPLE_RATE):
+    # the audio of the regions back to back, and the start times (in seconds) of every
+    # region in the concatenated and in the original audio, for remap_times
+    if len(regions) == 0:
+        return audio[:0], np.zeros(1), np.zeros(1)
+    speech = np.concatenate([audio[start:end] for start, end in regions])
+    lengths = np.array([end - start for start, end in regions])
+    speech_starts = np.concatenate(([0], np.cumsum(lengths)[:-1])) / sample_rate
+    original_starts = np.array([start for start, _ in regions]) / sample_rate
+    return speech, speech_starts, original_starts
+
+
+def remap_times(times, speech_starts, original_starts, side="right"):
+    # map times in the concatenated audio back to the original timeline
+    # a time at the boundary of two regions belongs to the next region with side="right"
+    # (for start times) and to the previous one with side="left" (for end times)
+    times = np.asarray(times, dtype=np.float64)
+    i = np.clip(np.searchsorted(speech_starts, times, side=side) - 1, 0, None)
+    return original_starts[i] + (times - speech_starts[i])
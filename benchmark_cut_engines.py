@@ -0,0 +1,116 @@
+# this script will benchmark the ffmpeg cut engines of clean_video_from_transcription.py
+# against each other on synthetic keep lists with an increasing number of cuts
+#
+# Usage:
+# python benchmark_cut_engines.py <input_video_file> [--cuts 10 100 1000] [--engines ...]
+#
+# For every engine and number of cuts it reports the command line length, the number of
+# inputs ffmpeg has to open, the wall time and the peak memory (RSS) of the ffmpeg process.
+# The output is discarded (-f null), so only the cutting and decoding/encoding is measured.
+#
+# Example:
+# python benchmark_cut_engines.py "input_video.mp4" --cuts 100 1000
+
+import argparse
+import os
+import tempfile
+import time
+
+from cut_engines import (
+    build_ffmpeg_cmd_with_filter,
+    build_ffmpeg_cmd_with_select,
+    build_ffmpeg_cmd_with_ss_to,
+    probe_media,
+)
+
+parser = argparse.ArgumentParser()
+parser.add_argument("input_video_file", help="input video file")
+parser.add_argument(
+    "--cuts", type=int, nargs="+", default=[10, 100, 1000], help="numbers of cuts"
+)
+parser.add_argument(
+    "--engines",
+    nargs="+",
+    choices=["select", "filter", "ss_to"],
+    default=["select", "filter", "ss_to"],
+    help="engines to benchmark",
+)
+parser.add_argument(
+    "--build_only",
+    action="store_true",
+    help="only build the commands, do not run ffmpeg",
+)
+args = parser.parse_args()
+
+input_video_file = args.input_video_file
+media = probe_media(input_video_file)
+arg_max = os.sysconf("SC_ARG_MAX") if hasattr(os, "sysconf") else None
+
+
+def make_keep_segments(n_cuts, duration, cut_length=0.4):
+    # evenly spaced cuts of cut_length seconds, like a long talk with regular filler words
+    step = duration / (n_cuts + 1)
+    keep_segments = []
+    start_time = 0.0
+    for i in range(1, n_cuts + 1):
+        keep_segments.append((start_time, i * step))
+        start_time = i * step + min(cut_length, step / 2)
+    keep_segments.append((start_time, duration))
+    return keep_segments
+
+
+def run_ffmpeg(cmd):
+    # run ffmpeg and return (wall time, peak RSS in MB) of that process only
+    start = time.perf_counter()
+    pid = os.spawnvp(os.P_NOWAIT, cmd[0], cmd)
+    _, status, rusage = os.wait4(pid, 0)
+    elapsed = time.perf_counter() - start
+    if status != 0:
+        return elapsed, None
+    # ru_maxrss is in kilobytes on Linux
+    return elapsed, rusage.ru_maxrss / 1024
+
+
+print(f"Input: {input_video_file} ({media['duration']:.1f}s)")
+print(
+    f"{'engine':<8} {'cuts':>6} {'inputs':>6} {'cmd bytes':>10} {'build ms':>9} "
+    f"{'time s':>8} {'peak MB':>8}"
+)
+with tempfile.TemporaryDirectory() as temp_dir:
+    filter_script_file = os.path.join(temp_dir, "filter.txt")
+    for n_cuts in args.cuts:
+        keep_segments = make_keep_segments(n_cuts, media["duration"])
+        for engine in args.engines:
+            build_start = time.perf_counter()
+            if engine == "select":
+                cmd = build_ffmpeg_cmd_with_select(
+                    input_video_file,
+                    keep_segments,
+                    filter_script_file,
+                    media["frame_rate"],
+                    media["sample_rate"],
+                )
+            elif engine == "filter":
+                cmd = build_ffmpeg_cmd_with_filter(input_video_file, keep_segments)
+            else:
+                cmd = build_ffmpeg_cmd_with_ss_to(input_video_file, keep_segments)
+            build_ms = (time.perf_counter() - build_start) * 1000
+            cmd = [*cmd, "-f", "null", "-"]
+
+            n_inputs = cmd.count("-i")
+            cmd_bytes = sum(len(arg.encode("utf-8")) + 1 for arg in cmd)
+            if arg_max is not None and cmd_bytes >= arg_max:
+                result = "exceeds ARG_MAX"
+            elif args.build_only:
+                result = "-"
+            else:
+                elapsed, peak_mb = run_ffmpeg(cmd)
+                result = (
+                    f"{elapsed:>8.1f} {peak_mb:>8.0f}"
+                    if peak_mb is not None
+                    else f"{elapsed:>8.1f} {'failed':>8}"
+                )
+            print(
+                f"{engine:<8} {n_cuts:>6} {n_inputs:>6} {cmd_bytes:>10} "
+                f"{build_ms:>9.1f} {result}"
+            )
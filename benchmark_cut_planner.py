@@ -0,0 +1,123 @@
+# this script will benchmark the cut planner (cut_planner.py) on a synthetic transcript,
+# against the original pop-based merging of consecutive filler words
+#
+# Usage:
+# python benchmark_cut_planner.py [--words 100000] [--filler_ratio 0.05]
+#
+# Example:
+# python benchmark_cut_planner.py --words 100000
+
+import argparse
+import random
+import time
+
+import numpy as np
+
+from cut_planner import find_filler_ranges, plan_cuts
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--words", type=int, default=100000, help="number of words")
+parser.add_argument(
+    "--filler_ratio", type=float, default=0.05, help="fraction of filler words"
+)
+parser.add_argument("--seed", type=int, default=0, help="random seed")
+args = parser.parse_args()
+
+filler_words = ["um", "uh", "so"]
+other_words = ["the", "video", "and", "we", "transcript", "helper", "is", "a"]
+
+
+def make_transcript(n_words, filler_ratio):
+    # words of 0.1-0.6 seconds with pauses of 0-0.3 seconds between them
+    rng = random.Random(args.seed)
+    contents = []
+    start_times = np.zeros(n_words)
+    end_times = np.zeros(n_words)
+    t = 0.0
+    for i in range(n_words):
+        if rng.random() < filler_ratio:
+            contents.append(rng.choice(filler_words))
+        else:
+            contents.append(rng.choice(other_words))
+        t += rng.uniform(0.0, 0.3)
+        start_times[i] = t
+        t += rng.uniform(0.1, 0.6)
+        end_times[i] = t
+    return contents, start_times, end_times, t + 1.0
+
+
+def plan_cuts_original(contents, start_times, end_times, duration):
+    # the original planning of clean_video_from_transcription.py: pop merged consecutive
+    # filler words from a list of items, add sentinels, sort, and stagger the timings
+    pronunciation_items = [
+        {"content": content, "start_time": start, "end_time": end}
+        for content, start, end in zip(contents, start_times, end_times)
+    ]
+    i = 0
+    while i < len(pronunciation_items) - 1:
+        if (
+            pronunciation_items[i]["content"].lower() in filler_words
+            and pronunciation_items[i + 1]["content"].lower() in filler_words
+        ):
+            pronunciation_items[i]["end_time"] = pronunciation_items[i + 1]["end_time"]
+            pronunciation_items.pop(i + 1)
+        else:
+            i += 1
+
+    filler_words_timings = [(0.0, 0.0)]
+    for i, item in enumerate(pronunciation_items[:-1]):
+        if item["content"].lower() in filler_words:
+            start_time = float(item["start_time"])
+            end_time = float(item["end_time"])
+            if end_time - start_time < 0.3:
+                end_time = start_time + 0.3
+            if float(pronunciation_items[i + 1]["start_time"]) > end_time:
+                end_time = float(pronunciation_items[i + 1]["start_time"])
+            if start_time >= end_time:
+                continue
+            filler_words_timings.append((start_time, end_time))
+    filler_words_timings.append((duration, duration))
+    filler_words_timings.sort(key=lambda x: x[0])
+
+    return [
+        (filler_words_timings[i - 1][1], filler_words_timings[i][0])
+        for i in range(1, len(filler_words_timings))
+        if filler_words_timings[i - 1][1] < filler_words_timings[i][0]
+    ]
+
+
+contents, start_times, end_times, duration = make_transcript(
+    args.words, args.filler_ratio
+)
+print(f"{args.words} words, {duration / 3600:.1f} hours")
+
+start = time.perf_counter()
+original_keep_segments = plan_cuts_original(contents, start_times, end_times, duration)
+original_elapsed = time.perf_counter() - start
+print(f"original: {original_elapsed * 1000:8.1f} ms, {len(original_keep_segments)} segments")
+
+start = time.perf_counter()
+keep_segments = plan_cuts(
+    find_filler_ranges(contents, start_times, end_times, filler_words), duration
+)
+elapsed = time.perf_counter() - start
+print(f"planner:  {elapsed * 1000:8.1f} ms, {len(keep_segments)} segments")
+
+start = time.perf_counter()
+padded_keep_segments = plan_cuts(
+    find_filler_ranges(contents, start_times, end_times, filler_words),
+    duration,
+    pre_padding=0.05,
+    post_padding=0.05,
+    min_keep=0.2,
+)
+padded_elapsed = time.perf_counter() - start
+print(
+    f"planner (padding, min_keep): {padded_elapsed * 1000:8.1f} ms, "
+    f"{len(padded_keep_segments)} segments"
+)
+
+if np.allclose(np.array(original_keep_segments), np.array(keep_segments)):
+    print("the planner matches the original keep list")
+else:
+    print("WARNING: the planner does not match the original keep list")
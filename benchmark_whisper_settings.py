@@ -0,0 +1,181 @@
+# this script will benchmark the faster-whisper model settings of
+# transcribe_from_video_whisper.py on a reference clip, to pick the best speed/quality point
+# for the machines the transcription runs on
+#
+# Usage:
+# python benchmark_whisper_settings.py <input_video_file> [--models base small]
+#     [--compute_types int8 float32] [--cpu_threads 4 8] [--beam_sizes 1 5]
+#     [--vads off energy silero] [--batch_sizes 0 8]
+#
+# Every combination of the settings runs in a fresh process. For each one the script reports
+# the model load time, the transcription time, the realtime factor (RTF, lower is faster),
+# the peak memory (RSS) of the process and the word agreement with the reference transcript:
+# the share of the reference words that the settings transcribed identically, in order.
+# Comparing --vads off with energy or silero shows the actual speedup of skipping non-speech.
+# The reference is the --reference transcript file, or else the first combination.
+#
+# Example:
+# python benchmark_whisper_settings.py "clip.mp4" --duration 300 --models base small \
+#     --compute_types int8 int8_float32 float32 --beam_sizes 1 5
+
+import argparse
+import difflib
+import itertools
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import transcribe_from_video_whisper as whisper
+from audio_utils import SAMPLE_RATE, read_audio
+from profiling_utils import get_peak_rss_bytes
+from transcript_utils import load_transcript, punctuation_marks, split_punctuation
+
+# the settings that are combined, in the order of the command line options
+SETTING_NAMES = [
+    "model",
+    "compute_type",
+    "cpu_threads",
+    "num_workers",
+    "beam_size",
+    "batch_size",
+    "vad",
+]
+
+
+def normalize_words(words):
+    # compare the words without case and punctuation
+    return [word.strip().lower() for word in words if word.strip()]
+
+
+def word_agreement(reference_words, words):
+    # share of the reference words that were transcribed identically, in order
+    if len(reference_words) == 0:
+        return 0.0
+    matcher = difflib.SequenceMatcher(None, reference_words, words, autojunk=False)
+    matches = sum(block.size for block in matcher.get_matching_blocks())
+    return matches / len(reference_words)
+
+
+def run_settings(audio, settings):
+    # runs in a fresh process, so the peak RSS is that of these settings only
+    start = time.perf_counter()
+    model = whisper.load_model(settings)
+    load_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    segments, _ = whisper.transcribe(model, audio, settings)
+    words = [
+        word["word"]
+        for segment in split_punctuation(segments)
+        for word in segment["words"]
+        if word["word"] not in punctuation_marks
+    ]
+    transcribe_seconds = time.perf_counter() - start
+
+    # the peak of this worker process, each run has its own
+    peak_mb = get_peak_rss_bytes() / 1024 / 1024
+    return load_seconds, transcribe_seconds, peak_mb, normalize_words(words)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input_video_file", help="input (reference) video file")
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=0,
+        help="only use the first this many seconds of the audio (0 = all of it)",
+    )
+    parser.add_argument(
+        "--models", nargs="+", default=[whisper.MODEL_NAME], help="model sizes or paths"
+    )
+    parser.add_argument(
+        "--compute_types",
+        nargs="+",
+        choices=whisper.COMPUTE_TYPES,
+        default=["int8", "float32"],
+        help="compute types",
+    )
+    parser.add_argument(
+        "--cpu_threads", type=int, nargs="+", default=[0], help="threads per model"
+    )
+    parser.add_argument(
+        "--num_workers", type=int, nargs="+", default=[1], help="workers per model"
+    )
+    parser.add_argument(
+        "--beam_sizes", type=int, nargs="+", default=[5], help="beam sizes"
+    )
+    parser.add_argument(
+        "--batch_sizes",
+        type=int,
+        nargs="+",
+        default=[0],
+        help="batch sizes of the batched pipeline (0 = no batching)",
+    )
+    parser.add_argument(
+        "--vads",
+        nargs="+",
+        choices=["off", "silero", "energy"],
+        default=["off"],
+        help="voice activity detection before decoding",
+    )
+    parser.add_argument(
+        "--reference",
+        help="reference transcript (.json, .jsonl or .npz) of the same audio",
+    )
+    args = parser.parse_args()
+
+    print("Decoding the audio...")
+    audio = read_audio(args.input_video_file)
+    if args.duration > 0:
+        audio = audio[: int(args.duration * SAMPLE_RATE)]
+    audio_duration = len(audio) / SAMPLE_RATE
+
+    reference_words = None
+    if args.reference:
+        table = load_transcript(args.reference)
+        reference_words = normalize_words(
+            table.contents[i] for i in table.pronunciation_indices()
+        )
+
+    print(f"Input: {args.input_video_file} ({audio_duration:.1f}s)")
+    print(
+        f"{'model':<12} {'compute':<13} {'threads':>7} {'workers':>7} {'beam':>4} "
+        f"{'batch':>5} {'vad':<6} {'load s':>7} {'time s':>7} {'RTF':>6} "
+        f"{'peak MB':>8} {'words':>6} {'agree':>6}"
+    )
+    # spawn instead of fork, so no memory is shared with (and counted from) this process
+    context = multiprocessing.get_context("spawn")
+    combinations = itertools.product(
+        args.models,
+        args.compute_types,
+        args.cpu_threads,
+        args.num_workers,
+        args.beam_sizes,
+        args.batch_sizes,
+        args.vads,
+    )
+    for values in combinations:
+        settings = dict(
+            zip(SETTING_NAMES, values),
+            vad_threshold_db=whisper.model_settings["vad_threshold_db"],
+        )
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            load_seconds, transcribe_seconds, peak_mb, words = executor.submit(
+                run_settings, audio, settings
+            ).result()
+
+        if reference_words is None:
+            reference_words = words
+        print(
+            f"{settings['model']:<12} {settings['compute_type']:<13} "
+            f"{settings['cpu_threads']:>7} {settings['num_workers']:>7} "
+            f"{settings['beam_size']:>4} {settings['batch_size']:>5} "
+            f"{settings['vad']:<6} {load_seconds:>7.1f} {transcribe_seconds:>7.1f} "
+            f"{transcribe_seconds / audio_duration:>6.3f} {peak_mb:>8.0f} "
+            f"{len(words):>6} {word_agreement(reference_words, words):>6.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
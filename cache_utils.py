@@ -0,0 +1,132 @@
+# a small content-addressed on-disk cache for JSON results
+# entries are stored as <cache_dir>/<key[:2]>/<key>.json and the least recently used ones are
+# evicted once the cache grows over its size limit. with ttl_seconds, entries older than that
+# are treated as missing and removed.
+#
+# the modification time of an entry is when it was written (for the TTL) and its access time
+# is when it was last used (for the eviction)
+#
+# Example:
+# from cache_utils import DiskCache, make_cache_key
+# cache = DiskCache(DEFAULT_CACHE_DIR)
+# key = make_cache_key(audio=audio_hash, model="base")
+# result = cache.get(key)
+# if result is None:
+#     result = ...
+#     cache.put(key, result)
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from profiling_utils import profiler
+
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+    "video-transcript-helper",
+)
+
+# 2 GB
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024
+
+
+def make_cache_key(**fields):
+    # hash all the fields that influence the cached result
+    return hashlib.sha256(
+        json.dumps(fields, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    ).hexdigest()
+
+
+class DiskCache:
+    def __init__(
+        self, cache_dir, max_bytes=DEFAULT_MAX_BYTES, ttl_seconds=None, name="cache"
+    ):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        # the hits and misses are also counted as <name>_hits / <name>_misses in the profiler
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _is_expired(self, stat):
+        return (
+            self.ttl_seconds is not None
+            and time.time() - stat.st_mtime > self.ttl_seconds
+        )
+
+    def _count(self, hit):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        profiler.count(f"{self.name}_hits" if hit else f"{self.name}_misses")
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".json")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            stat = os.stat(path)
+            if self._is_expired(stat):
+                os.remove(path)
+                self._count(hit=False)
+                return None
+            with open(path) as f:
+                value = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self._count(hit=False)
+            return None
+        # mark the entry as recently used, and keep the time it was written
+        os.utime(path, (time.time(), stat.st_mtime))
+        self._count(hit=True)
+        return value
+
+    def put(self, key, value):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file first so that a crash never leaves a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(value, f)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def put_file(self, key, json_file):
+        # store an already written JSON file, without loading it in memory
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        os.close(fd)
+        shutil.copyfile(json_file, tmp_path)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        # remove the expired entries, and then the least recently used ones until the cache
+        # fits in max_bytes
+        entries = []
+        total_bytes = 0
+        for root, _, file_names in os.walk(self.cache_dir):
+            for file_name in file_names:
+                if not file_name.endswith(".json"):
+                    continue
+                path = os.path.join(root, file_name)
+                stat = os.stat(path)
+                if self._is_expired(stat):
+                    os.remove(path)
+                    continue
+                entries.append((stat.st_atime, stat.st_size, path))
+                total_bytes += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            os.remove(path)
+            total_bytes -= size
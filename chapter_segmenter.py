@@ -0,0 +1,267 @@
+# split a transcript into chapters locally, without sending it to a language model: the
+# sentences are grouped into short units, every unit is embedded with a small CPU model and
+# the chapters start where the topic changes, i.e. at the deepest drops of the similarity
+# between the units before and after each gap (TextTiling, with embeddings instead of word
+# counts). A language model is then only asked for the titles, in one small request.
+#
+# The embeddings come from sentence-transformers (e.g. all-MiniLM-L6-v2) if it is installed,
+# and otherwise from TF-IDF vectors of the words of the units, which is the lexical cohesion
+# of the original TextTiling.
+#
+# The chapters are written in the format read by add_fades_captions_to_video.py:
+#     00:00 - 03:12 Introduction
+#     03:12 - 10:45 Setting up the project
+#
+# Example:
+# from chapter_segmenter import format_chapters, segment_chapters, title_chapters
+# chapters = segment_chapters(SentenceIndex.from_table(table), max_chapters=10)
+# titles = await title_chapters(client, "gpt-3.5-turbo", chapters)
+# print(format_chapters(chapters, titles))
+
+import re
+import zlib
+
+import numpy as np
+
+from llm_utils import build_prompt
+from profiling_utils import profiler
+
+# a small local model, if sentence-transformers is installed
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
+DEFAULT_EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+
+# number of dimensions of the hashed TF-IDF vectors used without sentence-transformers
+HASHED_DIMENSIONS = 4096
+WORD_PATTERN = re.compile(r"\w+")
+
+TITLE_LINE_PATTERN = re.compile(r"^\W*(\d+)\s*[.):-]\s*(.+)$")
+SPACED_DASHES_PATTERN = re.compile(r"(?: -)+ ")
+
+_models = {}
+
+
+def format_mmss(seconds):
+    return f"{int(seconds // 60):02d}:{int(seconds % 60):02d}"
+
+
+def embed_texts(texts, model_name=DEFAULT_EMBEDDING_MODEL):
+    # one L2-normalized row per text
+    if SentenceTransformer is not None:
+        if model_name not in _models:
+            with profiler.stage("embedding_model_load"):
+                _models[model_name] = SentenceTransformer(model_name, device="cpu")
+        with profiler.stage("embed"):
+            return np.asarray(
+                _models[model_name].encode(
+                    texts, batch_size=64, normalize_embeddings=True
+                ),
+                dtype=np.float32,
+            )
+    with profiler.stage("embed"):
+        return tfidf_vectors(texts)
+
+
+def tfidf_vectors(texts, dimensions=HASHED_DIMENSIONS):
+    # hashed bag of words, weighted by the inverse document frequency and L2-normalized.
+    # crc32 instead of hash() keeps the vectors the same from one run to the next.
+    rows = []
+    columns = []
+    for row, text in enumerate(texts):
+        for word in WORD_PATTERN.findall(text.lower()):
+            rows.append(row)
+            columns.append(zlib.crc32(word.encode("utf-8")) % dimensions)
+    counts = np.zeros((len(texts), dimensions), dtype=np.float32)
+    np.add.at(
+        counts, (np.asarray(rows, dtype=np.intp), np.asarray(columns, dtype=np.intp)), 1
+    )
+
+    document_frequencies = np.count_nonzero(counts, axis=0)
+    idf = np.log((1 + len(texts)) / (1 + document_frequencies)) + 1
+    vectors = np.log1p(counts) * idf.astype(np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def gap_similarities(embeddings, block_size):
+    # cosine similarity of the mean of the block_size units before each gap with the mean of
+    # the block_size units after it. gap g is between the units g and g + 1.
+    n = len(embeddings)
+    sums = np.concatenate(
+        (np.zeros((1, embeddings.shape[1]), embeddings.dtype), np.cumsum(embeddings, 0))
+    )
+    gaps = np.arange(1, n)
+    before = sums[gaps] - sums[np.maximum(gaps - block_size, 0)]
+    after = sums[np.minimum(gaps + block_size, n)] - sums[gaps]
+    norms = np.linalg.norm(before, axis=1) * np.linalg.norm(after, axis=1)
+    return np.einsum("ij,ij->i", before, after) / np.maximum(norms, 1e-12)
+
+
+def depth_scores(similarities, block_size):
+    # how much deeper each gap is than the highest similarity within block_size gaps on
+    # either side of it
+    n = len(similarities)
+    left_peaks = similarities.copy()
+    right_peaks = similarities.copy()
+    for shift in range(1, min(block_size, n - 1) + 1):
+        left_peaks[shift:] = np.maximum(left_peaks[shift:], similarities[:-shift])
+        right_peaks[:-shift] = np.maximum(right_peaks[:-shift], similarities[shift:])
+    return (left_peaks - similarities) + (right_peaks - similarities)
+
+
+def find_boundaries(
+    similarities, depths, gap_times, max_boundaries, min_seconds, duration
+):
+    # the gaps where a chapter starts: the valleys (local minima) of the similarity that are
+    # deeper than the mean plus half the standard deviation of the valley depths (TextTiling
+    # subtracts it, which lets almost every valley of the smoother embedding similarities
+    # through), deepest first, at least min_seconds from the start, the end and each other
+    if len(similarities) == 0 or max_boundaries <= 0:
+        return []
+    previous = np.concatenate(([np.inf], similarities[:-1]))
+    following = np.concatenate((similarities[1:], [np.inf]))
+    candidates = np.flatnonzero(
+        (similarities <= previous) & (similarities <= following) & (depths > 0)
+    )
+    if len(candidates) == 0:
+        return []
+    valley_depths = depths[candidates]
+    cutoff = valley_depths.mean() + valley_depths.std() / 2
+    candidate_times = gap_times[candidates]
+    candidates = candidates[
+        (valley_depths >= cutoff)
+        & (candidate_times >= min_seconds)
+        & (candidate_times <= duration - min_seconds)
+    ]
+    candidates = candidates[np.argsort(-depths[candidates], kind="stable")]
+
+    boundaries = []
+    for gap in candidates.tolist():
+        if all(
+            abs(gap_times[gap] - gap_times[other]) >= min_seconds
+            for other in boundaries
+        ):
+            boundaries.append(gap)
+            if len(boundaries) == max_boundaries:
+                break
+    return sorted(boundaries)
+
+
+def segment_chapters(
+    sentence_index,
+    model_name=DEFAULT_EMBEDDING_MODEL,
+    unit_sentences=3,
+    block_size=4,
+    max_chapters=10,
+    min_chapter_seconds=60.0,
+    excerpt_units=2,
+):
+    # split the sentences of a SentenceIndex into at most max_chapters chapters, returns a
+    # list of dicts with the start and end times, the range of sentences and an excerpt of
+    # the sentences closest to the topic of the chapter (to title it)
+    n_sentences = len(sentence_index)
+    if n_sentences == 0:
+        return []
+    texts = [sentence_index.sentence_text(k) for k in range(n_sentences)]
+
+    # the units are TextTiling's pseudo-sentences: a single sentence is too short to have a
+    # reliable topic
+    unit_starts = np.arange(0, n_sentences, unit_sentences)
+    unit_ends = np.minimum(unit_starts + unit_sentences, n_sentences)
+    unit_texts = [
+        " ".join(texts[start:end])
+        for start, end in zip(unit_starts.tolist(), unit_ends.tolist())
+    ]
+    embeddings = embed_texts(unit_texts, model_name)
+
+    with profiler.stage("find_boundaries"):
+        duration = float(sentence_index.end_times[-1])
+        similarities = gap_similarities(embeddings, block_size)
+        depths = depth_scores(similarities, block_size)
+        gap_times = sentence_index.start_times[unit_starts[1:]]
+        boundaries = find_boundaries(
+            similarities,
+            depths,
+            gap_times,
+            max_chapters - 1,
+            min_chapter_seconds,
+            duration,
+        )
+
+    # the chapters follow each other, and the first one starts at 00:00 as YouTube requires
+    chapter_units = [0] + [gap + 1 for gap in boundaries] + [len(unit_starts)]
+    chapters = []
+    for first_unit, end_unit in zip(chapter_units[:-1], chapter_units[1:]):
+        first = int(unit_starts[first_unit])
+        end = int(unit_ends[end_unit - 1])
+        centroid = embeddings[first_unit:end_unit].mean(axis=0)
+        closest_units = first_unit + np.argsort(
+            -(embeddings[first_unit:end_unit] @ centroid), kind="stable"
+        )[:excerpt_units]
+        start_time = 0.0 if first == 0 else float(sentence_index.start_times[first])
+        chapters.append(
+            {
+                "start_time": start_time,
+                "end_time": duration,
+                "first_sentence": first,
+                "end_sentence": end,
+                "excerpt": [unit_texts[i] for i in sorted(closest_units.tolist())],
+            }
+        )
+        if len(chapters) > 1:
+            chapters[-2]["end_time"] = chapters[-1]["start_time"]
+    return chapters
+
+
+def build_title_prompt(chapters, trim_length=300):
+    lines = [
+        f"{i + 1}. " + " ".join(chapter["excerpt"])[:trim_length]
+        for i, chapter in enumerate(chapters)
+    ]
+    return build_prompt(
+        "excerpts of consecutive chapters of a video:\n",
+        lines,
+        f"write a short title (at most 8 words) for each of the {len(chapters)} "
+        + "chapters of the video, one per line in the format: '<number>. <title>'\n",
+    )
+
+
+def clean_title(title):
+    # one line without markdown quotes or a final period, and without " - ", which is where
+    # add_fades_captions_to_video.py splits the chapter lines
+    title = " ".join(title.split()).strip("\"'*").rstrip(".")
+    return SPACED_DASHES_PATTERN.sub(", ", title).rstrip(" -")
+
+
+def parse_titles(answer, chapters):
+    # the numbered titles of the answer, a chapter without one is titled with the start of
+    # its excerpt
+    titles = {}
+    for line in answer.splitlines():
+        match = TITLE_LINE_PATTERN.match(line.strip())
+        if match:
+            titles[int(match.group(1))] = clean_title(match.group(2))
+    return [
+        titles.get(i + 1) or clean_title(" ".join(chapter["excerpt"][0].split()[:8]))
+        for i, chapter in enumerate(chapters)
+    ]
+
+
+async def title_chapters(client, model, chapters, trim_length=300):
+    # all the titles in a single request
+    if len(chapters) == 0:
+        return []
+    answer = await client.complete(model, build_title_prompt(chapters, trim_length))
+    return parse_titles(answer, chapters)
+
+
+def format_chapters(chapters, titles):
+    lines = []
+    for chapter, title in zip(chapters, titles):
+        start_time = format_mmss(chapter["start_time"])
+        end_time = format_mmss(chapter["end_time"])
+        lines.append(f"{start_time} - {end_time} {title}")
+    return "\n".join(lines)
@@ -8,220 +8,282 @@
 #
 # Example:
 # python clean_video_from_transcription.py "input_video.mp4" "input_json.json"
+#
+# Use --engine to pick how ffmpeg cuts the video (see cut_engines.py), the default "select"
+# engine decodes the input once and scales to thousands of cuts. The "smartcut" engine only
+# re-encodes the video around the cut points and stream-copies everything else, which is much
+# faster for long H.264/HEVC videos with sparse filler words. The "parallel" engine encodes
+# batches of the kept segments in --workers ffmpeg processes of --threads_per_worker threads.
+#
+# The kept segments are planned by cut_planner.py: --pre_padding / --post_padding widen (or
+# narrow) every cut, and kept segments shorter than --min_keep seconds are removed as well.
+#
+# Use --silence remove to also cut the periods of silence found in the audio, or
+# --silence speedup to play them --silence_speed times faster instead (only with the default
+# select engine, which then keeps one of every --silence_speed frames of the silences).
+#
+# Use --report (JSON), --prometheus and --profile (cProfile) to see where the time goes, e.g.
+# loading the transcript, ffprobe, the silence detection or the final ffmpeg encode
+# (see profiling_utils.py).
 
 import argparse
-import json
 import subprocess
 import os
 
+from audio_utils import find_silences
+from cut_engines import (
+    SMART_CUT_ENCODERS,
+    build_ffmpeg_cmd_with_filter,
+    build_ffmpeg_cmd_with_select,
+    build_ffmpeg_cmd_with_speedup,
+    build_ffmpeg_cmd_with_ss_to,
+    probe_media,
+    run_parallel_cut,
+    run_smart_cut,
+)
+from cut_planner import (
+    find_filler_ranges,
+    plan_cuts,
+    shrink_ranges,
+    split_for_speedup,
+)
+from profiling_utils import (
+    add_profiling_arguments,
+    file_size,
+    profiler,
+    start_profiling,
+)
+from transcript_utils import load_transcript
+
 # get the input video file and the output text file
 parser = argparse.ArgumentParser()
 parser.add_argument("input_video_file", help="input video file")
-parser.add_argument("input_json_file", help="input json transcription file")
+parser.add_argument(
+    "input_json_file", help="input json (or compact .npz) transcription file"
+)
+parser.add_argument(
+    "--engine",
+    choices=["select", "smartcut", "parallel", "filter", "ss_to"],
+    default="select",
+    help="how ffmpeg cuts the video: decode once and select the kept frames (select), "
+    "stream-copy whole GOPs and re-encode only around the cuts (smartcut), "
+    "encode batches of kept segments in several ffmpeg processes (parallel), "
+    "trim and concat (filter) or one input per kept segment (ss_to)",
+)
+parser.add_argument(
+    "--workers",
+    type=int,
+    default=4,
+    help="number of ffmpeg processes for the parallel engine",
+)
+parser.add_argument(
+    "--threads_per_worker",
+    type=int,
+    default=0,
+    help="threads per ffmpeg process for the parallel engine "
+    "(0 = cpu count / number of workers)",
+)
+parser.add_argument(
+    "--pre_padding",
+    type=float,
+    default=0.0,
+    help="seconds to also remove before each filler word (negative values keep more)",
+)
+parser.add_argument(
+    "--post_padding",
+    type=float,
+    default=0.0,
+    help="seconds to also remove after each filler word (negative values keep more)",
+)
+parser.add_argument(
+    "--min_keep",
+    type=float,
+    default=0.1,
+    help="remove the kept segments shorter than this many seconds",
+)
+parser.add_argument(
+    "--silence",
+    choices=["off", "remove", "speedup"],
+    default="off",
+    help="also remove the periods of silence, or play them faster",
+)
+parser.add_argument(
+    "--silence_threshold_db",
+    type=float,
+    default=-40.0,
+    help="audio below this level (dB relative to full scale) is silence",
+)
+parser.add_argument(
+    "--silence_min_duration",
+    type=float,
+    default=1.0,
+    help="only silences longer than this many seconds are shortened",
+)
+parser.add_argument(
+    "--silence_keep",
+    type=float,
+    default=0.3,
+    help="seconds of every removed silence to keep as a natural pause",
+)
+parser.add_argument(
+    "--silence_speed",
+    type=float,
+    default=4.0,
+    help="speed factor for the silences with --silence speedup",
+)
+add_profiling_arguments(parser)
 args = parser.parse_args()
+if args.silence == "speedup" and args.engine != "select":
+    # changing the speed of parts of the video is a variant of the select engine
+    parser.error("--silence speedup only works with the select engine")
+start_profiling(args, "clean_video_from_transcription")
 
 # get the input video file name and the output text file name
 input_video_file = args.input_video_file
 input_json_file = args.input_json_file
 
-# read the input JSON file
+# read the input transcription file (.json or the compact .npz)
 print("Parsing the input JSON file...")
-with open(input_json_file) as f:
-    data = json.load(f)
+table = load_transcript(input_json_file)
 
 # get all the items where .results.items.alternatives.content is a filler word
 filler_words = ["um", "uh", "so"]
 
-# filter to keep only pronunciations
-pronunciation_items = list(
-    filter(lambda x: x["type"] == "pronunciation", data["results"]["items"])
-)
-
-# merge consecutive filler words in pronunciation_items
-i = 0
-while i < len(pronunciation_items) - 1:
-    if (
-        pronunciation_items[i]["alternatives"][0]["content"].lower() in filler_words
-        and pronunciation_items[i + 1]["alternatives"][0]["content"].lower()
-        in filler_words
-    ):
-        print(
-            "Found consecutive filler words: "
-            "{pronunciation_items[i]['alternatives'][0]['content']} "
-            f"{pronunciation_items[i+1]['alternatives'][0]['content']} "
-            "at "
-            f"{pronunciation_items[i]['start_time']} "
-            f"{pronunciation_items[i+1]['start_time']}"
-        )
-        # merge the start and end timings of the two items
-        pronunciation_items[i]["end_time"] = pronunciation_items[i + 1]["end_time"]
-
-        # remove the second item
-        pronunciation_items.pop(i + 1)
-    else:
-        i += 1
+# keep only pronunciations
+pronunciation_indices = table.pronunciation_indices()
+contents = [table.contents[i] for i in pronunciation_indices]
 
 # extract the timings from the filler words items, in (start, end) tuples
-# parse float from string
+# consecutive filler words are merged into a single (start, end) tuple
 # the end time of a filler word is the start time of the next pronunciation
 # unless the next pronunciation is also a filler word, in which case the end time is the end time
 # of the next pronunciation
-filler_words_timings = [(0.0, 0.0)]
-for i, item in enumerate(pronunciation_items[:-1]):
-    # check in lowercase
-    if item["alternatives"][0]["content"].lower() in filler_words:
-        # get the start & end time of the filler word
-        start_time = float(item["start_time"])
-        # end_time = float(pronunciation_items[i+1]["start_time"]) + 0.1
-        end_time = float(item["end_time"])
-        # the duration of a filler word is at least 0.3 seconds
-        if end_time - start_time < 0.3:
-            end_time = start_time + 0.3
-        # if the next pronunciation is farther ahead than 0.3 seconds, then the start time of the
-        # next pronunciation as the end time of this filler word
-        if float(pronunciation_items[i + 1]["start_time"]) > end_time:
-            end_time = float(pronunciation_items[i + 1]["start_time"])
-
-        if start_time >= end_time:
-            continue
-
-        filler_words_timings.append((start_time, end_time))
-
-# append in the end the duration of the video
-# find the duration of the video using ffprobe
-print("Finding the duration of the video...")
-ffprobe_output = subprocess.check_output(
-    [
-        "ffprobe",
-        "-v",
-        "error",
-        "-show_entries",
-        "format=duration",
-        "-of",
-        "default=noprint_wrappers=1:nokey=1",
-        input_video_file,
-    ]
-)
-video_duration = float(ffprobe_output)
-filler_words_timings.append((video_duration, video_duration))
-
-# sort the filler words timings by start time
-filler_words_timings.sort(key=lambda x: x[0])
+with profiler.stage("find_fillers"):
+    filler_words_timings = find_filler_ranges(
+        contents,
+        table.start_times[pronunciation_indices],
+        table.end_times[pronunciation_indices],
+        filler_words,
+    )
 
-print(f"Found {len(filler_words_timings)-2} filler words in the video.")
+print(f"Found {len(filler_words_timings)} filler words in the video.")
 
 print("Filler words timings:")
 print(filler_words_timings[:5] + ["..."] + filler_words_timings[-5:])
 
-# build an ffmpeg filter to remove the filler words by using the timings
-# e.g.
-#      [0:v]trim=start=10:end=20,setpts=PTS-STARTPTS,format=yuv420p[0v];
-#      [0:a]atrim=start=10:end=20,asetpts=PTS-STARTPTS[0a];
-#      [0:v]trim=start=30:end=40,setpts=PTS-STARTPTS,format=yuv420p[1v];
-#      [0:a]atrim=start=30:end=40,asetpts=PTS-STARTPTS[1a];
-#      [0:v]trim=start=30:end=40,setpts=PTS-STARTPTS,format=yuv420p[2v];
-#      [0:a]atrim=start=30:end=40,asetpts=PTS-STARTPTS[2a];
-# and then concatenate the inputs
-#      [0v][0a][1v][1a][2v][2a]concat=n=3:v=1:a=1[outv][outa]
-
-
-
-def build_ffmpeg_cmd_with_filter():
-    n_filrs = len(filler_words_timings)
-    filter = ""
-    for i in range(1, n_filrs):
-        # stagger the start and end time of the video and audio filters
-        # so that we take the "non-filler" portion of the video
-        start_time = filler_words_timings[i - 1][1]
-        end_time = filler_words_timings[i][0]
-
-        # add the video filter
-        filter += (
-            f"[0:v]trim=start={start_time}:end={end_time},setpts=PTS-STARTPTS[{i}v];"
-        )
+# find the duration of the video (and the frame and sample rates) using ffprobe
+print("Finding the duration of the video...")
+media = probe_media(input_video_file)
+video_duration = media["duration"]
+profiler.add_audio_seconds(video_duration)
+
+# find the periods of silence in the audio
+silences = []
+if args.silence != "off":
+    print("Finding the periods of silence in the audio...")
+    silences = shrink_ranges(
+        find_silences(
+            input_video_file, args.silence_threshold_db, args.silence_min_duration
+        ),
+        args.silence_keep / 2,
+    )
+    print(
+        f"Found {len(silences)} periods of silence, "
+        f"{sum(end - start for start, end in silences):.1f}s in total."
+    )
+
+# plan the "non-filler" portions of the video to keep
+remove_ranges = filler_words_timings
+if args.silence == "remove":
+    remove_ranges = filler_words_timings + silences
+with profiler.stage("plan_cuts"):
+    keep_segments = plan_cuts(
+        remove_ranges,
+        video_duration,
+        pre_padding=args.pre_padding,
+        post_padding=args.post_padding,
+        min_keep=args.min_keep,
+    )
+
+print(f"Keeping {len(keep_segments)} segments of the video.")
 
-        # add the audio filter
-        filter += (
-            f"[0:a]atrim=start={start_time}:end={end_time},asetpts=PTS-STARTPTS[{i}a];"
-        )
+output_video_file = os.path.splitext(input_video_file)[0] + "_cleaned.mp4"
 
-    # add the concat filter
-    all_inputs = "".join([f"[{i}v][{i}a]" for i in range(n_filrs)])
-    filter += f"{all_inputs}concat=n={n_filrs}:v=1:a=1[outv][outa]"
-    print("Filter:")
-    print(filter)
 
-    return [
-        "ffmpeg",
-        "-i",
-        input_video_file,
-        "-filter_complex",
-        filter,
-        "-map",
-        "[outv]",
-        "-map",
-        "[outa]",
-        "-avoid_negative_ts",
-        "1",
-        "-y",
-    ]
-
-
-def build_ffmpeg_cmd_with_ss_to():
-    n_filrs = len(filler_words_timings)
-    cmd = ["ffmpeg"]
-    remove_fillers = 0
-    for i in range(1, n_filrs):
-        # stagger the start and end time of the video and audio filters
-        # so that we take the "non-filler" portion of the video
-        start_time = filler_words_timings[i - 1][1]  # end of last filler word
-        end_time = filler_words_timings[i][0]  # start of next filler word
-
-        if start_time >= end_time:
-            remove_fillers += 1
-            continue
-
-        # add the start and end time to the ffmpeg command
-        cmd += [
-            "-ss",
-            str(start_time) + "s",
-            "-to",
-            str(end_time) + "s",
-            "-i",
+def count_encode_bytes():
+    # the encoders read the whole input video and write the output video
+    profiler.add_bytes_read(file_size(input_video_file))
+    profiler.add_bytes_written(file_size(output_video_file))
+
+
+engine = args.engine
+
+if engine == "smartcut" and media["video_codec"] not in SMART_CUT_ENCODERS:
+    print(
+        f"Smart cut does not support {media['video_codec']} video, "
+        "using the select engine instead."
+    )
+    engine = "select"
+
+if engine == "smartcut":
+    print("Removing the filler words from the video...")
+    with profiler.stage("encode"):
+        run_smart_cut(input_video_file, keep_segments, output_video_file, media)
+    count_encode_bytes()
+    print("Done.")
+    exit(0)
+
+if engine == "parallel":
+    threads_per_worker = args.threads_per_worker or max(
+        1, (os.cpu_count() or 1) // args.workers
+    )
+    print("Removing the filler words from the video...")
+    with profiler.stage("encode"):
+        run_parallel_cut(
             input_video_file,
-        ]
-
-    # add the number of filler words to remove
-    print(f"Found {remove_fillers} inconsistent-timing filler words.")
-    n_filrs -= remove_fillers
-
-    # add the concat filter
-    all_inputs = "".join([f"[{i}:v][{i}:a]" for i in range(n_filrs - 1)])
-    filter = f"{all_inputs}concat=n={n_filrs-1}:v=1:a=1[outv][outa]"
-
-    cmd += [
-        "-filter_complex",
-        filter,
-        "-map",
-        "[outv]",
-        "-map",
-        "[outa]",
-        "-avoid_negative_ts",
-        "1",
-        "-y",
-        "-loglevel",
-        "error",
-    ]
-    return cmd
-
+            keep_segments,
+            output_video_file,
+            media,
+            args.workers,
+            threads_per_worker,
+        )
+    count_encode_bytes()
+    print("Done.")
+    exit(0)
 
 # build the ffmpeg command
-ffmpeg_cmd = build_ffmpeg_cmd_with_ss_to()
-
-output_video_file = os.path.splitext(input_video_file)[0] + "_cleaned.mp4"
+filter_script_file = None
+if args.silence == "speedup":
+    filter_script_file = os.path.splitext(input_video_file)[0] + "_cleaned_filter.txt"
+    ffmpeg_cmd = build_ffmpeg_cmd_with_speedup(
+        input_video_file,
+        split_for_speedup(keep_segments, silences, args.silence_speed),
+        filter_script_file,
+        media["frame_rate"],
+        media["sample_rate"],
+    )
+elif engine == "select":
+    filter_script_file = os.path.splitext(input_video_file)[0] + "_cleaned_filter.txt"
+    ffmpeg_cmd = build_ffmpeg_cmd_with_select(
+        input_video_file,
+        keep_segments,
+        filter_script_file,
+        media["frame_rate"],
+        media["sample_rate"],
+    )
+elif engine == "filter":
+    ffmpeg_cmd = build_ffmpeg_cmd_with_filter(input_video_file, keep_segments)
+else:
+    ffmpeg_cmd = build_ffmpeg_cmd_with_ss_to(input_video_file, keep_segments)
 
 # run ffmpeg to remove the filler words
 print("Removing the filler words from the video...")
-subprocess.run([*ffmpeg_cmd, output_video_file])
+with profiler.stage("encode"):
+    subprocess.run([*ffmpeg_cmd, output_video_file])
+count_encode_bytes()
+
+# delete the temporary filter script
+if filter_script_file is not None:
+    os.remove(filter_script_file)
 
 print("Done.")
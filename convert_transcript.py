@@ -0,0 +1,27 @@
+# this script will convert AWS style JSON transcription files to the compact columnar .npz
+# format, which the other scripts load much faster than the JSON file
+#
+# Usage:
+# python convert_transcript.py <input_json_file> [<input_json_file> ...]
+#
+# The output file will be saved next to the input file
+#
+# Example:
+# python convert_transcript.py "input_video.json"
+#
+# The output file will have the name "input_video.npz"
+
+import argparse
+import os
+
+from transcript_utils import load_transcript
+
+parser = argparse.ArgumentParser()
+parser.add_argument("input_json_file", nargs="+", help="input json transcription file")
+args = parser.parse_args()
+
+for input_json_file in args.input_json_file:
+    output_npz_file = os.path.splitext(input_json_file)[0] + ".npz"
+    table = load_transcript(input_json_file)
+    table.save_npz(output_npz_file)
+    print(f"Converted {len(table)} items: {output_npz_file}")
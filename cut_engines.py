@@ -0,0 +1,618 @@
+# ffmpeg command builders ("cut engines") that cut a video down to a list of keep segments
+# every builder takes the input video file and a sorted list of non-overlapping
+# (start, end) keep segments in seconds, and returns the ffmpeg command without the output file
+#
+# Example:
+# from cut_engines import build_ffmpeg_cmd_with_select, probe_media
+# media = probe_media("input_video.mp4")
+# cmd = build_ffmpeg_cmd_with_select(
+#     "input_video.mp4", [(0.0, 10.5), (12.0, 30.0)], "filter.txt",
+#     media["frame_rate"], media["sample_rate"]
+# )
+# subprocess.run([*cmd, "output_video.mp4"])
+
+import bisect
+import json
+import os
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from fractions import Fraction
+
+from profiling_utils import profiler
+
+
+# encoders used to re-encode the cut boundaries in smart cut mode, by source video codec
+SMART_CUT_ENCODERS = {
+    "h264": ["-c:v", "libx264", "-preset", "veryfast", "-crf", "18"],
+    "hevc": ["-c:v", "libx265", "-preset", "veryfast", "-crf", "20"],
+}
+
+# encoders of the batches of the parallel engine: the ones ffmpeg picks for the .mp4 output
+# of the select engine (H.264 and AAC). without them the MPEG-TS muxer of the batches would
+# default to low bitrate MPEG-2 video and MP2 audio, which the concat then copies as is.
+PARALLEL_CUT_ENCODERS = ["-c:v", "libx264", "-c:a", "aac"]
+
+
+@profiler.timed("ffprobe")
+def probe_media(input_file):
+    # get the duration, video codec, frame rate and audio sample rate with a single ffprobe call
+    ffprobe_output = subprocess.check_output(
+        [
+            "ffprobe",
+            "-v",
+            "error",
+            "-show_entries",
+            "format=duration,start_time:"
+            "stream=codec_type,codec_name,pix_fmt,r_frame_rate,sample_rate",
+            "-of",
+            "json",
+            input_file,
+        ]
+    )
+    probe = json.loads(ffprobe_output)
+    media = {
+        "duration": float(probe["format"]["duration"]),
+        "start_time": float(probe["format"].get("start_time", 0.0)),
+        "video_codec": None,
+        "pix_fmt": None,
+        "frame_rate": None,
+        "sample_rate": None,
+    }
+    for stream in probe.get("streams", []):
+        if stream.get("codec_type") == "video" and media["video_codec"] is None:
+            media["video_codec"] = stream.get("codec_name")
+            media["pix_fmt"] = stream.get("pix_fmt")
+            frame_rate = Fraction(stream.get("r_frame_rate", "0/1"))
+            media["frame_rate"] = frame_rate if frame_rate > 0 else None
+        elif stream.get("codec_type") == "audio" and media["sample_rate"] is None:
+            media["sample_rate"] = int(stream.get("sample_rate", 0)) or None
+    return media
+
+
+# build an ffmpeg filter to keep the segments by trimming the single input
+# e.g.
+#      [0:v]trim=start=10:end=20,setpts=PTS-STARTPTS[0v];
+#      [0:a]atrim=start=10:end=20,asetpts=PTS-STARTPTS[0a];
+#      [0:v]trim=start=30:end=40,setpts=PTS-STARTPTS[1v];
+#      [0:a]atrim=start=30:end=40,asetpts=PTS-STARTPTS[1a];
+# and then concatenate the inputs
+#      [0v][0a][1v][1a]concat=n=2:v=1:a=1[outv][outa]
+# the input is decoded once, but every trim branch buffers frames until concat reaches it
+def build_ffmpeg_cmd_with_filter(input_video_file, keep_segments):
+    filter = ""
+    for i, (start_time, end_time) in enumerate(keep_segments):
+        # add the video filter
+        filter += (
+            f"[0:v]trim=start={start_time}:end={end_time},setpts=PTS-STARTPTS[{i}v];"
+        )
+
+        # add the audio filter
+        filter += (
+            f"[0:a]atrim=start={start_time}:end={end_time},asetpts=PTS-STARTPTS[{i}a];"
+        )
+
+    # add the concat filter
+    n_segments = len(keep_segments)
+    all_inputs = "".join([f"[{i}v][{i}a]" for i in range(n_segments)])
+    filter += f"{all_inputs}concat=n={n_segments}:v=1:a=1[outv][outa]"
+
+    return [
+        "ffmpeg",
+        "-i",
+        input_video_file,
+        "-filter_complex",
+        filter,
+        "-map",
+        "[outv]",
+        "-map",
+        "[outa]",
+        "-avoid_negative_ts",
+        "1",
+        "-y",
+    ]
+
+
+# open the input once per keep segment with -ss/-to and concatenate all the inputs
+# ffmpeg opens and demuxes the same file once per segment, all at the same time
+def build_ffmpeg_cmd_with_ss_to(input_video_file, keep_segments):
+    cmd = ["ffmpeg"]
+    for start_time, end_time in keep_segments:
+        # add the start and end time to the ffmpeg command
+        cmd += [
+            "-ss",
+            str(start_time) + "s",
+            "-to",
+            str(end_time) + "s",
+            "-i",
+            input_video_file,
+        ]
+
+    # add the concat filter
+    n_segments = len(keep_segments)
+    all_inputs = "".join([f"[{i}:v][{i}:a]" for i in range(n_segments)])
+    filter = f"{all_inputs}concat=n={n_segments}:v=1:a=1[outv][outa]"
+
+    cmd += [
+        "-filter_complex",
+        filter,
+        "-map",
+        "[outv]",
+        "-map",
+        "[outa]",
+        "-avoid_negative_ts",
+        "1",
+        "-y",
+        "-loglevel",
+        "error",
+    ]
+    return cmd
+
+
+# video frame rate assumed by the speedup engine when it is unknown
+DEFAULT_FRAME_RATE = Fraction(25)
+
+
+def build_speedup_expression(pieces, slot_duration):
+    # an ffmpeg expression that is non-zero for the frames to keep of the (start, end, speed)
+    # pieces: every frame of a normal speed piece, and one frame of every `speed` in a piece
+    # that plays faster. the same balanced binary search over half-open intervals as
+    # build_select_expression().
+    if len(pieces) == 0:
+        return "0"
+    if len(pieces) == 1:
+        start_time, end_time, speed = pieces[0]
+        if speed == 1.0:
+            return f"gte(t,{start_time})*lt(t,{end_time})"
+        # the frames are slot_duration apart and the piece starts half a slot before its first
+        # frame, keep the first frame of every `speed` slots
+        return (
+            f"gte(t,{start_time})*lt(t,{end_time})"
+            f"*lt(mod(t-{start_time},{speed * slot_duration}),{slot_duration})"
+        )
+    mid = len(pieces) // 2
+    return (
+        f"if(lt(t,{pieces[mid][0]}),"
+        f"{build_speedup_expression(pieces[:mid], slot_duration)},"
+        f"{build_speedup_expression(pieces[mid:], slot_duration)})"
+    )
+
+
+# keep the (start, end, speed) pieces of the input and play some of them faster, e.g. to
+# shorten the silences instead of removing them. this is the select engine with a different
+# expression: the audio is cut in frames as long as a video frame, and a piece that plays
+# `speed` times faster keeps only one of every `speed` video frames and the matching audio
+# frames, so the pitch does not change and the audio and the video stay in sync.
+# the input is decoded once and the filter graph does not grow a branch per piece.
+def build_ffmpeg_cmd_with_speedup(
+    input_video_file,
+    pieces,
+    filter_script_file,
+    frame_rate=None,
+    sample_rate=None,
+):
+    frame_rate = frame_rate or DEFAULT_FRAME_RATE
+    slot_duration = float(1 / frame_rate)
+    snapped_pieces = snap_to_frames(pieces, frame_rate)
+
+    audio_filters = ""
+    if sample_rate is not None:
+        audio_filters = f"asetnsamples=n={round(sample_rate / frame_rate)},"
+
+    expression = build_speedup_expression(snapped_pieces, slot_duration)
+    filter = (
+        f"[0:v]select='{expression}',setpts=N/FRAME_RATE/TB[outv];\n"
+        f"[0:a]{audio_filters}aselect='{expression}',asetpts=N/SR/TB[outa]\n"
+    )
+    with open(filter_script_file, "w") as f:
+        f.write(filter)
+
+    return [
+        "ffmpeg",
+        "-i",
+        input_video_file,
+        "-filter_complex_script",
+        filter_script_file,
+        "-map",
+        "[outv]",
+        "-map",
+        "[outa]",
+        "-y",
+        "-loglevel",
+        "error",
+    ]
+
+
+def build_select_expression(keep_segments):
+    # an ffmpeg expression that is non-zero when `t` is inside one of the keep segments
+    # the segments are half-open, a frame exactly on the end of a segment is not kept
+    # it is a balanced binary search over the sorted segments: ffmpeg only evaluates the
+    # taken branch of if(), so every frame costs O(log n) comparisons instead of O(n)
+    if len(keep_segments) == 0:
+        return "0"
+    if len(keep_segments) == 1:
+        start_time, end_time = keep_segments[0]
+        return f"gte(t,{start_time})*lt(t,{end_time})"
+    mid = len(keep_segments) // 2
+    return (
+        f"if(lt(t,{keep_segments[mid][0]}),"
+        f"{build_select_expression(keep_segments[:mid])},"
+        f"{build_select_expression(keep_segments[mid:])})"
+    )
+
+
+def snap_to_frames(keep_segments, frame_rate):
+    # move the segment boundaries onto the video frame grid, then half a frame earlier: a
+    # half-open segment then keeps exactly the frames from the one on its snapped start to the
+    # one before its snapped end, whatever the rounding of the frame timestamps, so the video
+    # keeps the duration of the segment and does not drift from the audio cut by cut.
+    # anything after the start and end times (e.g. a speed) is kept as is.
+    half_frame = float(1 / frame_rate / 2)
+    snapped_segments = []
+    for start_time, end_time, *rest in keep_segments:
+        start_time = float(round(start_time * frame_rate) / frame_rate)
+        end_time = float(round(end_time * frame_rate) / frame_rate)
+        if start_time < end_time:
+            snapped_segments.append(
+                (start_time - half_frame, end_time - half_frame, *rest)
+            )
+    return snapped_segments
+
+
+# decode the input once and keep only the frames inside the keep segments with the
+# select/aselect filters, the timestamps are then regenerated to close the gaps.
+# the filter graph is written to `filter_script_file` (-filter_complex_script) so the command
+# line stays short, and memory use does not grow with the number of segments.
+def build_ffmpeg_cmd_with_select(
+    input_video_file,
+    keep_segments,
+    filter_script_file,
+    frame_rate=None,
+    sample_rate=None,
+):
+    audio_filters = ""
+    if frame_rate is not None:
+        keep_segments = snap_to_frames(keep_segments, frame_rate)
+        if sample_rate is not None:
+            # make the audio frames as long as a video frame, so that aselect cuts the audio
+            # with the same granularity as select cuts the video
+            audio_filters = f"asetnsamples=n={round(sample_rate / frame_rate)},"
+
+    expression = build_select_expression(keep_segments)
+    filter = (
+        f"[0:v]select='{expression}',setpts=N/FRAME_RATE/TB[outv];\n"
+        f"[0:a]{audio_filters}aselect='{expression}',asetpts=N/SR/TB[outa]\n"
+    )
+    with open(filter_script_file, "w") as f:
+        f.write(filter)
+
+    return [
+        "ffmpeg",
+        "-i",
+        input_video_file,
+        "-filter_complex_script",
+        filter_script_file,
+        "-map",
+        "[outv]",
+        "-map",
+        "[outa]",
+        "-y",
+        "-loglevel",
+        "error",
+    ]
+
+
+@profiler.timed("ffprobe_keyframes")
+def probe_keyframes(input_file, start_time=0.0):
+    # get the times of all the video keyframes, relative to the start of the file
+    # only the packet headers are read, nothing is decoded
+    ffprobe_output = subprocess.check_output(
+        [
+            "ffprobe",
+            "-v",
+            "error",
+            "-select_streams",
+            "v:0",
+            "-show_entries",
+            "packet=pts_time,flags",
+            "-of",
+            "csv=p=0",
+            input_file,
+        ]
+    )
+    keyframes = []
+    for line in ffprobe_output.decode("utf-8").splitlines():
+        pts_time, _, flags = line.partition(",")
+        if "K" in flags and pts_time not in ("", "N/A"):
+            keyframes.append(float(pts_time) - start_time)
+    keyframes.sort()
+    return keyframes
+
+
+def plan_smart_cut(keep_segments, keyframes, tolerance=0.001):
+    # split every keep segment into ("encode" | "copy", start, end) pieces: the whole GOPs
+    # inside the segment are stream-copied from keyframe to keyframe, and only the partial
+    # GOPs before the first and after the last keyframe of the segment are re-encoded.
+    # boundaries within `tolerance` of a keyframe snap to it instead of creating a sliver.
+    pieces = []
+    for start_time, end_time in keep_segments:
+        i = bisect.bisect_left(keyframes, start_time - tolerance)
+        j = bisect.bisect_right(keyframes, end_time + tolerance) - 1
+        if i >= len(keyframes) or j <= i:
+            # less than one whole GOP in this segment
+            pieces.append(("encode", start_time, end_time))
+            continue
+
+        first_keyframe = keyframes[i]
+        last_keyframe = keyframes[j]
+        if first_keyframe - start_time > tolerance:
+            pieces.append(("encode", start_time, first_keyframe))
+        pieces.append(("copy", first_keyframe, last_keyframe))
+        if end_time - last_keyframe > tolerance:
+            pieces.append(("encode", last_keyframe, end_time))
+    return pieces
+
+
+def build_ffmpeg_cmd_for_piece(input_video_file, piece, piece_file, media):
+    # cut a single smart cut piece (video only) to an MPEG-TS file, which keeps the codec
+    # parameters in-band so that copied and re-encoded pieces can be concatenated
+    kind, start_time, end_time = piece
+    if kind == "copy":
+        # seek a hair past the keyframe, input seeking lands on the keyframe before it
+        return [
+            "ffmpeg",
+            "-ss",
+            str(start_time + 0.0005),
+            "-i",
+            input_video_file,
+            "-t",
+            str(end_time - start_time),
+            "-map",
+            "0:v:0",
+            "-c:v",
+            "copy",
+            "-an",
+            "-f",
+            "mpegts",
+            "-y",
+            "-loglevel",
+            "error",
+            piece_file,
+        ]
+    return [
+        "ffmpeg",
+        "-ss",
+        str(start_time),
+        "-i",
+        input_video_file,
+        "-t",
+        str(end_time - start_time),
+        "-map",
+        "0:v:0",
+        *SMART_CUT_ENCODERS[media["video_codec"]],
+        "-pix_fmt",
+        media["pix_fmt"],
+        "-an",
+        "-f",
+        "mpegts",
+        "-y",
+        "-loglevel",
+        "error",
+        piece_file,
+    ]
+
+
+def build_ffmpeg_cmd_for_audio(input_video_file, keep_segments, filter_script_file):
+    # cut the audio of all the keep segments in one pass with aselect
+    # re-encoding the audio is cheap compared to the video. small audio frames (~5ms) keep the
+    # cuts close to the video ones.
+    expression = build_select_expression(keep_segments)
+    with open(filter_script_file, "w") as f:
+        f.write(f"[0:a]asetnsamples=n=256,aselect='{expression}',asetpts=N/SR/TB[outa]\n")
+    return [
+        "ffmpeg",
+        "-i",
+        input_video_file,
+        "-filter_complex_script",
+        filter_script_file,
+        "-map",
+        "[outa]",
+        "-vn",
+        "-c:a",
+        "aac",
+        "-b:a",
+        "192k",
+        "-y",
+        "-loglevel",
+        "error",
+    ]
+
+
+def write_concat_list(concat_list_file, piece_files):
+    # list file for the ffmpeg concat demuxer
+    with open(concat_list_file, "w") as f:
+        for piece_file in piece_files:
+            escaped_path = os.path.abspath(piece_file).replace("'", "'\\''")
+            f.write(f"file '{escaped_path}'\n")
+
+
+def build_ffmpeg_cmd_concat(concat_list_file, audio_file=None):
+    # join the pieces losslessly, and mux the audio next to them if it was cut separately
+    cmd = ["ffmpeg", "-f", "concat", "-safe", "0", "-i", concat_list_file]
+    if audio_file is not None:
+        cmd += ["-i", audio_file, "-map", "0:v", "-map", "1:a"]
+    return [*cmd, "-c", "copy", "-y", "-loglevel", "error"]
+
+
+# "smart cut": stream-copy every GOP that lies fully inside a keep segment, re-encode only the
+# partial GOPs at the cut points, and join the pieces with the concat demuxer.
+# this is much faster than re-encoding the whole video when the cuts are sparse.
+# `media` is the output of probe_media(), the source codec must be in SMART_CUT_ENCODERS.
+def run_smart_cut(input_video_file, keep_segments, output_video_file, media):
+    keyframes = probe_keyframes(input_video_file, media["start_time"])
+    tolerance = float(1 / media["frame_rate"]) / 2 if media["frame_rate"] else 0.001
+    pieces = plan_smart_cut(keep_segments, keyframes, tolerance)
+    copied_duration = sum(end - start for kind, start, end in pieces if kind == "copy")
+    total_duration = sum(end - start for _, start, end in pieces)
+    print(
+        f"Smart cut: {len(pieces)} pieces, {copied_duration:.1f}s of "
+        f"{total_duration:.1f}s stream-copied."
+    )
+
+    # keep the pieces next to the output video, they can be large
+    with tempfile.TemporaryDirectory(
+        dir=os.path.dirname(os.path.abspath(output_video_file))
+    ) as temp_dir:
+        piece_files = []
+        for i, piece in enumerate(pieces):
+            piece_file = os.path.join(temp_dir, f"piece_{i:06d}.ts")
+            subprocess.run(
+                build_ffmpeg_cmd_for_piece(input_video_file, piece, piece_file, media),
+                check=True,
+            )
+            piece_files.append(piece_file)
+
+        audio_file = os.path.join(temp_dir, "audio.m4a")
+        subprocess.run(
+            [
+                *build_ffmpeg_cmd_for_audio(
+                    input_video_file,
+                    keep_segments,
+                    os.path.join(temp_dir, "audio_filter.txt"),
+                ),
+                audio_file,
+            ],
+            check=True,
+        )
+
+        concat_list_file = os.path.join(temp_dir, "concat.txt")
+        write_concat_list(concat_list_file, piece_files)
+        subprocess.run(
+            [*build_ffmpeg_cmd_concat(concat_list_file, audio_file), output_video_file],
+            check=True,
+        )
+
+
+def group_into_batches(keep_segments, n_batches, frame_rate=None):
+    # group the keep segments into n_batches of roughly equal kept duration
+    # a segment that crosses a batch boundary is split there, on the video frame grid if the
+    # frame rate is known: the select segments are half-open, so the frame on the split goes
+    # to the later batch only and no frame is lost or duplicated between two batches
+    total_duration = sum(end - start for start, end in keep_segments)
+    target_duration = total_duration / max(1, n_batches)
+    batches = []
+    batch = []
+    batch_duration = 0.0
+    for start_time, end_time in keep_segments:
+        while (
+            len(batches) < n_batches - 1
+            and batch_duration + (end_time - start_time) > target_duration
+        ):
+            split_time = start_time + (target_duration - batch_duration)
+            if frame_rate is not None:
+                split_time = float(round(split_time * frame_rate) / frame_rate)
+            if start_time < split_time < end_time:
+                batch.append((start_time, split_time))
+                start_time = split_time
+            batches.append(batch)
+            batch = []
+            batch_duration = 0.0
+        batch.append((start_time, end_time))
+        batch_duration += end_time - start_time
+    if len(batch) > 0:
+        batches.append(batch)
+    return [batch for batch in batches if len(batch) > 0]
+
+
+def run_ffmpeg_with_progress(cmd, label, duration):
+    # run ffmpeg with machine readable progress on stdout and print every 10% of `duration`
+    process = subprocess.Popen(
+        [*cmd[:-1], "-progress", "pipe:1", "-nostats", cmd[-1]],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    last_reported = -1
+    for line in process.stdout:
+        key, _, value = line.strip().partition("=")
+        if key == "out_time_us" and value.isdigit() and duration > 0:
+            percent = min(100, int(int(value) / 1e6 / duration * 100))
+            if percent // 10 > last_reported:
+                last_reported = percent // 10
+                print(f"{label}: {percent}%")
+    process.stdout.close()
+    if process.wait() != 0:
+        raise subprocess.CalledProcessError(process.returncode, cmd)
+    print(f"{label}: done")
+
+
+# encode the keep segments in `workers` ffmpeg processes at once, each one seeking to its own
+# batch of segments and cutting it with the select engine, then join the encoded batches
+# losslessly with the concat demuxer. each ffmpeg uses `threads_per_worker` threads, so the
+# machine is best saturated with workers * threads_per_worker ~ number of cores.
+def run_parallel_cut(
+    input_video_file,
+    keep_segments,
+    output_video_file,
+    media,
+    workers,
+    threads_per_worker=0,
+):
+    batches = group_into_batches(keep_segments, workers, media["frame_rate"])
+    print(f"Encoding {len(batches)} batches with {workers} workers...")
+
+    # keep the batches next to the output video, they can be large
+    with tempfile.TemporaryDirectory(
+        dir=os.path.dirname(os.path.abspath(output_video_file))
+    ) as temp_dir:
+
+        def encode_batch(i):
+            batch = batches[i]
+            batch_start = batch[0][0]
+            batch_end = batch[-1][1]
+            if media["frame_rate"] is not None:
+                # seek to a frame, so the shifted segments snap to the same frame grid
+                frame_rate = media["frame_rate"]
+                batch_start = float(round(batch_start * frame_rate) / frame_rate)
+                batch_end = float(round(batch_end * frame_rate) / frame_rate)
+            # with -ss on the input the timestamps restart at 0, shift the segments too
+            shifted_segments = [
+                (start - batch_start, end - batch_start) for start, end in batch
+            ]
+            cmd = build_ffmpeg_cmd_with_select(
+                input_video_file,
+                shifted_segments,
+                os.path.join(temp_dir, f"batch_{i:04d}_filter.txt"),
+                media["frame_rate"],
+                media["sample_rate"],
+            )
+            batch_file = os.path.join(temp_dir, f"batch_{i:04d}.ts")
+            cmd = [
+                cmd[0],
+                "-ss",
+                str(batch_start),
+                "-to",
+                str(batch_end),
+                *cmd[1:],
+                *PARALLEL_CUT_ENCODERS,
+                "-threads",
+                str(threads_per_worker),
+                "-f",
+                "mpegts",
+                batch_file,
+            ]
+            run_ffmpeg_with_progress(
+                cmd,
+                f"batch {i + 1}/{len(batches)}",
+                sum(end - start for start, end in batch),
+            )
+            return batch_file
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            batch_files = list(executor.map(encode_batch, range(len(batches))))
+
+        concat_list_file = os.path.join(temp_dir, "concat.txt")
+        write_concat_list(concat_list_file, batch_files)
+        subprocess.run(
+            [*build_ffmpeg_cmd_concat(concat_list_file), output_video_file],
+            check=True,
+        )
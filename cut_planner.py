@@ -0,0 +1,159 @@
+# plan which parts of a video to keep, from the time ranges that should be removed
+# (filler words, silences, ...). the output is a sorted list of (start, end) keep segments that
+# any of the cut engines in cut_engines.py can consume.
+#
+# Example:
+# from cut_planner import find_filler_ranges, plan_cuts
+# remove_ranges = find_filler_ranges(contents, start_times, end_times, ["um", "uh"])
+# keep_segments = plan_cuts(remove_ranges, video_duration, pre_padding=0.05, min_keep=0.1)
+
+import bisect
+
+import numpy as np
+
+
+# a set of disjoint time intervals, kept as two sorted arrays of starts and ends
+class IntervalSet:
+    __slots__ = ("starts", "ends")
+
+    def __init__(self, starts=(), ends=()):
+        self.starts = list(starts)
+        self.ends = list(ends)
+
+    @classmethod
+    def from_ranges(cls, ranges, merge_gap=0.0):
+        # sort the ranges and merge the overlapping ones, and the ones that are less than
+        # merge_gap apart, in O(n log n)
+        starts = []
+        ends = []
+        for start, end in sorted(ranges):
+            if end <= start:
+                continue
+            if len(ends) > 0 and start <= ends[-1] + merge_gap:
+                ends[-1] = max(ends[-1], end)
+            else:
+                starts.append(start)
+                ends.append(end)
+        return cls(starts, ends)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __iter__(self):
+        return zip(self.starts, self.ends)
+
+    def union(self, other, merge_gap=0.0):
+        return IntervalSet.from_ranges([*self, *other], merge_gap)
+
+    def contains(self, t):
+        # is `t` inside one of the intervals, in O(log n)
+        i = bisect.bisect_right(self.starts, t) - 1
+        return i >= 0 and t < self.ends[i]
+
+    def overlapping(self, start, end):
+        # the intervals that overlap [start, end), in O(log n + k)
+        i = max(0, bisect.bisect_right(self.ends, start))
+        j = bisect.bisect_left(self.starts, end)
+        return list(zip(self.starts[i:j], self.ends[i:j]))
+
+    def total_duration(self):
+        return sum(end - start for start, end in self)
+
+    def complement(self, start, end):
+        # the gaps between the intervals, within [start, end)
+        gaps = []
+        position = start
+        for interval_start, interval_end in self.overlapping(start, end):
+            if interval_start > position:
+                gaps.append((position, interval_start))
+            position = max(position, interval_end)
+        if position < end:
+            gaps.append((position, end))
+        return IntervalSet([gap[0] for gap in gaps], [gap[1] for gap in gaps])
+
+
+def find_filler_ranges(
+    contents, start_times, end_times, filler_words, min_duration=0.3
+):
+    # find the time ranges of the filler words among the pronunciations
+    # consecutive filler words are merged into a single range, which lasts at least
+    # min_duration and extends to the start of the next word if that is farther ahead.
+    # the last word is never removed.
+    # contents, start_times and end_times are the pronunciation columns of a WordTable.
+    filler_words = set(filler_words)
+    is_filler = np.array(
+        [content.lower() in filler_words for content in contents], dtype=bool
+    )
+    if len(is_filler) < 2:
+        return []
+
+    # find the runs of consecutive filler words
+    previous_is_filler = np.concatenate(([False], is_filler[:-1]))
+    next_is_filler = np.concatenate((is_filler[1:], [False]))
+    run_starts = np.flatnonzero(is_filler & ~previous_is_filler)
+    run_ends = np.flatnonzero(is_filler & ~next_is_filler)
+    keep_runs = run_ends < len(is_filler) - 1
+    run_starts = run_starts[keep_runs]
+    run_ends = run_ends[keep_runs]
+
+    start_times = np.asarray(start_times, dtype=np.float64)
+    end_times = np.asarray(end_times, dtype=np.float64)
+    starts = start_times[run_starts]
+    ends = np.maximum(end_times[run_ends], starts + min_duration)
+    ends = np.maximum(ends, start_times[run_ends + 1])
+    return list(zip(starts.tolist(), ends.tolist()))
+
+
+def plan_cuts(
+    remove_ranges,
+    duration,
+    pre_padding=0.0,
+    post_padding=0.0,
+    min_keep=0.0,
+    merge_gap=0.0,
+):
+    # turn the ranges to remove into the sorted list of (start, end) segments to keep
+    # - every range is extended by pre_padding before and post_padding after it (negative
+    #   values keep more of the audio around the cut instead)
+    # - overlapping and adjacent ranges (closer than merge_gap) are merged
+    # - kept slivers shorter than min_keep are removed too, they would only add tiny
+    #   segments to the cut
+    padded_ranges = []
+    for start, end in remove_ranges:
+        start = max(0.0, start - pre_padding)
+        end = min(duration, end + post_padding)
+        if start < end:
+            padded_ranges.append((start, end))
+    remove_set = IntervalSet.from_ranges(padded_ranges, merge_gap)
+
+    keep_set = remove_set.complement(0.0, duration)
+    return [(start, end) for start, end in keep_set if end - start >= min_keep]
+
+
+def shrink_ranges(ranges, margin):
+    # leave `margin` seconds at both ends of every range, e.g. to keep a short natural pause
+    # when a silence is removed
+    return [
+        (start + margin, end - margin)
+        for start, end in ranges
+        if end - start > 2 * margin
+    ]
+
+
+def split_for_speedup(keep_segments, speedup_ranges, speed):
+    # split the keep segments into (start, end, speed) pieces, where the parts that overlap
+    # speedup_ranges (e.g. silences) play at `speed` and everything else at normal speed
+    speedup_set = IntervalSet.from_ranges(speedup_ranges)
+    pieces = []
+    for start, end in keep_segments:
+        position = start
+        for speedup_start, speedup_end in speedup_set.overlapping(start, end):
+            speedup_start = max(speedup_start, start)
+            speedup_end = min(speedup_end, end)
+            if speedup_start > position:
+                pieces.append((position, speedup_start, 1.0))
+            pieces.append((speedup_start, speedup_end, speed))
+            position = speedup_end
+        if position < end:
+            pieces.append((position, end, 1.0))
+    return pieces
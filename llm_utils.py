@@ -0,0 +1,265 @@
+# helpers to send transcripts of any length to a chat completion API (OpenAI or any server
+# with the same /chat/completions endpoint, e.g. stub_llm_server.py for offline tests)
+#
+# Long transcripts are summarized map-reduce style: the lines (sentences) are split into
+# windows that fit the token budget of one request, every window is summarized on its own
+# (concurrently), and the partial results are then reduced to the final answer, in as many
+# rounds as needed. A transcript that fits in one request is sent as is.
+#
+# With a DiskCache, the answers are cached on disk keyed by a hash of the API URL, the model,
+# the messages and the other request parameters, so re-running on an unchanged transcript (or
+# on the unchanged windows of an edited one) does not send those requests again.
+#
+# Example:
+# from llm_utils import ChatClient, map_reduce
+# async with ChatClient("https://api.openai.com/v1", api_key, max_concurrency=4) as client:
+#     summary = await map_reduce(
+#         client, "gpt-3.5-turbo", sentences, "write a summary of the video.\n",
+#         "write a short summary of this part of the video.\n", max_prompt_tokens=3000,
+#     )
+
+import asyncio
+import random
+import re
+
+import aiohttp
+
+from cache_utils import DEFAULT_CACHE_DIR, make_cache_key
+from profiling_utils import profiler
+
+# the exact tokenizer of the OpenAI models, if it is installed
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+DEFAULT_API_BASE = "https://api.openai.com/v1"
+
+# next to the transcript cache rather than inside it: a DiskCache evicts everything under its
+# directory, so the two caches would count (and evict) each other's entries
+DEFAULT_LLM_CACHE_DIR = DEFAULT_CACHE_DIR + "-llm"
+# 100 MB
+DEFAULT_LLM_CACHE_MAX_BYTES = 100 * 1024 * 1024
+
+# size of the context window (prompt and answer) of the models, in tokens
+MODEL_CONTEXT_TOKENS = {
+    "gpt-3.5-turbo": 4096,
+    "gpt-3.5-turbo-16k": 16384,
+}
+DEFAULT_CONTEXT_TOKENS = 4096
+
+# without tiktoken, words are counted in pieces of up to 4 characters and every punctuation
+# mark as one token, which overestimates the tokens of English text a little, so the
+# windows always fit
+APPROXIMATE_TOKEN_PATTERN = re.compile(r"\w{1,4}|[^\w\s]")
+
+TRANSCRIPT_HEADERS = (
+    "transcript for the video:\n",
+    "part {part} of {n_parts} of the transcript for the video:\n",
+)
+NOTES_HEADERS = (
+    "notes on consecutive parts of the video:\n",
+    "part {part} of {n_parts} of the notes on the video:\n",
+)
+
+# retry rate limits and server errors
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def get_encoding(model):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text, model=None):
+    if tiktoken is not None:
+        return len(get_encoding(model).encode(text))
+    return len(APPROXIMATE_TOKEN_PATTERN.findall(text))
+
+
+def truncate_to_tokens(text, max_tokens, model=None):
+    if tiktoken is not None:
+        encoding = get_encoding(model)
+        return encoding.decode(encoding.encode(text)[:max_tokens])
+    for i, match in enumerate(APPROXIMATE_TOKEN_PATTERN.finditer(text)):
+        if i == max_tokens:
+            return text[: match.start()]
+    return text
+
+
+def get_max_prompt_tokens(model, max_output_tokens):
+    # what is left of the context window once the answer has its room
+    return MODEL_CONTEXT_TOKENS.get(model, DEFAULT_CONTEXT_TOKENS) - max_output_tokens
+
+
+def build_prompt(header, lines, instruction):
+    prompt = header
+    prompt += "---\n"
+    for line in lines:
+        prompt += f"{line}\n"
+    prompt += "---\n"
+    prompt += instruction
+    return prompt
+
+
+def split_into_windows(lines, max_tokens, model=None):
+    # greedily pack consecutive lines into windows of at most max_tokens tokens, a window
+    # only ends between two lines. a single line longer than max_tokens is truncated.
+    windows = []
+    window = []
+    window_tokens = 0
+    for line in lines:
+        # every line is followed by a newline
+        line_tokens = count_tokens(line, model) + 1
+        if line_tokens > max_tokens:
+            line = truncate_to_tokens(line, max_tokens - 1, model)
+            line_tokens = max_tokens
+        if len(window) > 0 and window_tokens + line_tokens > max_tokens:
+            windows.append(window)
+            window = []
+            window_tokens = 0
+        window.append(line)
+        window_tokens += line_tokens
+    if len(window) > 0:
+        windows.append(window)
+    return windows
+
+
+class ChatClient:
+    # an async chat completion client: one pooled HTTP session, at most max_concurrency
+    # requests at once, and retries with exponential backoff for rate limits and server errors.
+    # the answers are read from and written to `cache` (a DiskCache), unless `refresh` is set,
+    # in which case they are only written.
+    def __init__(
+        self,
+        api_base,
+        api_key,
+        max_concurrency=4,
+        max_output_tokens=None,
+        print_prompts=False,
+        attempts=5,
+        cache=None,
+        refresh=False,
+    ):
+        self.url = api_base.rstrip("/") + "/chat/completions"
+        self.api_key = api_key
+        self.max_concurrency = max_concurrency
+        self.max_output_tokens = max_output_tokens
+        self.print_prompts = print_prompts
+        self.attempts = attempts
+        self.cache = cache
+        self.refresh = refresh
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.session = None
+
+    async def __aenter__(self):
+        headers = {}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        self.session = aiohttp.ClientSession(
+            headers=headers,
+            connector=aiohttp.TCPConnector(limit=self.max_concurrency),
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    async def complete(self, model, prompt):
+        # send a single user prompt, returns the text of the answer
+        if self.print_prompts:
+            print(prompt)
+        request = {"model": model, "messages": [{"role": "user", "content": prompt}]}
+        if self.max_output_tokens:
+            request["max_tokens"] = self.max_output_tokens
+
+        cache_key = None
+        if self.cache is not None:
+            # the URL keeps the answers of different servers (e.g. a stub) apart
+            cache_key = make_cache_key(url=self.url, **request)
+            if not self.refresh:
+                content = self.cache.get(cache_key)
+                if content is not None:
+                    return content
+
+        async with self.semaphore:
+            with profiler.stage("llm_request"):
+                response = await self.post(request)
+        content = response["choices"][0]["message"]["content"]
+        if cache_key is not None:
+            self.cache.put(cache_key, content)
+        return content
+
+    async def post(self, request):
+        for attempt in range(self.attempts):
+            try:
+                async with self.session.post(self.url, json=request) as response:
+                    if response.status not in RETRY_STATUSES:
+                        if response.status >= 400:
+                            raise RuntimeError(
+                                f"chat completion request failed ({response.status}): "
+                                f"{await response.text()}"
+                            )
+                        return await response.json()
+                    error = f"HTTP {response.status}"
+            except aiohttp.ClientError as e:
+                error = str(e)
+            if attempt == self.attempts - 1:
+                raise RuntimeError(f"chat completion request failed: {error}")
+            delay = 2**attempt * random.uniform(0.5, 1.0)
+            print(f"Error {error}, retrying in {delay:.1f} seconds...")
+            await asyncio.sleep(delay)
+
+
+async def map_reduce(
+    client, model, lines, instruction, map_instruction, max_prompt_tokens
+):
+    # answer `instruction` about the transcript `lines`, in a single request if they fit in
+    # max_prompt_tokens, otherwise by applying `map_instruction` to windows of the lines
+    # (concurrently) and then `instruction` to the partial results. the partial results are
+    # reduced the same way if they do not fit in a single request either.
+    headers = TRANSCRIPT_HEADERS
+    while True:
+        prompt = build_prompt(headers[0], lines, instruction)
+        if count_tokens(prompt, model) <= max_prompt_tokens:
+            return await client.complete(model, prompt)
+
+        # the room left for the lines in a request about one window
+        part_header = headers[1].format(part=len(lines), n_parts=len(lines))
+        window_tokens = max_prompt_tokens - count_tokens(
+            build_prompt(part_header, [], map_instruction), model
+        )
+        if window_tokens <= 0:
+            raise ValueError("the token budget is too small for the prompt")
+        windows = split_into_windows(lines, window_tokens, model)
+        if headers is NOTES_HEADERS and len(windows) == len(lines):
+            # every note needs a window of its own, another round would not shrink them
+            raise ValueError(
+                "the token budget is too small to combine the partial results, "
+                "allow more prompt tokens or fewer output tokens"
+            )
+
+        print(f"Splitting into {len(windows)} parts of at most {window_tokens} tokens...")
+        tasks = [
+            asyncio.ensure_future(
+                client.complete(
+                    model,
+                    build_prompt(
+                        headers[1].format(part=i + 1, n_parts=len(windows)),
+                        window,
+                        map_instruction,
+                    ),
+                )
+            )
+            for i, window in enumerate(windows)
+        ]
+        try:
+            lines = await asyncio.gather(*tasks)
+        except BaseException:
+            # do not leave the other requests running once one of them failed
+            for task in tasks:
+                task.cancel()
+            raise
+        headers = NOTES_HEADERS
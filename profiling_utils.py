@@ -0,0 +1,251 @@
+# shared timing and resource instrumentation for the scripts: named stage timers, peak RSS,
+# bytes read/written, the seconds of audio processed and event counters (e.g. cache hits),
+# reported as JSON (and optionally in the Prometheus text format) when the script exits
+#
+# Example:
+# from profiling_utils import add_profiling_arguments, profiler, start_profiling
+# add_profiling_arguments(parser)
+# args = parser.parse_args()
+# start_profiling(args, "clean_video")
+# with profiler.stage("ffprobe"):
+#     media = probe_media(input_video_file)
+# profiler.add_audio_seconds(media["duration"])
+#
+# Command line options added to every script:
+#   --report report.json       write the JSON report
+#   --prometheus metrics.prom  write the metrics in the Prometheus text format (e.g. for the
+#                              textfile collector of the node exporter)
+#   --profile profile.pstats   run the script under cProfile, save the stats (for pstats or
+#                              snakeviz) and print the slowest functions
+#
+# Stages may nest and may run concurrently (threads, asyncio tasks), their time is wall-clock
+# time and concurrent stages are all counted, so the stage times can add up to more than the
+# wall time of the run.
+
+import atexit
+import cProfile
+import functools
+import json
+import os
+import pstats
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+METRIC_PREFIX = "video_transcript_helper"
+
+
+def get_peak_rss_bytes(who=resource.RUSAGE_SELF):
+    # ru_maxrss is in bytes on macOS and in kilobytes everywhere else
+    peak = resource.getrusage(who).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def file_size(path):
+    # size of a file, or 0 if it does not exist (e.g. a failed output)
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+class Profiler:
+    def __init__(self, script=None):
+        self.lock = threading.Lock()
+        self.reset(script)
+
+    def reset(self, script):
+        self.script = script
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.start_cpu = time.process_time()
+        self.stages = {}
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.audio_seconds = 0.0
+        self.counters = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage_seconds(name, time.perf_counter() - start)
+
+    def timed(self, name):
+        # decorator that times every call of a function as the stage `name`
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def add_stage_seconds(self, name, seconds):
+        with self.lock:
+            stage = self.stages.setdefault(name, {"seconds": 0.0, "calls": 0})
+            stage["seconds"] += seconds
+            stage["calls"] += 1
+
+    def add_bytes_read(self, n_bytes):
+        with self.lock:
+            self.bytes_read += n_bytes
+
+    def add_bytes_written(self, n_bytes):
+        with self.lock:
+            self.bytes_written += n_bytes
+
+    def add_audio_seconds(self, seconds):
+        with self.lock:
+            self.audio_seconds += seconds
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def report(self):
+        wall_seconds = time.perf_counter() - self.start
+        children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        with self.lock:
+            stages = {name: dict(stage) for name, stage in self.stages.items()}
+            return {
+                "script": self.script,
+                "started_at": time.strftime(
+                    "%Y-%m-%dT%H:%M:%S%z", time.localtime(self.started_at)
+                ),
+                "wall_seconds": wall_seconds,
+                "cpu_seconds": time.process_time() - self.start_cpu,
+                # ffmpeg, ffprobe and the worker processes
+                "children_cpu_seconds": children_usage.ru_utime
+                + children_usage.ru_stime,
+                "peak_rss_bytes": get_peak_rss_bytes(),
+                # the largest of the finished child processes, not their sum
+                "peak_children_rss_bytes": get_peak_rss_bytes(resource.RUSAGE_CHILDREN),
+                "bytes_read": self.bytes_read,
+                "bytes_written": self.bytes_written,
+                "audio_seconds": self.audio_seconds,
+                "realtime_factor": wall_seconds / self.audio_seconds
+                if self.audio_seconds > 0
+                else None,
+                "stages": stages,
+                "counters": dict(self.counters),
+            }
+
+    def prometheus_text(self, report=None):
+        report = report or self.report()
+        labels = f'script="{report["script"]}"'
+        metrics = [
+            ("wall_seconds", "gauge", "wall-clock time of the run", "wall_seconds"),
+            ("cpu_seconds", "gauge", "CPU time of the script", "cpu_seconds"),
+            (
+                "children_cpu_seconds",
+                "gauge",
+                "CPU time of the child processes",
+                "children_cpu_seconds",
+            ),
+            ("peak_rss_bytes", "gauge", "peak resident memory", "peak_rss_bytes"),
+            (
+                "peak_children_rss_bytes",
+                "gauge",
+                "peak resident memory of the largest child process",
+                "peak_children_rss_bytes",
+            ),
+            ("read_bytes_total", "counter", "bytes read", "bytes_read"),
+            ("written_bytes_total", "counter", "bytes written", "bytes_written"),
+            (
+                "audio_seconds_total",
+                "counter",
+                "seconds of audio processed",
+                "audio_seconds",
+            ),
+        ]
+        lines = []
+        for name, metric_type, help_text, key in metrics:
+            lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} {metric_type}")
+            lines.append(f"{METRIC_PREFIX}_{name}{{{labels}}} {report[key]}")
+
+        for name, metric_type, help_text, key in [
+            ("stage_seconds_total", "counter", "time spent in each stage", "seconds"),
+            ("stage_calls_total", "counter", "times each stage ran", "calls"),
+        ]:
+            lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} {metric_type}")
+            for stage, values in report["stages"].items():
+                lines.append(
+                    f'{METRIC_PREFIX}_{name}{{{labels},stage="{stage}"}} {values[key]}'
+                )
+        lines.append(f"# HELP {METRIC_PREFIX}_events_total events such as cache hits")
+        lines.append(f"# TYPE {METRIC_PREFIX}_events_total counter")
+        for event, value in report["counters"].items():
+            lines.append(
+                f'{METRIC_PREFIX}_events_total{{{labels},event="{event}"}} {value}'
+            )
+        return "\n".join(lines) + "\n"
+
+    def print_stages(self, report=None, file=sys.stderr):
+        report = report or self.report()
+        print(
+            f"Profile: {report['wall_seconds']:.1f}s wall, "
+            f"{report['cpu_seconds']:.1f}s CPU, "
+            f"peak RSS {report['peak_rss_bytes'] / 1024 / 1024:.0f} MB",
+            file=file,
+        )
+        stages = sorted(
+            report["stages"].items(), key=lambda item: item[1]["seconds"], reverse=True
+        )
+        for name, values in stages:
+            print(
+                f"  {name:<24} {values['seconds']:>9.2f}s {values['calls']:>6} calls",
+                file=file,
+            )
+
+
+# the profiler of this process, shared by the scripts and the utility modules
+profiler = Profiler()
+
+
+def add_profiling_arguments(parser):
+    parser.add_argument("--report", help="write a JSON report of the stage timings")
+    parser.add_argument(
+        "--prometheus", help="write the metrics in the Prometheus text format"
+    )
+    parser.add_argument(
+        "--profile", help="run under cProfile and save the stats to this file"
+    )
+
+
+def start_profiling(args, script):
+    # start timing the run, the reports are written when the script exits
+    # (also after exit() and on errors)
+    profiler.reset(script)
+    c_profile = None
+    if args.profile:
+        c_profile = cProfile.Profile()
+        c_profile.enable()
+    if args.report or args.prometheus or args.profile:
+        atexit.register(finish_profiling, args, c_profile)
+    return profiler
+
+
+def finish_profiling(args, c_profile=None):
+    report = profiler.report()
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.prometheus:
+        with open(args.prometheus, "w") as f:
+            f.write(profiler.prometheus_text(report))
+    if c_profile is not None:
+        c_profile.disable()
+        c_profile.dump_stats(args.profile)
+        pstats.Stats(c_profile, stream=sys.stderr).sort_stats("cumulative").print_stats(
+            20
+        )
+    profiler.print_stages(report)
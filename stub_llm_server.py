@@ -0,0 +1,122 @@
+# a stand-in for the OpenAI chat completions API, to run summary_chapters_blog.py offline
+# (tests, benchmarks of the concurrency, no API costs)
+#
+# Usage:
+# python stub_llm_server.py [--port 8000] [--delay 1.0] [--context_tokens 0]
+#
+# Every answer is made up from the prompt: one "MM:SS <line>." line for the first timestamped
+# lines of the prompt (so chapter answers have the expected format), or else the start of the
+# prompt lines. --delay makes every request take that many seconds, like a real model, and a
+# request that does not fit in the context of the model (--context_tokens, by default the
+# size of the real model, counted the same way as llm_utils.py does) is rejected with the
+# same 400 error as the OpenAI API, so a request that would overflow the context fails loudly.
+#
+# Example:
+# python stub_llm_server.py --port 8000 --delay 2 &
+# python summary_chapters_blog.py "input_json.json" --generate_summary \
+#     --api_base http://127.0.0.1:8000/v1
+
+import argparse
+import asyncio
+import re
+import time
+
+from aiohttp import web
+
+from llm_utils import DEFAULT_CONTEXT_TOKENS, MODEL_CONTEXT_TOKENS, count_tokens
+
+TIMESTAMPED_LINE_PATTERN = re.compile(r"^\[?(\d\d:\d\d)(?: - \d\d:\d\d\])? (.+)$")
+
+
+def make_answer(prompt, max_lines=10):
+    # the lines between the --- markers of the prompt
+    parts = prompt.split("---\n")
+    lines = [line for line in parts[1 if len(parts) > 2 else 0].splitlines() if line]
+    step = max(1, len(lines) // max_lines)
+    answer = []
+    for line in lines[::step][:max_lines]:
+        match = TIMESTAMPED_LINE_PATTERN.match(line)
+        if match:
+            answer.append(f"{match.group(1)} {match.group(2)[:40].rstrip('.')}.")
+        else:
+            answer.append(line[:80])
+    return "\n".join(answer)
+
+
+async def chat_completions(request):
+    body = await request.json()
+    prompt = "".join(message["content"] for message in body["messages"])
+    prompt_tokens = count_tokens(prompt, body.get("model"))
+    settings = request.app["settings"]
+    settings["n_requests"] += 1
+    print(
+        f"{time.strftime('%H:%M:%S')} request {settings['n_requests']}: "
+        f"{body.get('model')}, {prompt_tokens} prompt tokens"
+    )
+    context_tokens = settings["context_tokens"] or MODEL_CONTEXT_TOKENS.get(
+        body.get("model"), DEFAULT_CONTEXT_TOKENS
+    )
+    if prompt_tokens + body.get("max_tokens", 0) > context_tokens:
+        return web.json_response(
+            {
+                "error": {
+                    "message": f"This model's maximum context length is "
+                    f"{context_tokens} tokens, your messages resulted in "
+                    f"{prompt_tokens} tokens.",
+                    "type": "invalid_request_error",
+                    "code": "context_length_exceeded",
+                }
+            },
+            status=400,
+        )
+
+    await asyncio.sleep(settings["delay"])
+    answer = make_answer(prompt)
+    return web.json_response(
+        {
+            "object": "chat.completion",
+            "model": body.get("model"),
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": answer},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": count_tokens(answer),
+            },
+        }
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8000, help="port to listen on")
+    parser.add_argument(
+        "--delay", type=float, default=0.0, help="seconds every request takes"
+    )
+    parser.add_argument(
+        "--context_tokens",
+        type=int,
+        default=0,
+        help="reject the requests whose prompt and answer do not fit in this many tokens "
+        "(0 = the context of the requested model)",
+    )
+    args = parser.parse_args()
+
+    app = web.Application()
+    app["settings"] = {
+        "delay": args.delay,
+        "context_tokens": args.context_tokens,
+        "n_requests": 0,
+    }
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    app.router.add_post("/chat/completions", chat_completions)
+    web.run_app(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,16 +7,70 @@
 #
 # Example:
 # python summary_and_chapters.py "input_json.json"
+#
+# The summary, chapters and blog post are generated at the same time and each one is written
+# to its own file as soon as it is done: "input_json_summary.txt", "input_json_chapters.txt"
+# and "input_json_blog.txt".
+#
+# Transcripts that do not fit in the context of the model are split at sentence boundaries
+# into windows of at most --max_prompt_tokens tokens (by default the context of the model
+# minus --max_output_tokens), up to --max_concurrency windows are summarized at once and the
+# partial results are then combined into the final summary, chapters or blog post (see
+# llm_utils.py). Use --api_base to send the requests to another server with the OpenAI chat
+# completions API, e.g. stub_llm_server.py for offline tests:
+# python stub_llm_server.py --port 8000 &
+# python summary_and_chapters.py "input_json.json" --generate_summary \
+#     --api_base http://127.0.0.1:8000/v1 --max_prompt_tokens 2000
+#
+# The answers are cached in ~/.cache/video-transcript-helper-llm, keyed by a hash of the model,
+# the prompt and the other request parameters, so a re-run (e.g. with only --generate_blog
+# after the chapters, or after editing the end of the transcript) only sends the requests
+# that changed. Use --no-cache to bypass the cache, --refresh to send every request again
+# and update the cache, --cache_ttl_days to expire old answers and --cache_max_mb to bound
+# its size. The hits and misses are printed at the end (and counted in --report).
+#
+# With --chapters_engine embeddings the chapters are found locally instead: the sentences are
+# embedded with a small CPU model and the chapters start where the topic changes (see
+# chapter_segmenter.py), so the model only writes their titles, in one small request. These
+# chapters are in the "MM:SS - MM:SS Title" format read by add_fades_captions_to_video.py.
+#
+# Use --report (JSON), --prometheus and --profile (cProfile) to see where the time goes, e.g.
+# loading the transcript or waiting for each of the OpenAI requests (see profiling_utils.py).
 
 import argparse
+import asyncio
 import json
-
-import openai
+import os
+
+from cache_utils import DiskCache
+from chapter_segmenter import (
+    DEFAULT_EMBEDDING_MODEL,
+    format_chapters,
+    segment_chapters,
+    title_chapters,
+)
+from llm_utils import (
+    DEFAULT_API_BASE,
+    DEFAULT_LLM_CACHE_DIR,
+    DEFAULT_LLM_CACHE_MAX_BYTES,
+    ChatClient,
+    get_max_prompt_tokens,
+    map_reduce,
+)
+from profiling_utils import (
+    add_profiling_arguments,
+    file_size,
+    profiler,
+    start_profiling,
+)
+from transcript_utils import SentenceIndex, load_transcript
 
 
 # get the input video file and the output text file
 parser = argparse.ArgumentParser()
-parser.add_argument("input_json_file", help="input json transcription file")
+parser.add_argument(
+    "input_json_file", help="input json (or compact .npz) transcription file"
+)
 # non positional arguments for generating summary and chapters
 parser.add_argument("--generate_summary", action="store_true", help="generate summary")
 parser.add_argument(
@@ -30,108 +84,124 @@ parser.add_argument(
 )
 # optional arguments for generating summary and chapters
 parser.add_argument("--summary_prompt", type=str, default="", help="prompt to use for summary")
+parser.add_argument(
+    "--api_base",
+    default=os.environ.get("OPENAI_API_BASE", DEFAULT_API_BASE),
+    help="base URL of the chat completions API (e.g. of a local stub server)",
+)
+parser.add_argument(
+    "--max_concurrency",
+    type=int,
+    default=4,
+    help="maximum number of requests sent to the API at once",
+)
+parser.add_argument(
+    "--max_prompt_tokens",
+    type=int,
+    default=0,
+    help="maximum tokens per request, longer transcripts are split into windows "
+    "(0 = the context of the model minus --max_output_tokens)",
+)
+parser.add_argument(
+    "--max_output_tokens",
+    type=int,
+    default=1024,
+    help="maximum tokens of every answer",
+)
+parser.add_argument(
+    "--no-cache", action="store_true", help="do not read or write the response cache"
+)
+parser.add_argument(
+    "--refresh",
+    action="store_true",
+    help="ignore cached answers, send the requests again and update the cache",
+)
+parser.add_argument(
+    "--cache_dir", default=DEFAULT_LLM_CACHE_DIR, help="response cache directory"
+)
+parser.add_argument(
+    "--cache_max_mb",
+    type=int,
+    default=DEFAULT_LLM_CACHE_MAX_BYTES // (1024 * 1024),
+    help="maximum size of the cache, least recently used entries are evicted",
+)
+parser.add_argument(
+    "--cache_ttl_days",
+    type=float,
+    default=30,
+    help="cached answers older than this many days are sent again (0 = never expire)",
+)
+parser.add_argument(
+    "--chapters_engine",
+    choices=["llm", "embeddings"],
+    default="llm",
+    help="find the chapters with the language model, or locally with sentence "
+    "embeddings (the model then only titles them)",
+)
+parser.add_argument(
+    "--embedding_model",
+    default=DEFAULT_EMBEDDING_MODEL,
+    help="sentence-transformers model of the embeddings engine (without "
+    "sentence-transformers, TF-IDF vectors are used)",
+)
+parser.add_argument(
+    "--max_chapters", type=int, default=10, help="maximum number of chapters"
+)
+parser.add_argument(
+    "--min_chapter_seconds",
+    type=float,
+    default=60,
+    help="minimum length of a chapter of the embeddings engine",
+)
+add_profiling_arguments(parser)
 args = parser.parse_args()
+if args.chapters_engine == "embeddings" and args.wshiper_cpp_json:
+    parser.error("--chapters_engine embeddings needs a word level transcript")
+start_profiling(args, "summary_chapters_blog")
 
 # get the input video file name and the output text file name
 input_json_file = args.input_json_file
 
-# read the input JSON file
+# read the input JSON file (AWS style transcripts can also be read from the compact .npz)
 # print("Parsing the input JSON file...")
-with open(input_json_file) as f:
-    data = json.load(f)
-
-# combine words into sentences and keep the timings, using the start time of the first word
-# and the end time of the last word.
-# sentences are separated by a `punctuation` type item in the JSON file.
-# collect sentences in a list of lists of items from the JSON file.
-sentences = []
-
-if not args.wshiper_cpp_json:
-    sentence = []
-    for item in data["results"]["items"]:
-        # if the item is a punctuation, then it's the end of the sentence
-        if item["type"] == "punctuation" and item["alternatives"][0]["content"] in [
-            ".",
-            "?",
-            "!",
-        ]:
-            # add an 'end_time' to the punctuation item by using the end time of the last word
-            item["end_time"] = (
-                sentence[-1]["end_time"] if len(sentence) > 0 else item["start_time"]
-            )
-
-            # add the punctuation to the sentence
-            sentence.append(item)
-
-            # add the sentence to the list of sentences
-            sentences.append(sentence)
-
-            # start a new sentence
-            sentence = []
-        else:
-            # filter out the filler words
-            if item["type"] == "pronunciation" and item["alternatives"][0][
-                "content"
-            ].lower() in ["um", "uh", "so", "hmm", "like"]:
-                continue
-
-            # filter out punctuation
-            if item["type"] == "punctuation":
-                continue
-
-            # add the word to the sentence
-            sentence.append(item)
-
-    # get the timings of the sentences
-    sentences_timings = []
-    for sentence in sentences:
-        # get the start time of the sentence
-        start_time = float(sentence[0]["start_time"])
-
-        # get the end time of the sentence
-        end_time = float(sentence[-1]["end_time"])
-
-        # add the timings to the list of timings
-        sentences_timings.append((start_time, end_time))
+if args.wshiper_cpp_json:
+    with profiler.stage("load_transcript"):
+        with open(input_json_file) as f:
+            data = json.load(f)
+    profiler.add_bytes_read(file_size(input_json_file))
+else:
+    table = load_transcript(input_json_file)
+    if len(table) > 0:
+        profiler.add_audio_seconds(float(table.end_times.max()))
+
+    # combine words into sentences and keep the timings, using the start time of the first
+    # word and the end time of the last word, without the filler words.
+    # sentences are separated by a `punctuation` type item in the transcript.
+    with profiler.stage("split_sentences"):
+        sentence_index = SentenceIndex.from_table(table)
 
 
 def convert_senconds_to_mmss(seconds):
     return f"{int(seconds // 60):02d}:{int(seconds % 60):02d}"
 
 
-def build_summary(trim=True, remove_filler_words=True):
+def build_summary(trim=True):
     # build a summary list from the senstences and their timings
     summary = []
     if not args.wshiper_cpp_json:
-        for sentence, timings in zip(sentences, sentences_timings):
-            # get the pronounciations from the sentence
-            pronounciations = [
-                item["alternatives"][0]["content"].strip()
-                for item in sentence
-                if item["type"] == "pronunciation"
-            ]
-
-            if remove_filler_words:
-                # remove the filler words from the sentence
-                pronounciations = [
-                    word
-                    for word in pronounciations
-                    if word.lower() not in ["um", "uh", "so", "hmm", "like"]
-                ]
-
-            # get the sentence text
-            sentence_text = " ".join(pronounciations) + "."
+        for k in range(len(sentence_index)):
+            # get the sentence text, without the filler words
+            sentence_text = sentence_index.sentence_text(k)
 
             if trim:
                 # trim the sentence text to a maximum of 100 characters
                 sentence_text = sentence_text[: args.trim_length]
 
-            # get the sentence start and end timings
-            sentence_start_time, sentence_end_time = timings
-
             # convert the timings to strings in the format MM:SS
-            sentence_start_time = f"{convert_senconds_to_mmss(sentence_start_time)}"
-            sentence_end_time = f"{convert_senconds_to_mmss(sentence_end_time)}"
+            sentence_start_time = convert_senconds_to_mmss(
+                sentence_index.start_times[k]
+            )
+            sentence_end_time = convert_senconds_to_mmss(sentence_index.end_times[k])
 
             # add the sentence to the summary
             summary.append(
@@ -166,106 +236,176 @@ def build_summary(trim=True, remove_filler_words=True):
     return summary
 
 
-if args.generate_summary:
-    # build a prompt for OpenAI generation:
-    prompt = "transcript for the video:\n"
-    prompt += "---\n"
-    for sentence in build_summary(trim=args.trim_length > 0):
-        prompt += f"{sentence['text']}\n"
-    prompt += "---\n"
-    if args.summary_prompt is not None and args.summary_prompt != "":
-        prompt += args.summary_prompt
-    else:
-        prompt += (
-            "write a short summary description paragraph for the above video on YouTube.\n"
-        )
-        prompt += "Summary for the video:\n"
+# the transcript is rendered once, the three generations only trim it differently
+summary = build_summary(trim=False)
 
-    if args.print_prompts:
-        print(prompt)
 
-    history = [{"role": "user", "content": prompt}]
+def trim_text(text, trim):
+    # trim the sentence text to a maximum of --trim_length characters
+    return text[: args.trim_length] if trim else text
 
-    # send a request to the OpenAI API (model gpt-3.5-turbo) to generate the summary
-    # print("Sending a request to the OpenAI API to generate the summary...")
-    print("Generating the summary...")
-    response = openai.ChatCompletion.create(
-        model="gpt-3.5-turbo-16k",
-        messages=history,
+
+async def generate(client, name, model, lines, instruction, map_instruction):
+    # send the lines to the model, split into several requests if they are too long, and
+    # write the answer to <input>_<name>.txt as soon as it is there
+    max_prompt_tokens = args.max_prompt_tokens or get_max_prompt_tokens(
+        model, args.max_output_tokens
     )
+    with profiler.stage(f"generate_{name}"):
+        generated_text = await map_reduce(
+            client, model, lines, instruction, map_instruction, max_prompt_tokens
+        )
+    return write_output(name, generated_text)
+
 
-    # get the generated summary
-    generated_summary = response["choices"][0]["message"]["content"]
-    history += [{"role": "assistant", "content": generated_summary}]
+def write_output(name, generated_text):
+    # write the answer to <input>_<name>.txt and print it
+    output_file = os.path.splitext(input_json_file)[0] + f"_{name}.txt"
+    with open(output_file, "w") as f:
+        f.write(generated_text + "\n")
+    profiler.add_bytes_written(file_size(output_file))
 
-    # print the generated summary
+    # print the generated text
     print("----------------------")
-    print(generated_summary)
+    print(generated_text)
     print("----------------------")
+    print(f"Wrote the {name} to {output_file}")
+    return generated_text
+
 
-if args.generate_chapters:
-    prompt = "transcript for the video:\n"
-    prompt += "---\n"
-    for sentence in build_summary(trim=True):
-        prompt += (
-            f"[{sentence['start_time']} - {sentence['end_time']}] {sentence['text']}\n"
+def generate_summary(client):
+    lines = [trim_text(sentence["text"], args.trim_length > 0) for sentence in summary]
+    if args.summary_prompt is not None and args.summary_prompt != "":
+        instruction = args.summary_prompt
+    else:
+        instruction = (
+            "write a short summary description paragraph for the above video on YouTube.\n"
         )
-    prompt += "---\n"
-    prompt += (
-        "write up to 10 high-level chapters for the video on YouTube in the format: "
-        + "'MM:SS <chapter-title>.'\n"
+        instruction += "Summary for the video:\n"
+
+    # send a request to the OpenAI API (model gpt-3.5-turbo) to generate the summary
+    print("Generating the summary...")
+    return generate(
+        client,
+        "summary",
+        "gpt-3.5-turbo-16k",
+        lines,
+        instruction,
+        "write a short summary of the above part of the video.\n",
     )
-    prompt += "Chapters for the video:\n"
 
-    if args.print_prompts:
-        print(prompt)
 
-    history = [{"role": "user", "content": prompt}]
+async def generate_local_chapters(client):
+    # find the chapters locally, in a thread so the other generations keep running, and
+    # only ask the model for their titles
+    print("Finding the chapters...")
+    with profiler.stage("segment_chapters"):
+        chapters = await asyncio.get_running_loop().run_in_executor(
+            None,
+            lambda: segment_chapters(
+                sentence_index,
+                args.embedding_model,
+                max_chapters=args.max_chapters,
+                min_chapter_seconds=args.min_chapter_seconds,
+            ),
+        )
+    print(f"Found {len(chapters)} chapters, generating their titles...")
+    with profiler.stage("generate_chapters"):
+        titles = await title_chapters(client, "gpt-3.5-turbo", chapters)
+    return write_output("chapters", format_chapters(chapters, titles))
+
+
+def generate_chapters(client):
+    if args.chapters_engine == "embeddings":
+        return generate_local_chapters(client)
+
+    lines = [
+        f"[{sentence['start_time']} - {sentence['end_time']}] "
+        + trim_text(sentence["text"], True)
+        for sentence in summary
+    ]
+    instruction = (
+        f"write up to {args.max_chapters} high-level chapters for the video on YouTube "
+        + "in the format: 'MM:SS <chapter-title>.'\n"
+    )
+    instruction += "Chapters for the video:\n"
 
     # send a request to the OpenAI API (model gpt-3.5-turbo) to generate the chapters
-    print("Sending a request to the OpenAI API to generate the chapters...")
-    response = openai.ChatCompletion.create(
-        model="gpt-3.5-turbo",
-        messages=history,
+    print("Generating the chapters...")
+    return generate(
+        client,
+        "chapters",
+        "gpt-3.5-turbo",
+        lines,
+        instruction,
+        "list the topics of the above part of the video in the format: "
+        + "'MM:SS <topic>.', with the time where each topic starts.\n",
     )
 
-    # get the generated chapters
-    generated_chapters = response["choices"][0]["message"]["content"]
-    history += [{"role": "assistant", "content": generated_chapters}]
 
-    # print the generated chapters
-    print("----------------------")
-    print(generated_chapters)
-    print("----------------------")
+def generate_blog(client):
+    lines = [sentence["text"] for sentence in summary]
+    instruction = "write a blog post of at least 500 words for the above video. write the title and then the post body.\n"
+    instruction += "Title of the blog post:\n"
 
-if args.generate_blog:
-    prompt = "transcript for the video:\n"
-    prompt += "---\n"
-    for sentence in build_summary(trim=False):
-        prompt += f"{sentence['text']}\n"
-    prompt += "---\n"
-    prompt += "write a blog post of at least 500 words for the above video. write the title and then the post body.\n"
-    prompt += "Title of the blog post:\n"
-
-    if args.print_prompts:
-        print(prompt)
+    # send a request to the OpenAI API (model gpt-3.5-turbo) to generate the blog post
+    print("Generating the blog post...")
+    return generate(
+        client,
+        "blog",
+        "gpt-3.5-turbo",
+        lines,
+        instruction,
+        "write detailed notes of the key points of the above part of the video.\n",
+    )
 
-    history = [{"role": "user", "content": prompt}]
 
-    # send a request to the OpenAI API (model gpt-3.5-turbo) to generate the blog post
-    print("Sending a request to the OpenAI API to generate the blog post...")
-    response = openai.ChatCompletion.create(
-        model="gpt-3.5-turbo",
-        messages=history,
+# cache of the answers, shared by the three generations
+cache = None
+if not args.no_cache:
+    cache = DiskCache(
+        args.cache_dir,
+        args.cache_max_mb * 1024 * 1024,
+        args.cache_ttl_days * 24 * 60 * 60 if args.cache_ttl_days > 0 else None,
+        name="llm_cache",
     )
 
-    # get the generated blog post
-    generated_blog = response["choices"][0]["message"]["content"]
-    history += [{"role": "assistant", "content": generated_blog}]
 
-    # print the generated blog post
-    print("----------------------")
-    print(generated_blog)
-    print("----------------------")
+async def generate_all():
+    # all the requests share one HTTP connection pool and the --max_concurrency limit, and
+    # the generations run at the same time, so the total time is about that of the slowest
+    async with ChatClient(
+        args.api_base,
+        os.environ.get("OPENAI_API_KEY"),
+        args.max_concurrency,
+        args.max_output_tokens,
+        args.print_prompts,
+        cache=cache,
+        refresh=args.refresh,
+    ) as client:
+        generations = []
+        if args.generate_summary:
+            generations.append(generate_summary(client))
+        if args.generate_chapters:
+            generations.append(generate_chapters(client))
+        if args.generate_blog:
+            generations.append(generate_blog(client))
+        # a failed generation does not stop the others
+        return await asyncio.gather(*generations, return_exceptions=True)
+
+
+results = asyncio.run(generate_all())
+
+if cache is not None:
+    print(f"LLM response cache: {cache.hits} hits, {cache.misses} misses")
+
+n_failed = 0
+for result in results:
+    if isinstance(result, Exception):
+        n_failed += 1
+        print(f"Error: {result}")
+if n_failed > 0:
+    print(f"{n_failed} of {len(results)} generations failed")
+    exit(1)
 
 print("Done.")
@@ -0,0 +1,195 @@
+# unit tests of the cut planner (cut_planner.py)
+#
+# Usage:
+# python -m pytest test_cut_planner.py
+
+import random
+
+import numpy as np
+import pytest
+
+from cut_planner import (
+    IntervalSet,
+    find_filler_ranges,
+    plan_cuts,
+    shrink_ranges,
+    split_for_speedup,
+)
+
+FILLER_WORDS = ["um", "uh", "so"]
+
+
+def find_filler_ranges_original(contents, start_times, end_times, filler_words):
+    # the list-based loop that clean_video_from_transcription.py used before the planner,
+    # without its (0.0, 0.0) sentinel
+    is_filler = [content.lower() in filler_words for content in contents]
+    filler_words_timings = []
+    i = 0
+    while i < len(contents) - 1:
+        if not is_filler[i]:
+            i += 1
+            continue
+
+        # find the last filler word in this run of consecutive filler words
+        j = i
+        while j + 1 < len(contents) and is_filler[j + 1]:
+            j += 1
+        # the last pronunciation is never removed
+        if j == len(contents) - 1:
+            break
+
+        start_time = float(start_times[i])
+        end_time = float(end_times[j])
+        if end_time - start_time < 0.3:
+            end_time = start_time + 0.3
+        if float(start_times[j + 1]) > end_time:
+            end_time = float(start_times[j + 1])
+
+        if start_time < end_time:
+            filler_words_timings.append((start_time, end_time))
+        i = j + 1
+    return filler_words_timings
+
+
+def make_transcript(n_words, filler_ratio, seed=0):
+    # words of 0.1-0.6 seconds with pauses of 0-0.3 seconds between them
+    rng = random.Random(seed)
+    other_words = ["the", "video", "and", "we", "transcript", "Um", "helper"]
+    contents = []
+    start_times = np.zeros(n_words)
+    end_times = np.zeros(n_words)
+    t = 0.0
+    for i in range(n_words):
+        if rng.random() < filler_ratio:
+            contents.append(rng.choice(FILLER_WORDS))
+        else:
+            contents.append(rng.choice(other_words))
+        t += rng.uniform(0.0, 0.3)
+        start_times[i] = t
+        t += rng.uniform(0.1, 0.6)
+        end_times[i] = t
+    return contents, start_times, end_times
+
+
+def test_interval_set_merges_overlapping_and_touching_ranges():
+    intervals = IntervalSet.from_ranges([(5, 7), (0, 2), (1, 3), (3, 4), (8, 9)])
+    assert list(intervals) == [(0, 4), (5, 7), (8, 9)]
+
+
+def test_interval_set_merge_gap_and_empty_ranges():
+    intervals = IntervalSet.from_ranges([(0, 1), (1.5, 2), (4, 4), (3, 2)], 0.5)
+    assert list(intervals) == [(0, 2)]
+
+
+def test_interval_set_union():
+    first = IntervalSet.from_ranges([(0, 1), (4, 5)])
+    second = IntervalSet.from_ranges([(1, 2), (6, 7)])
+    assert list(first.union(second)) == [(0, 2), (4, 5), (6, 7)]
+
+
+def test_interval_set_complement():
+    intervals = IntervalSet.from_ranges([(1, 2), (4, 5)])
+    assert list(intervals.complement(0, 6)) == [(0, 1), (2, 4), (5, 6)]
+    assert list(intervals.complement(1.5, 4.5)) == [(2, 4)]
+    assert list(IntervalSet().complement(0, 3)) == [(0, 3)]
+    assert list(IntervalSet.from_ranges([(0, 3)]).complement(0, 3)) == []
+
+
+def test_interval_set_overlap_queries():
+    intervals = IntervalSet.from_ranges([(1, 2), (4, 5), (7, 8)])
+    assert intervals.overlapping(1.5, 4.5) == [(1, 2), (4, 5)]
+    # the intervals are half-open, touching is not overlapping
+    assert intervals.overlapping(2, 4) == []
+    assert intervals.overlapping(0, 10) == [(1, 2), (4, 5), (7, 8)]
+    assert intervals.contains(1)
+    assert not intervals.contains(2)
+    assert not intervals.contains(3)
+    assert intervals.total_duration() == 3
+
+
+def test_find_filler_ranges_matches_the_original_algorithm():
+    contents, start_times, end_times = make_transcript(5000, 0.15)
+    assert find_filler_ranges(
+        contents, start_times, end_times, FILLER_WORDS
+    ) == pytest.approx(
+        find_filler_ranges_original(contents, start_times, end_times, FILLER_WORDS)
+    )
+
+
+def test_find_filler_ranges_merges_runs_and_keeps_the_last_word():
+    contents = ["hello", "um", "uh", "world", "so"]
+    start_times = [0.0, 1.0, 1.1, 2.0, 3.0]
+    end_times = [0.9, 1.05, 1.2, 2.5, 3.5]
+    # the run of "um uh" lasts until the next word, the final "so" is kept
+    assert find_filler_ranges(contents, start_times, end_times, FILLER_WORDS) == [
+        (1.0, 2.0)
+    ]
+    assert find_filler_ranges(["um"], [0.0], [1.0], FILLER_WORDS) == []
+
+
+def test_plan_cuts_without_padding():
+    assert plan_cuts([(2, 3), (5, 6)], 10) == [(0, 2), (3, 5), (6, 10)]
+
+
+def test_plan_cuts_padding():
+    keep_segments = plan_cuts([(2, 3), (5, 6)], 10, pre_padding=0.5, post_padding=0.25)
+    assert keep_segments == [(0, 1.5), (3.25, 4.5), (6.25, 10)]
+    # negative padding keeps more of the audio, and the padding stays within the video
+    assert plan_cuts([(2, 3)], 10, pre_padding=-0.5) == [(0, 2.5), (3, 10)]
+    assert plan_cuts([(0.2, 1), (9, 9.8)], 10, 0.5, 0.5) == [(1.5, 8.5)]
+
+
+def test_plan_cuts_merges_padded_ranges():
+    assert plan_cuts([(2, 3), (3.4, 4)], 10, post_padding=0.5) == [(0, 2), (4.5, 10)]
+
+
+def test_plan_cuts_min_keep():
+    # the 0.1s between the two cuts is dropped, the 0.3s one is kept
+    assert plan_cuts([(2, 3), (3.1, 4), (4.3, 5)], 10, min_keep=0.2) == [
+        (0, 2),
+        pytest.approx((4, 4.3)),
+        (5, 10),
+    ]
+
+
+def test_plan_cuts_empty_transcript():
+    assert plan_cuts([], 10) == [(0, 10)]
+    assert plan_cuts(find_filler_ranges([], [], [], FILLER_WORDS), 10) == [(0, 10)]
+    assert plan_cuts([], 0) == []
+
+
+def test_shrink_ranges():
+    assert shrink_ranges([(0, 2), (3, 3.5), (5, 6)], 0.25) == [
+        (0.25, 1.75),
+        (5.25, 5.75),
+    ]
+    # a range exactly twice the margin would become empty
+    assert shrink_ranges([(0, 0.5)], 0.25) == []
+    assert shrink_ranges([(0, 1)], 0) == [(0, 1)]
+
+
+def test_split_for_speedup_inside_and_across_segments():
+    pieces = split_for_speedup([(0, 10)], [(2, 3), (5, 6)], 4.0)
+    assert pieces == [
+        (0, 2, 1.0),
+        (2, 3, 4.0),
+        (3, 5, 1.0),
+        (5, 6, 4.0),
+        (6, 10, 1.0),
+    ]
+    # a speedup range that crosses the segment boundaries is clipped to the segments
+    pieces = split_for_speedup([(0, 4), (6, 10)], [(3, 7)], 2.0)
+    assert pieces == [(0, 3, 1.0), (3, 4, 2.0), (6, 7, 2.0), (7, 10, 1.0)]
+
+
+def test_split_for_speedup_at_interval_boundaries():
+    # speedup ranges that only touch a segment do not add empty pieces
+    assert split_for_speedup([(2, 5)], [(0, 2), (5, 8)], 2.0) == [(2, 5, 1.0)]
+    # speedup ranges that start or end exactly at the segment boundaries
+    assert split_for_speedup([(2, 5)], [(2, 3), (4, 5)], 2.0) == [
+        (2, 3, 2.0),
+        (3, 4, 1.0),
+        (4, 5, 2.0),
+    ]
+    assert split_for_speedup([(2, 5)], [(2, 5)], 2.0) == [(2, 5, 2.0)]
+    assert split_for_speedup([(2, 5)], [], 2.0) == [(2, 5, 1.0)]
@@ -0,0 +1,71 @@
+# unit tests of the sentence index (transcript_utils.py)
+#
+# Usage:
+# python -m pytest test_transcript_utils.py
+
+import numpy as np
+
+from transcript_utils import SentenceIndex, WordTable
+
+
+def make_table(words):
+    # a WordTable from (content, start_time, end_time) tuples, the punctuation items have
+    # the same start and end time like in the whisper transcripts
+    items = [
+        {
+            "alternatives": [{"content": content, "confidence": 0.9}],
+            "start_time": start_time,
+            "end_time": end_time,
+            "type": "punctuation" if start_time == end_time else "pronunciation",
+        }
+        for content, start_time, end_time in words
+    ]
+    return WordTable.from_items(items)
+
+
+# whisper keeps the space in front of each word
+WHISPER_WORDS = [
+    (" Hello", 0.0, 0.4),
+    (" um", 0.5, 0.7),
+    (" world", 0.8, 1.2),
+    (".", 1.2, 1.2),
+    (" So", 2.0, 2.2),
+    (" how", 2.3, 2.5),
+    (" are", 2.6, 2.8),
+    (" you", 2.9, 3.1),
+    ("?", 3.1, 3.1),
+    (" trailing", 4.0, 4.5),
+]
+
+
+def test_sentence_index_skips_whisper_filler_words():
+    index = SentenceIndex.from_table(make_table(WHISPER_WORDS))
+    assert len(index) == 2
+    assert index.sentence_text(0) == "Hello world."
+    assert index.sentence_text(1) == "how are you."
+    assert index.sentence_words(0).tolist() == [0, 2]
+
+
+def test_sentence_index_times():
+    index = SentenceIndex.from_table(make_table(WHISPER_WORDS))
+    # a sentence lasts from its first to its last word, without the fillers
+    assert index.start_times.tolist() == [0.0, 2.3]
+    assert index.end_times.tolist() == [1.2, 3.1]
+    assert index.sentence_at(1.0) == 0
+    assert index.sentence_at(1.5) == -1
+    assert index.sentence_at(3.0) == 1
+    assert list(index.sentences_between(1.0, 2.4)) == [0, 1]
+    # the words after the last sentence end are not part of any sentence
+    assert index.words_between(2.4, 10.0).tolist() == [5, 6, 7]
+
+
+def test_sentence_index_without_words():
+    index = SentenceIndex.from_table(make_table([(".", 1.0, 1.0)]))
+    assert len(index) == 1
+    assert index.sentence_text(0) == "."
+    assert index.start_times.tolist() == [1.0]
+    assert index.end_times.tolist() == [1.0]
+
+    index = SentenceIndex.from_table(make_table([]))
+    assert len(index) == 0
+    assert np.array_equal(index.words_between(0.0, 10.0), [])
@@ -1,10 +1,10 @@
 # this script will transcribe the audio from an input video file
 # the output will be a JSON file with the transcription
 # use argparse to get the input video file and the output text file
-# use the AWS transcribe using the AWS CLI to transcribe the audio
+# use the AWS transcribe API (through an asyncio client) to transcribe the audio
 #
 # Usage:
-# python transcribe_from_video.py <input_video_file>
+# python transcribe_from_video.py <input_video_file> [<input_video_file> ...]
 #
 # The output JSON file will be saved in the same directory as the input video file
 #
@@ -12,140 +12,517 @@
 # python transcribe_from_video.py "input_video.mp4"
 #
 # The output JSON file will have the name "input_video.json"
+#
+# Several files are transcribed concurrently (at most --concurrency at a time), so the upload,
+# queueing and download of the different files overlap. All the AWS calls share one pooled
+# HTTP session per service. Use --endpoint_url to run against a local stand-in (e.g. moto).
+# The transcript is fetched in memory and written in the same normalized form as the whisper
+# script (confidences and timings as numbers, timings on the punctuation items too).
+#
+# By default every job creates and deletes a temporary S3 bucket. With --bucket (or the
+# TRANSCRIBE_S3_BUCKET environment variable) one bucket is reused for all the jobs, the audio is
+# uploaded under --prefix, and a lifecycle rule expires anything left there after --expire_days.
+# Large FLAC files are uploaded in parallel multipart chunks, each part is retried on its own.
+#
+# Transcripts are cached on disk, keyed by a hash of the decoded audio, so re-running on the
+# same (or a renamed / re-muxed) video does not start (and pay for) a new transcription job.
+# Use --no-cache to bypass the cache and --refresh to transcribe again and update it.
+#
+# Use --npz to also write the transcript in the compact columnar format ("input_video.npz")
+# that the other scripts load much faster than the JSON file.
+#
+# Once a transcription job is started, its name is saved to "input_video.aws-job.json". If the
+# script is interrupted (or the machine is preempted) while the job runs, the job is left running
+# and a rerun re-attaches to it instead of uploading the audio and paying for a new job.
+# Use --no-resume to ignore the checkpoint.
+#
+# Use --report (JSON), --prometheus and --profile (cProfile) to see where the time goes: the
+# conversion, the upload, the queueing and transcription in AWS, the download, ... (see
+# profiling_utils.py). The stages of concurrent files overlap, so they add up to more than the
+# wall time.
 
 import argparse
+import asyncio
 import json
-import subprocess
 import os
+import random
 import re
 import uuid
 
-# get the input video file and the output text file
-parser = argparse.ArgumentParser()
-parser.add_argument("input_video_file", help="input video file")
-args = parser.parse_args()
+import aiohttp
+from aiobotocore.config import AioConfig
+from aiobotocore.session import get_session
+from botocore.exceptions import ClientError
+
+from audio_utils import hash_audio
+from cache_utils import DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES, DiskCache, make_cache_key
+from profiling_utils import add_profiling_arguments, file_size, profiler, start_profiling
+from transcript_utils import normalize_aws_transcript, write_transcript_json
+
+
+class TranscriptionJobFailed(Exception):
+    pass
+
+
+def log(input_video_file, message):
+    # prefix the messages with the file name, the files are transcribed concurrently
+    print(f"[{os.path.basename(input_video_file)}] {message}")
+
+
+# id of the lifecycle rule that expires the uploaded audio in a reused bucket
+LIFECYCLE_RULE_ID = "video-transcript-helper-expiry"
+
+# error codes of the AWS calls that are worth retrying (rate limits and transient failures)
+THROTTLING_ERROR_CODES = {"ThrottlingException", "TooManyRequestsException", "LimitExceededException",
+                          "RequestLimitExceeded", "InternalFailureException", "ServiceUnavailableException"}
+
+
+def read_file(file_name):
+    with open(file_name, "rb") as f:
+        return f.read()
+
+
+def read_file_part(file_name, offset, size):
+    with open(file_name, "rb") as f:
+        f.seek(offset)
+        return f.read(size)
+
+
+async def run_in_thread(function, *args):
+    return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+
+async def run_process(*cmd):
+    process = await asyncio.create_subprocess_exec(*cmd)
+    return await process.wait()
+
+
+async def convert_to_flac(input_video_file):
+    # convert the video file to a FLAC audio file using ffmpeg (quiet mode)
+    # the FLAC audio file will be saved in the same directory as the input video file
+    # the FLAC audio file will have the same name as the input video file but with a FLAC extension
+    flac_audio_file = os.path.basename(os.path.splitext(input_video_file)[0])
+    # make sure the file has s3 compatible name..
+    flac_audio_file = re.sub('[^0-9a-zA-Z]+', '-', flac_audio_file) + ".flac"
+    # add the path to the FLAC audio file
+    flac_audio_file = os.path.join(os.path.dirname(input_video_file), flac_audio_file)
+
+    log(input_video_file, f"Converting video file to FLAC audio file using ffmpeg... {flac_audio_file}")
+    returncode = await run_process("ffmpeg", "-i", input_video_file, "-vn", "-ac", "1", "-ar", "16000",
+                                   "-c:a", "flac", "-qscale:a", "0", "-loglevel", "quiet", "-copyts", "-y",
+                                   flac_audio_file)
+    if returncode != 0 or not os.path.exists(flac_audio_file):
+        raise RuntimeError(f"Error converting {input_video_file} to FLAC")
+    return flac_audio_file
+
+
+def read_flac_duration(flac_file):
+    # the STREAMINFO block right after the "fLaC" marker holds the sample rate (20 bits) and the
+    # number of samples (36 bits), ffmpeg fills them in once the file is complete
+    with open(flac_file, "rb") as f:
+        header = f.read(26)
+    if len(header) < 26 or not header.startswith(b"fLaC"):
+        return 0.0
+    info = int.from_bytes(header[18:26], "big")
+    sample_rate = info >> 44
+    n_samples = info & ((1 << 36) - 1)
+    return n_samples / sample_rate if sample_rate > 0 else 0.0
+
+
+async def with_retries(make_call, what, input_video_file, attempts=5, is_retryable=None):
+    # retry a single AWS call (e.g. the upload of one part) with exponential backoff
+    # with is_retryable, the errors it rejects are raised at once instead of retried
+    for attempt in range(attempts):
+        try:
+            return await make_call()
+        except Exception as e:
+            if attempt == attempts - 1 or (is_retryable is not None and not is_retryable(e)):
+                raise
+            delay = 2 ** attempt * random.uniform(0.5, 1.0)
+            log(input_video_file, f"Error {what}, retrying in {delay:.1f} seconds: {e}")
+            await asyncio.sleep(delay)
+
+
+async def upload_file(s3, input_video_file, file_name, bucket, key, part_size, concurrency):
+    # upload small files in a single request, and large files in parts of part_size bytes,
+    # up to `concurrency` parts at a time. every part is retried on its own, so a failure
+    # does not restart the whole upload.
+    size = os.path.getsize(file_name)
+    if size <= part_size:
+        body = await run_in_thread(read_file, file_name)
+        await with_retries(lambda: s3.put_object(Bucket=bucket, Key=key, Body=body),
+                           f"uploading {key}", input_video_file)
+        return
+
+    upload = await with_retries(lambda: s3.create_multipart_upload(Bucket=bucket, Key=key),
+                                f"starting the upload of {key}", input_video_file)
+    upload_id = upload["UploadId"]
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def upload_part(part_number, offset):
+        async with semaphore:
+            body = await run_in_thread(read_file_part, file_name, offset, part_size)
+            response = await with_retries(
+                lambda: s3.upload_part(Bucket=bucket, Key=key, UploadId=upload_id,
+                                       PartNumber=part_number, Body=body),
+                f"uploading part {part_number} of {key}", input_video_file)
+            return {"ETag": response["ETag"], "PartNumber": part_number}
+
+    try:
+        parts = await asyncio.gather(*[upload_part(i + 1, offset)
+                                       for i, offset in enumerate(range(0, size, part_size))])
+        await with_retries(
+            lambda: s3.complete_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id,
+                                                 MultipartUpload={"Parts": parts}),
+            f"completing the upload of {key}", input_video_file)
+    except Exception:
+        try:
+            await s3.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        except Exception as e:
+            log(input_video_file, f"Error aborting the upload of {key}: {e}")
+        raise
+
+
+async def create_bucket(s3, bucket, region):
+    create_bucket_args = {}
+    if region != "us-east-1":
+        create_bucket_args["CreateBucketConfiguration"] = {"LocationConstraint": region}
+    await s3.create_bucket(Bucket=bucket, **create_bucket_args)
+
+
+async def prepare_reused_bucket(s3, bucket, prefix, expire_days, region):
+    # create the bucket if needed, and make sure that a lifecycle rule expires the audio
+    # uploaded under `prefix`, so that leftovers of crashed runs are cleaned up by S3
+    try:
+        await s3.head_bucket(Bucket=bucket)
+    except ClientError as e:
+        if e.response["Error"]["Code"] not in ("404", "NoSuchBucket"):
+            raise
+        print(f"Creating the S3 bucket {bucket}...")
+        await create_bucket(s3, bucket, region)
 
-# get the input video file name and the output text file name
-input_video_file = args.input_video_file
+    try:
+        response = await s3.get_bucket_lifecycle_configuration(Bucket=bucket)
+        rules = response["Rules"]
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "NoSuchLifecycleConfiguration":
+            raise
+        rules = []
 
-# get the input video file name without the extension
-input_video_file_name = os.path.splitext(input_video_file)[0]
+    # keep the other rules of the bucket, only add or update ours
+    rule = {"ID": LIFECYCLE_RULE_ID, "Filter": {"Prefix": prefix}, "Status": "Enabled",
+            "Expiration": {"Days": expire_days},
+            "AbortIncompleteMultipartUpload": {"DaysAfterInitiation": expire_days}}
+    if rule not in rules:
+        rules = [r for r in rules if r.get("ID") != LIFECYCLE_RULE_ID] + [rule]
+        await s3.put_bucket_lifecycle_configuration(Bucket=bucket,
+                                                    LifecycleConfiguration={"Rules": rules})
 
-# get the input video file name without the extension and without the path
-input_video_file_name_without_path = os.path.basename(input_video_file_name)
 
+def read_checkpoint(checkpoint_file):
+    try:
+        with open(checkpoint_file) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
 
-def cleanup(job_name, s3_uri, flac_audio_file):
-    if s3_uri is not None:
+
+def write_checkpoint(checkpoint_file, checkpoint):
+    # write to a temporary file first so that a crash never leaves a partial checkpoint
+    with open(checkpoint_file + ".tmp", "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(checkpoint_file + ".tmp", checkpoint_file)
+
+
+def is_throttling_error(e):
+    return isinstance(e, ClientError) and e.response.get("Error", {}).get("Code") in THROTTLING_ERROR_CODES
+
+
+def is_job_not_found_error(e):
+    # AWS Transcribe answers a BadRequestException "The requested job couldn't be found..."
+    error = e.response.get("Error", {})
+    return (error.get("Code") == "NotFoundException"
+            or (error.get("Code") == "BadRequestException" and "couldn't be found" in error.get("Message", "")))
+
+
+async def find_job(transcribe, job_name, input_video_file):
+    # the job, or None if it does not exist (anymore). throttling is retried and any other error
+    # (expired credentials, access denied, ...) is raised: taking it for a missing job would delete
+    # the audio of a running job and pay for a new one
+    async def get_job():
+        try:
+            return (await transcribe.get_transcription_job(TranscriptionJobName=job_name))["TranscriptionJob"]
+        except ClientError as e:
+            if is_job_not_found_error(e):
+                return None
+            raise
+
+    return await with_retries(get_job, f"looking up the transcription job {job_name}", input_video_file,
+                              is_retryable=is_throttling_error)
+
+
+async def wait_for_job(transcribe, job_name, input_video_file, poll_interval, max_poll_interval):
+    # poll the job status with exponential backoff (and some jitter, so that many concurrent
+    # jobs do not poll in lockstep) until it is COMPLETED or FAILED. a throttled poll is retried,
+    # the job keeps running on AWS in the meantime
+    while True:
+        response = await with_retries(lambda: transcribe.get_transcription_job(TranscriptionJobName=job_name),
+                                      f"polling the transcription job {job_name}", input_video_file,
+                                      is_retryable=is_throttling_error)
+        job = response["TranscriptionJob"]
+        status = job["TranscriptionJobStatus"]
+        if status == "COMPLETED":
+            return job
+        if status == "FAILED":
+            raise TranscriptionJobFailed(f"Transcription job {job_name} failed: {job.get('FailureReason')}")
+        log(input_video_file, f"Transcription job {status.lower()}. Waiting for {poll_interval:.1f} seconds...")
+        await asyncio.sleep(poll_interval * random.uniform(0.8, 1.2))
+        poll_interval = min(max_poll_interval, poll_interval * 1.5)
+
+
+async def cleanup(s3, transcribe, input_video_file, bucket, s3_key, job_name, flac_audio_file,
+                  temporary_bucket):
+    # best effort: a failing cleanup step should not hide the actual result or error
+    async def ignore_errors(step, coroutine):
+        try:
+            await coroutine
+        except Exception as e:
+            log(input_video_file, f"Error {step}: {e}")
+
+    if s3_key is not None:
         # delete the temporary S3 audio file
-        print("Deleting the temporary S3 audio file...")
-        subprocess.run(["aws", "s3", "rm", s3_uri])
+        log(input_video_file, "Deleting the temporary S3 audio file...")
+        await ignore_errors("deleting the S3 audio file", s3.delete_object(Bucket=bucket, Key=s3_key))
 
     if job_name is not None:
         # delete the trascription job in AWS Transcribe
-        print("Deleting the transcription job in AWS Transcribe...")
-        subprocess.run(["aws", "transcribe", "delete-transcription-job",
-                        "--region", "us-east-1", "--transcription-job-name", job_name])
+        log(input_video_file, "Deleting the transcription job in AWS Transcribe...")
+        await ignore_errors("deleting the transcription job",
+                            transcribe.delete_transcription_job(TranscriptionJobName=job_name))
 
+    if temporary_bucket is not None:
         # delete the temporary S3 bucket
-        print("Deleting the temporary S3 bucket...")
-        subprocess.run(["aws", "s3", "rb", f"s3://{job_name}", "--force"])
+        log(input_video_file, "Deleting the temporary S3 bucket...")
+        await ignore_errors("deleting the S3 bucket", s3.delete_bucket(Bucket=temporary_bucket))
 
-    if flac_audio_file is not None:
+    if flac_audio_file is not None and os.path.exists(flac_audio_file):
         # delete the FLAC audio file
-        print("Deleting the local FLAC audio file...")
-        subprocess.run(["rm", flac_audio_file])
-
-
-# convert the video file to a FLAC audio file using ffmpeg (quiet mode)
-# the FLAC audio file will be saved in the same directory as the input video file
-# the FLAC audio file will have the same name as the input video file but with a FLAC extension
-flac_audio_file = input_video_file_name_without_path
-# make sure the file has s3 compatible name..
-flac_audio_file = re.sub('[^0-9a-zA-Z]+', '-', flac_audio_file)
-flac_audio_file_without_path = flac_audio_file + ".flac"
-# add the path to the FLAC audio file
-flac_audio_file = os.path.join(os.path.dirname(input_video_file), flac_audio_file_without_path)
-
-print(f"Converting video file to FLAC audio file using ffmpeg... {flac_audio_file}")
-subprocess.run(["ffmpeg", "-i", input_video_file, "-vn", "-ac", "1", "-ar", "16000", "-c:a", "flac",
-                "-qscale:a", "0", "-loglevel", "quiet", "-copyts", "-y", flac_audio_file])
-
-# generate a UUID for the job name
-job_name = f"transcribe-job-{uuid.uuid4().hex}"
-
-# create a temporary S3 bucket for the transcription job
-# the bucket name will be the same as the job name
-print("Creating temporary S3 bucket for the transcription job...")
-process = subprocess.run(["aws", "s3", "mb", f"s3://{job_name}"])
-
-if process.returncode != 0:
-    print("Error creating temporary S3 bucket for the transcription job")
-    exit(1)
-
-# upload the FLAC audio file to the temporary S3 bucket
-print("Uploading FLAC audio file to the temporary S3 bucket...")
-process = subprocess.run(["aws", "s3", "cp", flac_audio_file, f"s3://{job_name}"])
-
-if process.returncode != 0:
-    print("Error uploading FLAC audio file to the temporary S3 bucket")
-    cleanup(job_name, None, flac_audio_file)
-    exit(1)
-
-# get the S3 URI for the FLAC audio file
-s3_uri = f"s3://{job_name}/{flac_audio_file_without_path}"
-
-print(s3_uri)
-
-# start the transcription job
-# aws transcribe start-transcription-job \
-#  --region us-east-1 \
-#  --transcription-job-name "$TEMP_NAME" \
-#  --media "MediaFileUri=$S3_URI" \
-#  --language-code en-U
-print("Starting the transcription job...")
-process = subprocess.run(["aws", "transcribe", "start-transcription-job",
-                          "--region", "us-east-1", "--transcription-job-name", job_name,
-                          "--media", f"MediaFileUri={s3_uri}",
-                          "--language-code", "en-US"])
-
-if process.returncode != 0:
-    print("Error starting the transcription job")
-    cleanup(job_name, s3_uri, flac_audio_file)
-    exit(1)
-
-# wait for the transcription job to complete
-# run `aws transcribe get-transcription-job`` and capture the output JSON
-# e.g. aws transcribe get-transcription-job \
-#  --region us-east-1 \
-#  --transcription-job-name "$TEMP_NAME"
-# check the `TranscriptionJobStatus` field in the JSON if it is `COMPLETED`
-# if it is not `COMPLETED`, wait for 5 seconds and then check again
-# if it is `COMPLETED`, then break out of the loop
-print("Waiting for the transcription job to complete...")
-while True:
-    process = subprocess.run(["aws", "transcribe", "get-transcription-job",
-                              "--region", "us-east-1", "--transcription-job-name", job_name],
-                             capture_output=True)
-    output = process.stdout.decode("utf-8")
-    if "COMPLETED" in output:
-        break
-    else:
-        print("Transcription job not completed yet. Waiting for 5 seconds...")
-        subprocess.run(["sleep", "5"])
-
-# get the transcription job output JSON
-# use the last output JSON from the previous loop iteration to get the output JSON
-# from the `TranscriptionJob.Transcript.TranscriptFileUri` field
-# parse the JSON and get the `TranscriptFileUri` field
-parsed = json.loads(output)
-output_uri = parsed["TranscriptionJob"]["Transcript"]["TranscriptFileUri"]
-
-# download the transcription job output JSON file using regular `curl`
-# the transcription job output JSON file will be saved in the same directory as the input video file
-# and have the same name as the input video file but with a JSON extension
-output_json_file = input_video_file_name + ".json"
-print("Downloading the transcription job output JSON file...")
-subprocess.run(["curl", "-o", output_json_file, output_uri])
-
-cleanup(job_name, s3_uri, flac_audio_file)
+        log(input_video_file, "Deleting the local FLAC audio file...")
+        os.remove(flac_audio_file)
+
+
+async def fetch_json(http, url):
+    async with http.get(url) as response:
+        return await response.json(content_type=None)
+
+
+async def transcribe_file(s3, transcribe, http, input_video_file, args, cache, semaphore):
+    # the output JSON file will be saved in the same directory as the input video file
+    # and have the same name as the input video file but with a JSON extension
+    input_video_file_name = os.path.splitext(input_video_file)[0]
+    output_json_file = input_video_file_name + ".json"
+
+    checkpoint_file = input_video_file_name + ".aws-job.json"
+    async with semaphore:
+        # look up the transcript in the cache before starting a new (paid) transcription job
+        # hashing decodes the whole audio, so it counts against --concurrency too
+        cache_key = None
+        if cache is not None:
+            log(input_video_file, "Hashing the audio of the video file...")
+            cache_key = make_cache_key(audio=await run_in_thread(hash_audio, input_video_file),
+                                       model="aws-transcribe", language_code=args.language_code,
+                                       initial_prompt=None, word_timestamps=True)
+            transcript = None if args.refresh else cache.get(cache_key)
+            if transcript is not None:
+                write_transcript_json(output_json_file, transcript, args.npz)
+                log(input_video_file, f"Found the transcript in the cache, wrote {output_json_file}")
+                return
+
+        bucket = s3_key = started_job_name = flac_audio_file = temporary_bucket = None
+        keep_job = False
+        try:
+            # re-attach to the job of an interrupted run, if it is still running or done
+            checkpoint = None if args.no_resume else read_checkpoint(checkpoint_file)
+            if checkpoint is not None:
+                bucket = checkpoint["bucket"]
+                s3_key = checkpoint["s3_key"]
+                temporary_bucket = checkpoint["temporary_bucket"]
+                started_job_name = checkpoint["job_name"]
+                job = await find_job(transcribe, started_job_name, input_video_file)
+                if (job is not None and job["TranscriptionJobStatus"] != "FAILED"
+                        and checkpoint["language_code"] == args.language_code):
+                    log(input_video_file, f"Re-attaching to the transcription job {started_job_name}...")
+                else:
+                    log(input_video_file, f"Cannot resume the transcription job {started_job_name}, starting over...")
+                    await cleanup(s3, transcribe, input_video_file, bucket, s3_key,
+                                  started_job_name if job is not None else None, None, temporary_bucket)
+                    os.remove(checkpoint_file)
+                    bucket = s3_key = started_job_name = temporary_bucket = None
+
+            if started_job_name is None:
+                with profiler.stage("convert_to_flac"):
+                    flac_audio_file = await convert_to_flac(input_video_file)
+                profiler.add_bytes_read(file_size(input_video_file))
+                profiler.add_bytes_written(file_size(flac_audio_file))
+                profiler.add_audio_seconds(read_flac_duration(flac_audio_file))
+
+                # generate a UUID for the job name
+                job_name = f"transcribe-job-{uuid.uuid4().hex}"
+
+                if args.bucket:
+                    # reuse the configured bucket, every job gets its own key under the prefix
+                    bucket = args.bucket
+                    key = f"{args.prefix}{job_name}/{os.path.basename(flac_audio_file)}"
+                else:
+                    # create a temporary S3 bucket for the transcription job
+                    # the bucket name will be the same as the job name
+                    log(input_video_file, "Creating temporary S3 bucket for the transcription job...")
+                    with profiler.stage("create_bucket"):
+                        await create_bucket(s3, job_name, args.region)
+                    bucket = temporary_bucket = job_name
+                    key = os.path.basename(flac_audio_file)
+
+                # upload the FLAC audio file to the S3 bucket
+                log(input_video_file, f"Uploading FLAC audio file to s3://{bucket}/{key}...")
+                with profiler.stage("upload"):
+                    await upload_file(s3, input_video_file, flac_audio_file, bucket, key,
+                                      max(5, args.part_size_mb) * 1024 * 1024, args.upload_concurrency)
+                profiler.add_bytes_read(file_size(flac_audio_file))
+                s3_key = key
+
+                # get the S3 URI for the FLAC audio file
+                s3_uri = f"s3://{bucket}/{s3_key}"
+
+                # start the transcription job
+                log(input_video_file, "Starting the transcription job...")
+                # many concurrent jobs can hit the LimitExceededException of the account, retry it
+                with profiler.stage("start_job"):
+                    await with_retries(lambda: transcribe.start_transcription_job(
+                                           TranscriptionJobName=job_name, Media={"MediaFileUri": s3_uri},
+                                           LanguageCode=args.language_code),
+                                       "starting the transcription job", input_video_file,
+                                       is_retryable=is_throttling_error)
+                started_job_name = job_name
+
+                # save the checkpoint, so that an interrupted run can re-attach to the job
+                write_checkpoint(checkpoint_file, {"job_name": job_name, "bucket": bucket, "s3_key": s3_key,
+                                                   "temporary_bucket": temporary_bucket,
+                                                   "language_code": args.language_code})
+
+            # wait for the transcription job to complete
+            log(input_video_file, "Waiting for the transcription job to complete...")
+            with profiler.stage("queue_and_transcribe"):
+                job = await wait_for_job(transcribe, started_job_name, input_video_file, args.poll_interval,
+                                         args.max_poll_interval)
+            output_uri = job["Transcript"]["TranscriptFileUri"]
+
+            # fetch the transcription job output JSON over the shared HTTP connection pool
+            log(input_video_file, "Downloading the transcription job output JSON...")
+            with profiler.stage("download"):
+                transcript = await with_retries(lambda: fetch_json(http, output_uri),
+                                                "downloading the transcription job output", input_video_file)
+        except TranscriptionJobFailed:
+            raise
+        except BaseException:
+            # interrupted (or the polling / download failed) while the job runs: leave the job and its
+            # audio for a rerun to re-attach to
+            keep_job = started_job_name is not None
+            raise
+        finally:
+            with profiler.stage("cleanup"):
+                if keep_job:
+                    log(input_video_file,
+                        f"Leaving the transcription job {started_job_name} running, rerun to resume")
+                    await cleanup(s3, transcribe, input_video_file, None, None, None, flac_audio_file, None)
+                else:
+                    await cleanup(s3, transcribe, input_video_file, bucket, s3_key, started_job_name,
+                                  flac_audio_file, temporary_bucket)
+                    if os.path.exists(checkpoint_file):
+                        os.remove(checkpoint_file)
+
+    # write the transcript in the same form as the whisper path (floats instead of strings,
+    # timings on the punctuation items), and store it in the cache
+    with profiler.stage("normalize_transcript"):
+        transcript = normalize_aws_transcript(transcript)
+    write_transcript_json(output_json_file, transcript, args.npz)
+    if cache is not None:
+        cache.put(cache_key, transcript)
+    log(input_video_file, f"Wrote {output_json_file}")
+
+
+async def transcribe_files(args):
+    cache = None
+    if not args.no_cache:
+        cache = DiskCache(args.cache_dir, args.cache_max_mb * 1024 * 1024)
+
+    # one client (and connection pool) per service, shared by all the files
+    session = get_session()
+    config = AioConfig(max_pool_connections=max(10, args.concurrency * (args.upload_concurrency + 1)))
+    client_args = {"region_name": args.region, "endpoint_url": args.endpoint_url, "config": config}
+    connector = aiohttp.TCPConnector(limit=max(10, args.concurrency))
+    async with session.create_client("s3", **client_args) as s3, \
+            session.create_client("transcribe", **client_args) as transcribe, \
+            aiohttp.ClientSession(connector=connector, raise_for_status=True) as http:
+        if args.bucket:
+            with profiler.stage("prepare_bucket"):
+                await prepare_reused_bucket(s3, args.bucket, args.prefix, args.expire_days, args.region)
+        semaphore = asyncio.Semaphore(args.concurrency)
+        results = await asyncio.gather(
+            *[transcribe_file(s3, transcribe, http, input_video_file, args, cache, semaphore)
+              for input_video_file in args.input_video_file],
+            return_exceptions=True)
+
+    n_failed = 0
+    for input_video_file, result in zip(args.input_video_file, results):
+        if isinstance(result, Exception):
+            n_failed += 1
+            log(input_video_file, f"Error: {result}")
+    return n_failed
+
+
+def main():
+    # get the input video file and the output text file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input_video_file", nargs="+", help="input video file(s)")
+    parser.add_argument("--concurrency", type=int, default=4, help="maximum number of files transcribed at once")
+    parser.add_argument("--region", default="us-east-1", help="AWS region")
+    parser.add_argument("--endpoint_url", default=None,
+                        help="AWS endpoint URL, e.g. of a local stand-in such as a moto server")
+    parser.add_argument("--language_code", default="en-US", help="language of the audio")
+    parser.add_argument("--bucket", default=os.environ.get("TRANSCRIBE_S3_BUCKET"),
+                        help="reuse this S3 bucket instead of creating a temporary one per job")
+    parser.add_argument("--prefix", default="transcribe-audio/",
+                        help="key prefix of the audio in the reused bucket (not empty)")
+    parser.add_argument("--expire_days", type=int, default=1,
+                        help="days after which the audio in the reused bucket expires")
+    parser.add_argument("--part_size_mb", type=int, default=16, help="size of the multipart upload parts (at least 5)")
+    parser.add_argument("--upload_concurrency", type=int, default=4,
+                        help="number of parts of a file uploaded at once")
+    parser.add_argument("--poll_interval", type=float, default=2.0, help="initial job status polling interval")
+    parser.add_argument("--max_poll_interval", type=float, default=30.0,
+                        help="maximum job status polling interval")
+    parser.add_argument("--no-resume", action="store_true",
+                        help="start a new job instead of re-attaching to the job of an interrupted run")
+    parser.add_argument("--no-cache", action="store_true", help="do not read or write the cache")
+    parser.add_argument("--refresh", action="store_true",
+                        help="ignore the cached transcript, transcribe again and update the cache")
+    parser.add_argument("--cache_dir", default=DEFAULT_CACHE_DIR, help="transcript cache directory")
+    parser.add_argument("--cache_max_mb", type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024),
+                        help="maximum size of the cache, least recently used entries are evicted")
+    parser.add_argument("--npz", action="store_true",
+                        help="also write the transcript in the compact columnar .npz format")
+    add_profiling_arguments(parser)
+    args = parser.parse_args()
+    if args.bucket and not args.prefix:
+        # the lifecycle rule expires everything under the prefix, i.e. the whole bucket
+        parser.error("--prefix must not be empty with --bucket")
+    start_profiling(args, "transcribe_from_video_aws")
+
+    n_failed = asyncio.run(transcribe_files(args))
+    if n_failed > 0:
+        print(f"{n_failed} of {len(args.input_video_file)} files failed")
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,7 @@
 # use whisper from openai to transcribe the audio
 #
 # Usage:
-# python transcribe_from_video.py <input_video_file>
+# python transcribe_from_video.py <input_video_file> [<input_video_file> ...]
 #
 # The output JSON file will be saved in the same directory as the input video file
 #
@@ -12,226 +12,1039 @@
 # python transcribe_from_video.py "input_video.mp4"
 #
 # The output JSON file will have the name "input_video.json"
+#
+# Use --stream to pipe the audio from ffmpeg straight into the model instead of writing a
+# temporary wav file, and --stream_chunk_seconds to transcribe it in (slightly overlapping)
+# chunks while ffmpeg is still decoding the rest of the file:
+# python transcribe_from_video.py "input_video.mp4" --stream --stream_chunk_seconds 600
+#
+# Batch mode: pass several files, directories or glob patterns. The model is loaded once,
+# the audio of the next file is decoded while the current one is transcribed, and each
+# JSON file is written as soon as its video is done:
+# python transcribe_from_video.py lectures/ "extra/*.mp4"
+#
+# Parallel mode: split the audio at pauses into N chunks and transcribe them in a pool of N
+# processes, each with its own model limited to --cpu_threads threads:
+# python transcribe_from_video.py "input_video.mp4" --parallel 8 --cpu_threads 4
+#
+# Transcripts are cached on disk, keyed by the path, size and modification time of the video
+# and the model settings, so re-running on the same video returns instantly. With
+# --cache_by_content a miss is looked up again by a hash of the decoded audio, which also
+# finds a renamed or re-muxed copy but decodes the audio one more time.
+# Use --no-cache to bypass the cache and --refresh to transcribe again and update it.
+#
+# Pick the model and how it runs with --model, --compute_type (e.g. int8 for fast quantized
+# CPU inference), --cpu_threads, --num_workers and --beam_size, or put them in a JSON file
+# passed with --config, e.g. {"model": "small", "compute_type": "int8", "beam_size": 1}.
+# benchmark_whisper_settings.py compares the speed and quality of these settings.
+#
+# Batched inference: --batch_size N decodes N 30-second windows of the audio at once with the
+# batched pipeline of faster-whisper (1.1 or later), which splits the audio at the speech found
+# by its Silero VAD. With several input files, short files are packed together into one
+# timeline, so the batches are full even for clips shorter than N windows, and the words are
+# split back into the files afterwards:
+# python transcribe_from_video.py clips/ --batch_size 16 --compute_type int8
+#
+# Use --vad to skip the non-speech parts of the audio (intros, music, dead air) before they
+# are decoded: "silero" uses the Silero VAD built into faster-whisper, "energy" cuts the
+# silences below --vad_threshold_db. The word timestamps stay on the original timeline.
+#
+# Use --npz to also write the transcript in the compact columnar format ("input_video.npz")
+# that the other scripts load much faster than the JSON file.
+#
+# The words are appended to "input_video.jsonl" as soon as they are transcribed, which is
+# replaced by "input_video.json" once the whole file is done. After a crash, the .jsonl file
+# holds the partial transcript, which the other scripts can read as well. It is also the
+# checkpoint: a rerun seeks the audio to the end of the last word written and continues
+# from there, unless --no-resume is given.
+#
+# Live mode: transcribe a recording that is still being written, stdin ("-") or an ffmpeg
+# input URL in rolling windows. Every --live_step_seconds of new audio the words that are
+# no longer within --live_overlap_seconds of the live edge are appended to a JSON Lines file
+# ("input_video.jsonl" or --output), which the other scripts can read while it grows:
+# ffmpeg -i rtmp://... -c copy -f mpegts - | python transcribe_from_video.py - --live -o live.jsonl
+#
+# Use --report (JSON), --prometheus and --profile (cProfile) to see where the time goes: the
+# audio extraction, the model load, the decoding, writing the JSON, ... (see profiling_utils.py)
 
 import argparse
+import bisect
+import collections
+import glob
 import json
-import subprocess
 import os
-import re
-import uuid
+import subprocess
+import time
+import types
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
 from faster_whisper import WhisperModel
 
-# get the input video file and the output text file
-parser = argparse.ArgumentParser()
-parser.add_argument("input_video_file", help="input video file")
-args = parser.parse_args()
+try:
+    from faster_whisper import BatchedInferencePipeline
+except ImportError:
+    # faster-whisper < 1.1
+    BatchedInferencePipeline = None
+
+from audio_utils import (
+    SAMPLE_RATE,
+    concatenate_regions,
+    find_speech_regions,
+    find_split_points,
+    hash_audio,
+    is_local_file,
+    iter_audio_chunks,
+    read_audio,
+    remap_times,
+)
+from cache_utils import DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES, DiskCache, make_cache_key
+from profiling_utils import (
+    add_profiling_arguments,
+    file_size,
+    profiler,
+    start_profiling,
+)
+from transcript_utils import TranscriptWriter, split_punctuation, write_transcript_json
 
-# get the input video file name and the output text file name
-input_video_file = args.input_video_file
+# file extensions picked up when a directory is given as input
+MEDIA_EXTENSIONS = (
+    ".mp4",
+    ".mov",
+    ".mkv",
+    ".avi",
+    ".webm",
+    ".m4v",
+    ".mp3",
+    ".m4a",
+    ".wav",
+    ".flac",
+)
 
-# get the input video file name without the extension
-input_video_file_name = os.path.splitext(input_video_file)[0]
+MODEL_NAME = "base"
 
-# get the input video file name without the extension and without the path
-input_video_file_name_without_path = os.path.basename(input_video_file_name)
+# the int8 types quantize the weights, which is the fastest on CPUs
+COMPUTE_TYPES = [
+    "default",
+    "int8",
+    "int8_float32",
+    "int8_float16",
+    "int16",
+    "float16",
+    "float32",
+]
 
-# transcribe the audio from the input video file
-# the output will be a JSON file with the transcription
-# use whisper from openai to transcribe the audio
-# the output JSON file will be saved in the same directory as the input video file
-# the output JSON file will have the name "input_video.json"
+# hack the model to produce filler words by adding them as an input prompt
+INITIAL_PROMPT = "So uhm, yeaah. Uh, um. Uhh, Umm. Like, Okay, ehm, uuuh."
 
-# get the audio from the input video file
-# the output will be a wav file with the same name as the input video file
-# the output wav file will be saved in the same directory as the input video file
+# in batched mode, files are packed together until there are this many seconds of audio, with
+# this much silence between them: the batched pipeline never puts more than 30 seconds of
+# audio in one window, so no window can hold the words of two files
+PACK_SECONDS = 600.0
+PACK_GAP_SECONDS = 31.0
 
-# get the input video file name without the extension
-input_video_file_name = os.path.splitext(input_video_file)[0]
+# number of files decoded ahead of the model in batched mode
+PACK_PREFETCH_FILES = 8
 
-# get the input video file name without the extension and without the path
-input_video_file_name_without_path = os.path.basename(input_video_file_name)
+# in parallel mode and with --stream_chunk_seconds each chunk is transcribed with this much
+# extra audio on both sides, so that words at the split points are heard in full by at
+# least one of the chunks
+CHUNK_OVERLAP_SECONDS = 1.0
 
-# get the output wav file name
-output_wav_file_name = input_video_file_name_without_path + ".wav"
+# the model and decoding settings, set from the command line (or the --config file)
+model_settings = {
+    "model": MODEL_NAME,
+    "compute_type": "default",
+    "cpu_threads": 0,
+    "num_workers": 1,
+    "beam_size": 5,
+    "batch_size": 0,
+    "vad": "off",
+    "vad_threshold_db": -40.0,
+}
 
-# get the output wav file name with the path
-output_wav_file_name_with_path = os.path.join(
-    os.path.dirname(input_video_file), output_wav_file_name
-)
+# the model of a parallel worker process, loaded once per process
+worker_model = None
+
+
+@profiler.timed("model_load")
+def load_model(settings):
+    model = WhisperModel(
+        settings["model"],
+        compute_type=settings["compute_type"],
+        cpu_threads=settings["cpu_threads"],
+        num_workers=settings["num_workers"],
+    )
+    if settings["batch_size"] > 0:
+        if BatchedInferencePipeline is None:
+            print("Error: batched inference needs faster-whisper 1.1 or later")
+            exit(1)
+        return BatchedInferencePipeline(model=model)
+    return model
+
+
+# audio is a file name or a float32 array, the settings default to model_settings
+# the segments are decoded lazily, this only covers what faster-whisper does up front
+# (reading the audio file, the features and the language detection)
+@profiler.timed("transcribe_setup")
+def transcribe(model, audio, settings=None):
+    settings = settings or model_settings
+    if settings["batch_size"] > 0:
+        # the batched pipeline always splits the audio at the speech found by the VAD
+        options = {"batch_size": settings["batch_size"], "vad_filter": True}
+    elif settings["vad"] == "energy":
+        return transcribe_speech(model, audio, settings)
+    else:
+        options = {"vad_filter": settings["vad"] == "silero"}
+
+    segments, transcriptionInfo = model.transcribe(
+        audio,
+        beam_size=settings["beam_size"],
+        initial_prompt=INITIAL_PROMPT,
+        word_timestamps=True,
+        suppress_blank=True,
+        **options,
+    )
+    if options["vad_filter"]:
+        print_vad_stats(
+            transcriptionInfo.duration,
+            getattr(
+                transcriptionInfo, "duration_after_vad", transcriptionInfo.duration
+            ),
+        )
+    return segments, transcriptionInfo
 
-print("converting video to audio...")
-# execute the command to extract the audio from the input video file
-# the output will be a wav file with the same name as the input video file
-# the output wav file will be saved in the same directory as the input video file
-subprocess.run(
-    [
-        "ffmpeg",
-        "-i",
-        input_video_file,
-        "-vn",
-        "-ac",
-        "1",
-        "-ar",
-        "16000",
-        "-loglevel",
-        "quiet",
-        "-copyts",
-        "-y",
-        output_wav_file_name_with_path,
-    ]
-)
 
-# check if the output wav file exists
-if not os.path.exists(output_wav_file_name_with_path):
+def transcribe_speech(model, audio, settings):
+    # energy-based VAD: only decode the speech regions of the audio, back to back, and map
+    # the word timestamps back to the original timeline
+    if isinstance(audio, str):
+        audio = read_audio(audio)
+    regions = find_speech_regions(audio, settings["vad_threshold_db"])
+    speech, speech_starts, original_starts = concatenate_regions(audio, regions)
+    transcriptionInfo = types.SimpleNamespace(
+        duration=len(audio) / SAMPLE_RATE,
+        duration_after_vad=len(speech) / SAMPLE_RATE,
+    )
+    print_vad_stats(transcriptionInfo.duration, transcriptionInfo.duration_after_vad)
+    if len(speech) == 0:
+        return [], transcriptionInfo
+
+    segments, _ = model.transcribe(
+        speech,
+        beam_size=settings["beam_size"],
+        initial_prompt=INITIAL_PROMPT,
+        word_timestamps=True,
+        suppress_blank=True,
+    )
+    return remap_segments(segments, speech_starts, original_starts), transcriptionInfo
+
+
+def remap_segments(segments, speech_starts, original_starts):
+    # the segments are still generated lazily, one at a time
+    for segment in segments:
+        words = segment.words
+        starts = remap_times(
+            [word.start for word in words], speech_starts, original_starts, side="right"
+        )
+        ends = remap_times(
+            [word.end for word in words], speech_starts, original_starts, side="left"
+        )
+        yield types.SimpleNamespace(
+            words=[
+                types.SimpleNamespace(
+                    word=word.word, start=start, end=end, probability=word.probability
+                )
+                for word, start, end in zip(words, starts.tolist(), ends.tolist())
+            ]
+        )
+
+
+def print_vad_stats(duration, speech_duration):
+    if duration <= 0:
+        return
+    skipped = duration - speech_duration
+    speedup = duration / max(speech_duration, 0.001)
     print(
-        'Error: the output wav file does not exist "'
-        + output_wav_file_name_with_path
-        + '"'
+        f"VAD: skipped {skipped:.1f}s of {duration:.1f}s of audio "
+        f"({skipped / duration:.0%}), {speedup:.2f}x less audio to decode"
     )
-    exit(1)
 
-print("transcribing audio...")
-model = WhisperModel("base")
-# hack the model to produce filler words by adding them as an input prompt
-segments, transcriptionInfo = model.transcribe(
-    output_wav_file_name_with_path,
-    initial_prompt="So uhm, yeaah. Uh, um. Uhh, Umm. Like, Okay, ehm, uuuh.",
-    word_timestamps=True,
-    suppress_blank=True,
-)
 
-punctuation_marks = "\"'.。,，!！?？:：”)]}、"
+# the settings that change the transcript (and not only how fast it is produced)
+def get_transcript_settings():
+    return {
+        "model": model_settings["model"],
+        "compute_type": model_settings["compute_type"],
+        "beam_size": model_settings["beam_size"],
+        "batched": model_settings["batch_size"] > 0,
+        "vad": model_settings["vad"],
+        "vad_threshold_db": model_settings["vad_threshold_db"],
+    }
 
-new_segments = []
-# split punctuation from words into new items
-for segment in segments:
-    new_words = []
-    for word in segment.words:
-        wordStr = word.word.strip()
-        if len(wordStr) < 1:
-            continue
-        if wordStr[-1] in punctuation_marks:
-            punctuation = wordStr[-1]
-            new_words.append(
-                {
-                    "word": wordStr[:-1].strip(),
-                    "start": word.start,
-                    "end": word.end,
-                    "probability": word.probability,
-                }
+
+def get_output_json_file_name(input_video_file):
+    # get the input video file name without the extension and without the path
+    input_video_file_name_without_path = os.path.basename(
+        os.path.splitext(input_video_file)[0]
+    )
+
+    # the output json file is saved in the same directory as the input video file
+    return os.path.join(
+        os.path.dirname(input_video_file), input_video_file_name_without_path + ".json"
+    )
+
+
+def get_cache_key(input_video_file, by_content=False):
+    # everything that changes the transcript: the input and the model settings. the input is
+    # identified by its path, size and modification time, which only costs a stat, or with
+    # by_content by a hash of its decoded audio, which costs a full decode of the file
+    if by_content:
+        source = {"audio": hash_audio(input_video_file)}
+    else:
+        stat = os.stat(input_video_file)
+        source = {
+            "file": os.path.abspath(input_video_file),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+        }
+    return make_cache_key(
+        **source,
+        **get_transcript_settings(),
+        initial_prompt=INITIAL_PROMPT,
+        word_timestamps=True,
+    )
+
+
+# the words are written to a .jsonl file next to the output json file while transcribing
+# with resume, the .jsonl file left by an interrupted run is continued
+def open_output(input_video_file, write_npz=False, resume=True):
+    output_json_file = get_output_json_file_name(input_video_file)
+    writer = TranscriptWriter(
+        os.path.splitext(output_json_file)[0] + ".jsonl",
+        header={"source": input_video_file, **get_transcript_settings()},
+        output_json_file=output_json_file,
+        write_npz=write_npz,
+        resume=resume,
+    )
+    if writer.resume_offset > 0:
+        print(
+            f"resuming from {writer.resume_offset:.1f}s "
+            f"({writer.n_items} items already transcribed)..."
+        )
+    return writer
+
+
+# finish the output json file and store it in the cache under each of its cache keys,
+# returns the output file name
+def close_output(writer, audio_duration, cache=None, cache_keys=None):
+    output_json_file = writer.close(duration=audio_duration)
+    # only the audio after resume_offset was transcribed by this run
+    profiler.add_audio_seconds(audio_duration - writer.resume_offset)
+    if cache is not None:
+        for cache_key in cache_keys or []:
+            cache.put_file(cache_key, output_json_file)
+    return output_json_file
+
+
+# the decoding happens here, the segments come lazily out of the model
+@profiler.timed("transcribe")
+def write_segments(writer, segments, time_offset=0.0):
+    # write each segment as soon as it is decoded
+    for segment in segments:
+        writer.write_segments(split_punctuation([segment], time_offset))
+
+
+@profiler.timed("extract_audio")
+def extract_wav(input_video_file, start_time=None):
+    # get the audio from the input video file, from start_time on
+    # the output will be a wav file with the same name as the input video file
+    # the output wav file will be saved in the same directory as the input video file
+    output_wav_file_name_with_path = (
+        os.path.splitext(get_output_json_file_name(input_video_file))[0] + ".wav"
+    )
+
+    print("converting video to audio...")
+    subprocess.run(
+        [
+            "ffmpeg",
+            *(["-ss", str(start_time)] if start_time else []),
+            "-i",
+            input_video_file,
+            "-vn",
+            "-ac",
+            "1",
+            "-ar",
+            "16000",
+            "-loglevel",
+            "quiet",
+            "-copyts",
+            "-y",
+            output_wav_file_name_with_path,
+        ]
+    )
+
+    # check if the output wav file exists
+    if not os.path.exists(output_wav_file_name_with_path):
+        print(
+            'Error: the output wav file does not exist "'
+            + output_wav_file_name_with_path
+            + '"'
+        )
+        exit(1)
+
+    profiler.add_bytes_read(file_size(input_video_file))
+    profiler.add_bytes_written(file_size(output_wav_file_name_with_path))
+    return output_wav_file_name_with_path
+
+
+# transcribe a single file into the writer, returns the duration of the audio in seconds
+# the audio before writer.resume_offset was transcribed by an earlier run and is skipped
+def transcribe_file(
+    model, input_video_file, writer, stream=False, stream_chunk_seconds=0
+):
+    start_time = writer.resume_offset
+    if stream and stream_chunk_seconds > 0:
+        print("transcribing audio stream in chunks...")
+        audio_duration = start_time
+        # ffmpeg keeps decoding the next chunks in the background while the model
+        # decodes the current one
+        chunks = iter_audio_chunks(
+            input_video_file, stream_chunk_seconds, start_time=start_time
+        )
+        # each chunk is transcribed with the last 2 * CHUNK_OVERLAP_SECONDS of the previous
+        # one in front of it, and the words are split between the two at the middle of that
+        # overlap, like in parallel mode. The next chunk is read before the current one is
+        # transcribed, to know whether the current one is the last.
+        overlap = int(2 * CHUNK_OVERLAP_SECONDS * SAMPLE_RATE)
+        previous_tail = np.zeros(0, dtype=np.float32)
+        keep_start = float("-inf")
+        next_chunk = next(chunks, None)
+        while next_chunk is not None:
+            chunk_start_time, chunk = next_chunk
+            next_chunk = next(chunks, None)
+            audio = np.concatenate((previous_tail, chunk))
+            audio_start_time = chunk_start_time - len(previous_tail) / SAMPLE_RATE
+            audio_duration = chunk_start_time + len(chunk) / SAMPLE_RATE
+            previous_tail = audio[-overlap:]
+            keep_end = (
+                audio_duration - len(previous_tail) / 2 / SAMPLE_RATE
+                if next_chunk is not None
+                else float("inf")
+            )
+            print(f"transcribing chunk at {chunk_start_time:.1f}s...")
+            segments, _ = transcribe(model, audio)
+            with profiler.stage("transcribe"):
+                writer.write_segments(
+                    keep_words_in_range(
+                        segments, audio_start_time, keep_start, keep_end
+                    )
+                )
+            keep_start = keep_end
+        return audio_duration
+
+    if stream:
+        # read the raw audio from the ffmpeg stdout pipe, nothing is written to disk
+        print("converting video to audio stream...")
+        audio = read_audio(input_video_file, start_time=start_time)
+        print("transcribing audio...")
+        segments, _ = transcribe(model, audio)
+        write_segments(writer, segments, start_time)
+        return start_time + len(audio) / SAMPLE_RATE
+
+    output_wav_file_name_with_path = extract_wav(input_video_file, start_time)
+    print("transcribing audio...")
+    segments, transcriptionInfo = transcribe(model, output_wav_file_name_with_path)
+    write_segments(writer, segments, start_time)
+
+    # cleanup the output wav file
+    os.remove(output_wav_file_name_with_path)
+    return start_time + transcriptionInfo.duration
+
+
+def init_parallel_worker(settings):
+    global model_settings, worker_model
+    model_settings = settings
+    worker_model = load_model(settings)
+
+
+# only keep the words whose middle falls in [keep_start, keep_end), so that a word heard
+# by two overlapping chunks is emitted exactly once
+def keep_words_in_range(segments, chunk_start_time, keep_start, keep_end):
+    kept_segments = []
+    for segment in segments:
+        words = [
+            word
+            for word in segment.words
+            if keep_start <= chunk_start_time + (word.start + word.end) / 2 < keep_end
+        ]
+        if len(words) > 0:
+            kept_segments.append(types.SimpleNamespace(words=words))
+    return split_punctuation(kept_segments, chunk_start_time)
+
+
+# transcribe one chunk of audio in a worker process
+def transcribe_chunk(chunk, chunk_start_time, keep_start, keep_end):
+    segments, _ = transcribe(worker_model, chunk)
+    return keep_words_in_range(segments, chunk_start_time, keep_start, keep_end)
+
+
+def transcribe_parallel(executor, n_chunks, input_video_file, writer):
+    print("converting video to audio stream...")
+    start_time = writer.resume_offset
+    audio = read_audio(input_video_file, start_time=start_time)
+    split_points = find_split_points(audio, n_chunks)
+    overlap = int(CHUNK_OVERLAP_SECONDS * SAMPLE_RATE)
+
+    print(f"transcribing audio in {len(split_points) - 1} chunks...")
+    futures = []
+    for start, end in zip(split_points[:-1], split_points[1:]):
+        chunk_start = max(0, start - overlap)
+        chunk_end = min(len(audio), end + overlap)
+        futures.append(
+            executor.submit(
+                transcribe_chunk,
+                audio[chunk_start:chunk_end],
+                start_time + chunk_start / SAMPLE_RATE,
+                # the first and last chunks keep everything before/after them
+                start_time + start / SAMPLE_RATE if start > 0 else float("-inf"),
+                start_time + end / SAMPLE_RATE if end < len(audio) else float("inf"),
+            )
+        )
+
+    # stitch the chunks back together in order
+    with profiler.stage("transcribe"):
+        for future in futures:
+            writer.write_segments(future.result())
+    return start_time + len(audio) / SAMPLE_RATE
+
+
+def get_live_output_file_name(input_source):
+    if is_local_file(input_source):
+        return os.path.splitext(get_output_json_file_name(input_source))[0] + ".jsonl"
+    return "live_transcript.jsonl"
+
+
+def transcribe_live(
+    model,
+    input_source,
+    output_jsonl_file,
+    step_seconds,
+    overlap_seconds,
+    idle_timeout,
+):
+    # every step_seconds of new audio, transcribe the audio since the last committed point
+    # (plus overlap_seconds of context before it) and commit the words that end more than
+    # overlap_seconds before the live edge: the model may still change its mind about the
+    # words at the very end of the window, which have not been heard in full yet
+    if step_seconds <= overlap_seconds:
+        print("Error: --live_step_seconds must be larger than --live_overlap_seconds")
+        exit(1)
+
+    overlap_samples = int(overlap_seconds * SAMPLE_RATE)
+    window = np.zeros(0, dtype=np.float32)
+    window_start = 0  # in samples since the start of the stream
+    committed_until = 0  # in samples, all the words before it are written
+    n_windows = 0
+    total_elapsed = 0.0
+
+    def commit_window(keep_until, new_audio_seconds):
+        nonlocal n_windows, total_elapsed
+        start = time.perf_counter()
+        with profiler.stage("transcribe"):
+            segments, _ = transcribe(model, window)
+            new_segments = keep_words_in_range(
+                segments,
+                window_start / SAMPLE_RATE,
+                committed_until / SAMPLE_RATE,
+                keep_until / SAMPLE_RATE,
             )
-            new_words.append(
-                {
-                    "word": punctuation,
-                    "start": word.end,
-                    "end": word.end,
-                    "probability": word.probability,
-                }
+        n_items = writer.write_segments(new_segments)
+        elapsed = time.perf_counter() - start
+        profiler.add_audio_seconds(new_audio_seconds)
+        n_windows += 1
+        total_elapsed += elapsed
+        # RTF above 1 means the transcription falls behind the live source
+        print(
+            f"window {n_windows}: {window_start / SAMPLE_RATE:.1f}-"
+            f"{(window_start + len(window)) / SAMPLE_RATE:.1f}s, {n_items} new items, "
+            f"latency {elapsed:.2f}s, RTF {elapsed / new_audio_seconds:.3f}"
+        )
+
+    print(f"transcribing {input_source} live into {output_jsonl_file}...")
+    writer = TranscriptWriter(
+        output_jsonl_file,
+        header={"source": input_source, **get_transcript_settings(), "live": True},
+    )
+    for _, chunk in iter_audio_chunks(
+        input_source, step_seconds, follow_timeout=idle_timeout
+    ):
+        window = np.concatenate((window, chunk))
+        keep_until = window_start + len(window) - overlap_samples
+        if keep_until <= committed_until:
+            continue
+        commit_window(keep_until, len(chunk) / SAMPLE_RATE)
+        committed_until = keep_until
+
+        # drop the committed audio, except for overlap_samples of context
+        new_window_start = max(window_start, committed_until - overlap_samples)
+        window = window[new_window_start - window_start :]
+        window_start = new_window_start
+
+    # the source ended: commit the rest of the audio
+    window_end = window_start + len(window)
+    if window_end > committed_until:
+        commit_window(float("inf"), (window_end - committed_until) / SAMPLE_RATE)
+        committed_until = window_end
+    writer.close(duration=committed_until / SAMPLE_RATE)
+
+    print_realtime_factor(
+        f"wrote {output_jsonl_file} ({n_windows} windows)",
+        committed_until / SAMPLE_RATE,
+        total_elapsed,
+    )
+
+
+# expand the command line inputs (files, directories or glob patterns) to a list of files
+def resolve_input_files(inputs):
+    input_files = []
+    for input_path in inputs:
+        if os.path.isdir(input_path):
+            input_files += sorted(
+                os.path.join(input_path, file_name)
+                for file_name in os.listdir(input_path)
+                if file_name.lower().endswith(MEDIA_EXTENSIONS)
             )
+        elif os.path.exists(input_path):
+            input_files.append(input_path)
         else:
-            new_words.append(
-                {
-                    "word": word.word,
-                    "start": word.start,
-                    "end": word.end,
-                    "probability": word.probability,
-                }
+            matches = sorted(glob.glob(input_path))
+            if len(matches) == 0:
+                print(f'Warning: no input files match "{input_path}"')
+            input_files += matches
+    return input_files
+
+
+def print_realtime_factor(label, audio_duration, elapsed):
+    # realtime factor = processing time / audio duration (lower is faster)
+    if audio_duration <= 0:
+        print(f"{label}: {elapsed:.1f}s")
+        return
+    print(
+        f"{label}: {audio_duration:.1f}s of audio in {elapsed:.1f}s, "
+        f"RTF {elapsed / audio_duration:.3f} ({audio_duration / elapsed:.1f}x realtime)"
+    )
+
+
+def transcribe_batch(
+    model,
+    input_video_files,
+    cache=None,
+    cache_keys=None,
+    write_npz=False,
+    resume=True,
+):
+    # decode the audio of the next file in the background while the model transcribes the
+    # current one, so ffmpeg extraction and decoding overlap. at most two files are held
+    # in memory at any time.
+    total_audio_duration = 0.0
+    batch_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        next_audio = executor.submit(read_audio, input_video_files[0])
+        for i, input_video_file in enumerate(input_video_files):
+            file_start = time.perf_counter()
+            print(f"[{i + 1}/{len(input_video_files)}] {input_video_file}")
+            try:
+                audio = next_audio.result()
+            except Exception as e:
+                audio = None
+                print(f"Error: could not decode the audio: {e}")
+            if i + 1 < len(input_video_files):
+                next_audio = executor.submit(read_audio, input_video_files[i + 1])
+            if audio is None:
+                continue
+
+            audio_duration = len(audio) / SAMPLE_RATE
+            writer = open_output(input_video_file, write_npz, resume)
+            # skip the audio that an earlier run already transcribed
+            start_time = writer.resume_offset
+            segments, _ = transcribe(model, audio[int(start_time * SAMPLE_RATE) :])
+            write_segments(writer, segments, start_time)
+            output_json_file = close_output(
+                writer, audio_duration, cache, (cache_keys or {}).get(input_video_file)
             )
-    new_segment = {"words": new_words}
-    new_segments.append(new_segment)
 
-# print(json.dumps(result, indent=4))
+            total_audio_duration += audio_duration
+            print_realtime_factor(
+                f"wrote {output_json_file}",
+                audio_duration,
+                time.perf_counter() - file_start,
+            )
 
-# get the output json file name
-output_json_file_name = input_video_file_name_without_path + ".json"
+    print_realtime_factor(
+        f"transcribed {len(input_video_files)} files",
+        total_audio_duration,
+        time.perf_counter() - batch_start,
+    )
 
-# get the output json file name with the path
-output_json_file_name_with_path = os.path.join(
-    os.path.dirname(input_video_file), output_json_file_name
-)
 
-# write the output json file where the output format is:
-# {
-#     "results": {
-#         "transcripts": [{
-#             "transcript": "the transcript"
-#         }],
-#         "items": [
-#             {
-#                 "alternatives": [
-#                     {
-#                         "content": "the word",
-#                         "confidence": 0.0
-#                     }
-#                 ],
-#                 "start_time": 0.0,
-#                 "end_time": 0.0,
-#                 "type": "pronunciation"
-#             },
-#             ...
-#         ]
-#     }
-# }
-#
-# the input forma from whisper is:
-# {
-#     "segments": [
-#         {
-#             "words": [
-#                 {
-#                     "word": "the word",
-#                     "start": 0.0,
-#                     "end": 0.0,
-#                     "probability": 0.0
-#                 },
-#                 ...
-#             ]
-#         },
-#         ...
-#     ]
-# }
-#
-# translate from whisper format to output format
-with open(output_json_file_name_with_path, "w") as outfile:
-    json.dump(
-        {
-            "results": {
-                "transcripts": [
-                    {
-                        "transcript": " ".join(
-                            [
-                                word["word"].strip()
-                                for segment in new_segments
-                                for word in segment["words"]
-                            ]
-                        ),
-                    }
-                ],
-                "items": [
-                    {
-                        "alternatives": [
-                            {
-                                "content": word["word"],
-                                "confidence": word["probability"],
-                            },
-                        ],
-                        "start_time": word["start"],
-                        "end_time": word["end"],
-                        "confidence": word["probability"],
-                        "type": (
-                            "pronunciation"
-                            if word["word"] not in punctuation_marks
-                            else "punctuation"
-                        ),
-                    }
-                    for segment in new_segments
-                    for word in segment["words"]
-                ],
-            }
-        },
-        outfile,
-        indent=2,
-    )
-
-# cleanup the output wav file
-os.remove(output_wav_file_name_with_path)
+def decode_files(input_video_files):
+    # yield (input_video_file, audio) tuples, decoding up to PACK_PREFETCH_FILES files ahead
+    # in the background
+    def result(pending_file):
+        input_video_file, future = pending_file
+        try:
+            yield input_video_file, future.result()
+        except Exception as e:
+            print(f"Error: could not decode the audio of {input_video_file}: {e}")
+
+    pending = collections.deque()
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        for input_video_file in input_video_files:
+            pending.append(
+                (input_video_file, executor.submit(read_audio, input_video_file))
+            )
+            if len(pending) >= PACK_PREFETCH_FILES:
+                yield from result(pending.popleft())
+        while len(pending) > 0:
+            yield from result(pending.popleft())
+
+
+def iter_packs(decoded_files, pack_seconds):
+    # group the decoded files into packs of at least pack_seconds of audio
+    pack = []
+    pack_duration = 0.0
+    for input_video_file, audio in decoded_files:
+        pack.append((input_video_file, audio))
+        pack_duration += len(audio) / SAMPLE_RATE
+        if pack_duration >= pack_seconds:
+            yield pack
+            pack = []
+            pack_duration = 0.0
+    if len(pack) > 0:
+        yield pack
+
+
+def transcribe_packed(
+    model, input_video_files, cache=None, cache_keys=None, write_npz=False
+):
+    # lay several files out one after the other, separated by PACK_GAP_SECONDS of silence,
+    # so that the batched pipeline fills its batches with windows of all of them, and then
+    # send every segment back to the file it came from. the files start from scratch, a
+    # partial transcript of an earlier run is not resumed in this mode.
+    gap = np.zeros(int(PACK_GAP_SECONDS * SAMPLE_RATE), dtype=np.float32)
+    total_audio_duration = 0.0
+    n_files = 0
+    batch_start = time.perf_counter()
+    for pack in iter_packs(decode_files(input_video_files), PACK_SECONDS):
+        pack_start = time.perf_counter()
+        file_starts = []
+        pieces = []
+        offset = 0
+        for _, audio in pack:
+            file_starts.append(offset / SAMPLE_RATE)
+            pieces += [audio, gap]
+            offset += len(audio) + len(gap)
+        writers = [
+            open_output(input_video_file, write_npz, resume=False)
+            for input_video_file, _ in pack
+        ]
+
+        segments, _ = transcribe(model, np.concatenate(pieces))
+        with profiler.stage("transcribe"):
+            for segment in segments:
+                if len(segment.words) == 0:
+                    continue
+                # the file that holds the middle of the segment
+                middle = (segment.words[0].start + segment.words[-1].end) / 2
+                k = max(0, bisect.bisect_right(file_starts, middle) - 1)
+                writers[k].write_segments(
+                    split_punctuation([segment], -file_starts[k])
+                )
+
+        pack_duration = 0.0
+        for (input_video_file, audio), writer in zip(pack, writers):
+            audio_duration = len(audio) / SAMPLE_RATE
+            output_json_file = close_output(
+                writer, audio_duration, cache, (cache_keys or {}).get(input_video_file)
+            )
+            print(f"wrote {output_json_file}")
+            pack_duration += audio_duration
+        total_audio_duration += pack_duration
+        n_files += len(pack)
+        print_realtime_factor(
+            f"transcribed a pack of {len(pack)} files",
+            pack_duration,
+            time.perf_counter() - pack_start,
+        )
+
+    print_realtime_factor(
+        f"transcribed {n_files} files",
+        total_audio_duration,
+        time.perf_counter() - batch_start,
+    )
+
+
+def main():
+    # get the input video file and the output text file
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "input_video_file",
+        nargs="+",
+        help="input video file (or several files, directories or glob patterns)",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="stream the audio from ffmpeg into memory instead of a temporary wav file",
+    )
+    parser.add_argument(
+        "--stream_chunk_seconds",
+        type=float,
+        default=0,
+        help="in stream mode, transcribe chunks of this many seconds as they are decoded "
+        "(0 = decode the whole file first)",
+    )
+    parser.add_argument(
+        "--parallel",
+        type=int,
+        default=0,
+        help="split the audio at pauses and transcribe the chunks in this many processes",
+    )
+    parser.add_argument(
+        "--config",
+        help="JSON file with default values for the options, e.g. "
+        '{"model": "small", "compute_type": "int8"}',
+    )
+    parser.add_argument(
+        "--model",
+        default=MODEL_NAME,
+        help="whisper model size (tiny, base, small, medium, large-v3, ...) or path",
+    )
+    parser.add_argument(
+        "--compute_type",
+        choices=COMPUTE_TYPES,
+        default="default",
+        help="type of the model weights and computations, int8 is the fastest on CPUs",
+    )
+    parser.add_argument(
+        "--cpu_threads",
+        type=int,
+        default=0,
+        help="threads per model (0 = the default, or in parallel mode cpu count / number "
+        "of processes)",
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=1,
+        help="number of transcriptions a model can run at once",
+    )
+    parser.add_argument(
+        "--beam_size", type=int, default=5, help="beam size of the decoder (1 = greedy)"
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=0,
+        help="decode this many 30-second windows at once with the batched pipeline, "
+        "packing short files together (0 = no batching)",
+    )
+    parser.add_argument(
+        "--vad",
+        choices=["off", "silero", "energy"],
+        default="off",
+        help="skip the non-speech audio before decoding, with the Silero VAD of "
+        "faster-whisper or by cutting the silences",
+    )
+    parser.add_argument(
+        "--vad_threshold_db",
+        type=float,
+        default=-40.0,
+        help="with --vad energy, audio below this level (dB relative to full scale) "
+        "is silence",
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="do not read or write the cache"
+    )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="ignore cached transcripts, transcribe again and update the cache",
+    )
+    parser.add_argument(
+        "--cache_dir", default=DEFAULT_CACHE_DIR, help="transcript cache directory"
+    )
+    parser.add_argument(
+        "--cache_by_content",
+        action="store_true",
+        help="on a cache miss, also look up the transcript by a hash of the decoded audio, "
+        "to find renamed or re-muxed copies (decodes every missed file once more)",
+    )
+    parser.add_argument(
+        "--cache_max_mb",
+        type=int,
+        default=DEFAULT_MAX_BYTES // (1024 * 1024),
+        help="maximum size of the cache, least recently used entries are evicted",
+    )
+    parser.add_argument(
+        "--npz",
+        action="store_true",
+        help="also write the transcript in the compact columnar .npz format",
+    )
+    parser.add_argument(
+        "--no-resume",
+        action="store_true",
+        help="start from the beginning instead of resuming an interrupted transcription",
+    )
+    parser.add_argument(
+        "--live",
+        action="store_true",
+        help="transcribe a growing file, stdin (-) or an ffmpeg input URL in rolling "
+        "windows and append the words to a JSON Lines file as they become stable",
+    )
+    parser.add_argument("-o", "--output", help="output JSON Lines file in live mode")
+    parser.add_argument(
+        "--live_step_seconds",
+        type=float,
+        default=10.0,
+        help="in live mode, transcribe a new window every this many seconds of audio",
+    )
+    parser.add_argument(
+        "--live_overlap_seconds",
+        type=float,
+        default=3.0,
+        help="in live mode, words this close to the live edge are only written once "
+        "the next window has heard them in full",
+    )
+    parser.add_argument(
+        "--live_idle_timeout",
+        type=float,
+        default=30.0,
+        help="in live mode, stop once a growing file did not grow for this many seconds",
+    )
+    add_profiling_arguments(parser)
+
+    # the values of the --config file become the defaults, the command line still wins
+    config_args, _ = parser.parse_known_args()
+    if config_args.config:
+        with open(config_args.config) as f:
+            parser.set_defaults(**json.load(f))
+    args = parser.parse_args()
+    start_profiling(args, "transcribe_from_video_whisper")
+
+    model_settings.update(
+        model=args.model,
+        compute_type=args.compute_type,
+        cpu_threads=args.cpu_threads,
+        num_workers=args.num_workers,
+        beam_size=args.beam_size,
+        batch_size=args.batch_size,
+        vad=args.vad,
+        vad_threshold_db=args.vad_threshold_db,
+    )
+    if args.batch_size > 0 and args.vad == "energy":
+        print("Error: batched inference always uses the Silero VAD, not --vad energy")
+        exit(1)
+
+    if args.live:
+        if len(args.input_video_file) != 1:
+            print("Error: live mode takes a single input")
+            exit(1)
+        input_source = args.input_video_file[0]
+        transcribe_live(
+            load_model(model_settings),
+            input_source,
+            args.output or get_live_output_file_name(input_source),
+            args.live_step_seconds,
+            args.live_overlap_seconds,
+            args.live_idle_timeout,
+        )
+        return
+
+    input_video_files = resolve_input_files(args.input_video_file)
+    if len(input_video_files) == 0:
+        print("Error: no input files")
+        exit(1)
+
+    # look up the cached transcripts and only transcribe the files that are missing
+    cache = None
+    cache_keys = {}
+    if not args.no_cache:
+        cache = DiskCache(args.cache_dir, args.cache_max_mb * 1024 * 1024)
+        missing_files = []
+        for input_video_file in input_video_files:
+            with profiler.stage("cache_lookup"):
+                file_cache_keys = [get_cache_key(input_video_file)]
+                transcript = None if args.refresh else cache.get(file_cache_keys[0])
+                if transcript is None and args.cache_by_content:
+                    file_cache_keys.append(get_cache_key(input_video_file, True))
+                    transcript = None if args.refresh else cache.get(file_cache_keys[1])
+                    if transcript is not None:
+                        # a copy of a cached video, find it by its file next time
+                        cache.put(file_cache_keys[0], transcript)
+            if transcript is None:
+                cache_keys[input_video_file] = file_cache_keys
+                missing_files.append(input_video_file)
+                continue
+            output_json_file = get_output_json_file_name(input_video_file)
+            write_transcript_json(output_json_file, transcript, args.npz)
+            print(f"wrote {output_json_file} (cached)")
+        input_video_files = missing_files
+        if len(input_video_files) == 0:
+            return
+
+    if args.parallel > 1:
+        cpu_threads = args.cpu_threads or max(1, (os.cpu_count() or 1) // args.parallel)
+        with ProcessPoolExecutor(
+            max_workers=args.parallel,
+            initializer=init_parallel_worker,
+            initargs=(
+                {**model_settings, "cpu_threads": cpu_threads, "num_workers": 1},
+            ),
+        ) as executor:
+            for input_video_file in input_video_files:
+                start = time.perf_counter()
+                writer = open_output(input_video_file, args.npz, not args.no_resume)
+                audio_duration = transcribe_parallel(
+                    executor, args.parallel, input_video_file, writer
+                )
+                output_json_file = close_output(
+                    writer, audio_duration, cache, cache_keys.get(input_video_file)
+                )
+                print_realtime_factor(
+                    f"wrote {output_json_file}",
+                    audio_duration,
+                    time.perf_counter() - start,
+                )
+        return
+
+    # the model is loaded once and shared by all the input files
+    model = load_model(model_settings)
+
+    if len(input_video_files) > 1 and args.batch_size > 0:
+        transcribe_packed(model, input_video_files, cache, cache_keys, args.npz)
+        return
+
+    if len(input_video_files) > 1:
+        transcribe_batch(
+            model, input_video_files, cache, cache_keys, args.npz, not args.no_resume
+        )
+        return
+
+    input_video_file = input_video_files[0]
+    start = time.perf_counter()
+    writer = open_output(input_video_file, args.npz, not args.no_resume)
+    audio_duration = transcribe_file(
+        model, input_video_file, writer, args.stream, args.stream_chunk_seconds
+    )
+    output_json_file = close_output(
+        writer, audio_duration, cache, cache_keys.get(input_video_file)
+    )
+    print_realtime_factor(
+        f"wrote {output_json_file}", audio_duration, time.perf_counter() - start
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,535 @@
+# helpers to convert the whisper output into the AWS Transcribe style JSON format
+# that all the other scripts in this repo read
+#
+# the output format is:
+# {
+#     "results": {
+#         "transcripts": [{
+#             "transcript": "the transcript"
+#         }],
+#         "items": [
+#             {
+#                 "alternatives": [
+#                     {
+#                         "content": "the word",
+#                         "confidence": 0.0
+#                     }
+#                 ],
+#                 "start_time": 0.0,
+#                 "end_time": 0.0,
+#                 "type": "pronunciation"
+#             },
+#             ...
+#         ]
+#     }
+# }
+#
+# the same words can also be stored in a compact columnar .npz file (see WordTable), which
+# loads much faster than the nested JSON for long transcripts:
+#     contents:     all the words joined by "\n", as utf-8 bytes
+#     start_times:  float64 array
+#     end_times:    float64 array
+#     confidences:  float32 array
+#     types:        int8 array (TYPE_PRONUNCIATION or TYPE_PUNCTUATION)
+#
+# transcripts that are written while the audio is still being transcribed are JSON Lines
+# files (.jsonl, see TranscriptWriter): a {"header": {...}} line, one output item per line
+# in the same format as above, and a {"footer": {...}} line once the transcript is complete.
+#
+# the input forma from whisper is:
+# {
+#     "segments": [
+#         {
+#             "words": [
+#                 {
+#                     "word": "the word",
+#                     "start": 0.0,
+#                     "end": 0.0,
+#                     "probability": 0.0
+#                 },
+#                 ...
+#             ]
+#         },
+#         ...
+#     ]
+# }
+
+import json
+import os
+import time
+
+import numpy as np
+
+from profiling_utils import file_size, profiler
+
+punctuation_marks = "\"'.。,，!！?？:：”)]}、"
+
+# item type codes in a WordTable
+TYPE_PRONUNCIATION = 0
+TYPE_PUNCTUATION = 1
+
+# the punctuation marks that end a sentence, and the words that are left out of the
+# sentences (see SentenceIndex)
+SENTENCE_END_MARKS = [".", "?", "!"]
+FILLER_WORDS = ["um", "uh", "so", "hmm", "like"]
+
+# how often an incrementally written transcript is synced to disk
+CHECKPOINT_SYNC_SECONDS = 30.0
+
+
+# split punctuation from words into new items
+# time_offset is added to all the timings, for audio that was transcribed in chunks
+def split_punctuation(segments, time_offset=0.0):
+    new_segments = []
+    for segment in segments:
+        new_words = []
+        for word in segment.words:
+            wordStr = word.word.strip()
+            if len(wordStr) < 1:
+                continue
+            start = word.start + time_offset
+            end = word.end + time_offset
+            if wordStr[-1] in punctuation_marks:
+                punctuation = wordStr[-1]
+                new_words.append(
+                    {
+                        "word": wordStr[:-1].strip(),
+                        "start": start,
+                        "end": end,
+                        "probability": word.probability,
+                    }
+                )
+                new_words.append(
+                    {
+                        "word": punctuation,
+                        "start": end,
+                        "end": end,
+                        "probability": word.probability,
+                    }
+                )
+            else:
+                new_words.append(
+                    {
+                        "word": word.word,
+                        "start": start,
+                        "end": end,
+                        "probability": word.probability,
+                    }
+                )
+        new_segment = {"words": new_words}
+        new_segments.append(new_segment)
+    return new_segments
+
+
+# translate a single whisper word to an output item
+def word_to_item(word):
+    return {
+        "alternatives": [
+            {
+                "content": word["word"],
+                "confidence": word["probability"],
+            },
+        ],
+        "start_time": word["start"],
+        "end_time": word["end"],
+        "confidence": word["probability"],
+        "type": (
+            "pronunciation" if word["word"] not in punctuation_marks else "punctuation"
+        ),
+    }
+
+
+# translate from whisper format to output format
+def segments_to_transcript(new_segments):
+    return {
+        "results": {
+            "transcripts": [
+                {
+                    "transcript": " ".join(
+                        [
+                            word["word"].strip()
+                            for segment in new_segments
+                            for word in segment["words"]
+                        ]
+                    ),
+                }
+            ],
+            "items": [
+                word_to_item(word)
+                for segment in new_segments
+                for word in segment["words"]
+            ],
+        }
+    }
+
+
+# translate the AWS Transcribe output to the same normalized form as the whisper path
+# AWS returns the timings and confidences as strings and has no timings on the punctuation
+# items, which get the end time of the previous item instead
+def normalize_aws_transcript(aws_transcript):
+    items = []
+    last_end_time = 0.0
+    for aws_item in aws_transcript["results"]["items"]:
+        alternative = aws_item["alternatives"][0]
+        word = {
+            "word": alternative["content"],
+            "start": float(aws_item.get("start_time", last_end_time)),
+            "end": float(aws_item.get("end_time", last_end_time)),
+            "probability": float(alternative.get("confidence") or 0.0),
+        }
+        item = word_to_item(word)
+        item["type"] = aws_item["type"]
+        items.append(item)
+        last_end_time = word["end"]
+    return {
+        "results": {
+            "transcripts": aws_transcript["results"]["transcripts"],
+            "items": items,
+        }
+    }
+
+
+@profiler.timed("write_output")
+def write_transcript_json(output_json_file, transcript, write_npz=False):
+    with open(output_json_file, "w") as outfile:
+        json.dump(transcript, outfile, indent=2)
+    profiler.add_bytes_written(file_size(output_json_file))
+
+    # also write the compact columnar version next to the JSON file
+    if write_npz:
+        npz_file = os.path.splitext(output_json_file)[0] + ".npz"
+        WordTable.from_items(transcript["results"]["items"]).save_npz(npz_file)
+        profiler.add_bytes_written(file_size(npz_file))
+
+
+# a transcript as columns of arrays instead of a list of nested dicts
+class WordTable:
+    __slots__ = ("contents", "start_times", "end_times", "confidences", "types")
+
+    def __init__(self, contents, start_times, end_times, confidences, types):
+        self.contents = contents
+        self.start_times = start_times
+        self.end_times = end_times
+        self.confidences = confidences
+        self.types = types
+
+    def __len__(self):
+        return len(self.contents)
+
+    @classmethod
+    def from_items(cls, items):
+        # build the table from the AWS style `results.items` list
+        # AWS returns the timings and confidences as strings and has no timings on the
+        # punctuation items, which get the end time of the previous item instead
+        n = len(items)
+        contents = []
+        start_times = np.zeros(n, dtype=np.float64)
+        end_times = np.zeros(n, dtype=np.float64)
+        confidences = np.zeros(n, dtype=np.float32)
+        types = np.zeros(n, dtype=np.int8)
+        last_end_time = 0.0
+        for i, item in enumerate(items):
+            alternative = item["alternatives"][0]
+            contents.append(alternative["content"])
+            start_times[i] = float(item.get("start_time", last_end_time))
+            end_times[i] = float(item.get("end_time", last_end_time))
+            confidences[i] = float(alternative.get("confidence") or 0.0)
+            types[i] = (
+                TYPE_PUNCTUATION if item["type"] == "punctuation" else TYPE_PRONUNCIATION
+            )
+            last_end_time = end_times[i]
+        return cls(contents, start_times, end_times, confidences, types)
+
+    @classmethod
+    def load_npz(cls, npz_file):
+        with np.load(npz_file) as data:
+            text = data["contents"].tobytes().decode("utf-8")
+            return cls(
+                text.split("\n") if len(data["types"]) > 0 else [],
+                data["start_times"],
+                data["end_times"],
+                data["confidences"],
+                data["types"],
+            )
+
+    def save_npz(self, npz_file):
+        np.savez(
+            npz_file,
+            contents=np.frombuffer("\n".join(self.contents).encode("utf-8"), np.uint8),
+            start_times=self.start_times,
+            end_times=self.end_times,
+            confidences=self.confidences,
+            types=self.types,
+        )
+
+    def pronunciation_indices(self):
+        return np.flatnonzero(self.types == TYPE_PRONUNCIATION)
+
+
+# the sentences of a WordTable, as arrays built in one vectorized pass over its columns
+#
+# a sentence ends with a "." "?" or "!" punctuation item (the words after the last one are
+# not part of any sentence). the words of sentence k are the table items
+#     word_indices[word_starts[k]:word_ends[k]]
+# i.e. its pronunciations without the filler words, and it lasts from the start of its first
+# word to the end of its last one (a sentence without words is an instant at its
+# punctuation). the sentences and words are in time order, so the lookups by time are
+# binary searches.
+#
+# Example:
+# index = SentenceIndex.from_table(load_transcript("talk.json"))
+# k = index.sentence_at(62.5)
+# print(index.start_times[k], index.sentence_text(k))
+# words = index.words_between(60.0, 90.0)
+class SentenceIndex:
+    __slots__ = (
+        "table",
+        "end_items",
+        "word_indices",
+        "word_starts",
+        "word_ends",
+        "word_start_times",
+        "word_end_times",
+        "start_times",
+        "end_times",
+    )
+
+    def __init__(
+        self,
+        table,
+        end_items,
+        word_indices,
+        word_starts,
+        word_ends,
+        word_start_times,
+        word_end_times,
+        start_times,
+        end_times,
+    ):
+        self.table = table
+        self.end_items = end_items
+        self.word_indices = word_indices
+        self.word_starts = word_starts
+        self.word_ends = word_ends
+        self.word_start_times = word_start_times
+        self.word_end_times = word_end_times
+        self.start_times = start_times
+        self.end_times = end_times
+
+    def __len__(self):
+        return len(self.end_items)
+
+    @classmethod
+    def from_table(cls, table, filler_words=FILLER_WORDS):
+        # the whisper words keep the space in front of them (" um")
+        contents = np.char.strip(np.asarray(table.contents, dtype=str))
+        is_punctuation = table.types == TYPE_PUNCTUATION
+        end_items = np.flatnonzero(
+            is_punctuation & np.isin(contents, SENTENCE_END_MARKS)
+        )
+        is_word = (table.types == TYPE_PRONUNCIATION) & ~np.isin(
+            np.char.lower(contents), list(filler_words)
+        )
+        # the sentence of every item is that of the next sentence end
+        item_sentences = np.searchsorted(end_items, np.arange(len(table)))
+        word_indices = np.flatnonzero(is_word & (item_sentences < len(end_items)))
+        word_sentences = item_sentences[word_indices]
+        sentences = np.arange(len(end_items))
+        word_starts = np.searchsorted(word_sentences, sentences, side="left")
+        word_ends = np.searchsorted(word_sentences, sentences, side="right")
+
+        word_start_times = table.start_times[word_indices].astype(np.float64)
+        word_end_times = table.end_times[word_indices].astype(np.float64)
+        has_words = word_ends > word_starts
+        start_times = table.start_times[end_items].astype(np.float64)
+        end_times = start_times.copy()
+        start_times[has_words] = word_start_times[word_starts[has_words]]
+        end_times[has_words] = word_end_times[word_ends[has_words] - 1]
+        return cls(
+            table,
+            end_items,
+            word_indices,
+            word_starts,
+            word_ends,
+            word_start_times,
+            word_end_times,
+            start_times,
+            end_times,
+        )
+
+    def sentence_words(self, k):
+        # the table indices of the words of sentence k
+        return self.word_indices[self.word_starts[k] : self.word_ends[k]]
+
+    def sentence_text(self, k):
+        return (
+            " ".join(self.table.contents[i].strip() for i in self.sentence_words(k))
+            + "."
+        )
+
+    def sentence_at(self, time):
+        # the sentence that is being spoken at `time`, or -1 between two sentences
+        k = int(np.searchsorted(self.start_times, time, side="right")) - 1
+        if k < 0 or time > self.end_times[k]:
+            return -1
+        return k
+
+    def sentences_between(self, start_time, end_time):
+        # the range of the sentences that overlap [start_time, end_time]
+        first = int(np.searchsorted(self.end_times, start_time, side="left"))
+        last = int(np.searchsorted(self.start_times, end_time, side="right"))
+        return range(first, max(first, last))
+
+    def words_between(self, start_time, end_time):
+        # the table indices of the sentence words that overlap [start_time, end_time]
+        first = np.searchsorted(self.word_end_times, start_time, side="left")
+        last = np.searchsorted(self.word_start_times, end_time, side="right")
+        return self.word_indices[first : max(first, last)]
+
+
+# write a transcript incrementally: every item is appended to a JSON Lines file as soon as
+# its words come off the model, so a crash partway through a long file leaves a usable
+# partial transcript. with output_json_file, close() also writes the usual JSON document,
+# streamed from the .jsonl file so the items are never all held in memory, and removes the
+# .jsonl file.
+#
+# the .jsonl file doubles as a checkpoint: with resume=True an unfinished file written by an
+# earlier run with the same header is continued, and resume_offset is the end time of its
+# last item, i.e. where the transcription of the audio should pick up again.
+class TranscriptWriter:
+    def __init__(
+        self,
+        output_jsonl_file,
+        header=None,
+        output_json_file=None,
+        write_npz=False,
+        resume=False,
+    ):
+        self.output_jsonl_file = output_jsonl_file
+        self.output_json_file = output_json_file
+        self.header = {"version": 1, **(header or {})}
+        self.write_npz = write_npz
+        self.last_sync_time = time.monotonic()
+        if resume and self._load_checkpoint():
+            self.outfile = open(output_jsonl_file, "a")
+            return
+
+        self.n_items = 0
+        self.resume_offset = 0.0
+        # only the text (and, for the .npz file, the columns) are kept in memory
+        self.transcript_words = []
+        self.table_items = [] if write_npz else None
+        self.outfile = open(output_jsonl_file, "w")
+        self.outfile.write(json.dumps({"header": self.header}) + "\n")
+        self.outfile.flush()
+
+    def _load_checkpoint(self):
+        # read the items of an unfinished .jsonl file, and cut off an incomplete last line
+        self.n_items = 0
+        self.resume_offset = 0.0
+        self.transcript_words = []
+        self.table_items = [] if self.write_npz else None
+        valid_bytes = 0
+        try:
+            with open(self.output_jsonl_file, "rb") as f:
+                for i, line in enumerate(f):
+                    if not line.endswith(b"\n"):
+                        break
+                    data = json.loads(line)
+                    if i == 0 and data.get("header") != self.header:
+                        return False
+                    if "footer" in data:
+                        return False
+                    valid_bytes += len(line)
+                    if "alternatives" not in data:
+                        continue
+                    self.transcript_words.append(
+                        data["alternatives"][0]["content"].strip()
+                    )
+                    if self.table_items is not None:
+                        self.table_items.append(data)
+                    self.resume_offset = max(self.resume_offset, data["end_time"])
+                    self.n_items += 1
+        except (FileNotFoundError, ValueError):
+            return False
+        if valid_bytes == 0:
+            return False
+        os.truncate(self.output_jsonl_file, valid_bytes)
+        return True
+
+    # append the words of the whisper segments, returns the number of items written
+    def write_segments(self, new_segments):
+        n_items = 0
+        for segment in new_segments:
+            for word in segment["words"]:
+                item = word_to_item(word)
+                self.outfile.write(json.dumps(item) + "\n")
+                self.transcript_words.append(word["word"].strip())
+                if self.table_items is not None:
+                    self.table_items.append(item)
+                n_items += 1
+        self.outfile.flush()
+        self.n_items += n_items
+
+        # make sure the checkpoint survives the loss of the whole machine, not only of the
+        # process, without paying for an fsync after every segment
+        if time.monotonic() - self.last_sync_time >= CHECKPOINT_SYNC_SECONDS:
+            os.fsync(self.outfile.fileno())
+            self.last_sync_time = time.monotonic()
+        return n_items
+
+    @profiler.timed("write_output")
+    def close(self, **footer):
+        self.outfile.write(
+            json.dumps({"footer": {"n_items": self.n_items, **footer}}) + "\n"
+        )
+        self.outfile.close()
+
+        output_file = self.output_jsonl_file
+        if self.output_json_file is not None:
+            self._write_json()
+            os.remove(self.output_jsonl_file)
+            output_file = self.output_json_file
+        profiler.add_bytes_written(file_size(output_file))
+        if self.table_items is not None:
+            npz_file = os.path.splitext(output_file)[0] + ".npz"
+            WordTable.from_items(self.table_items).save_npz(npz_file)
+            profiler.add_bytes_written(file_size(npz_file))
+        return output_file
+
+    def _write_json(self):
+        # copy the item lines of the .jsonl file into the "items" list of the JSON document
+        tmp_json_file = self.output_json_file + ".tmp"
+        with open(self.output_jsonl_file) as infile, open(tmp_json_file, "w") as outfile:
+            transcript = json.dumps(" ".join(self.transcript_words))
+            outfile.write(
+                '{\n  "results": {\n    "transcripts": [\n'
+                f'      {{"transcript": {transcript}}}\n    ],\n    "items": [\n'
+            )
+            separator = "      "
+            for line in infile:
+                if line.startswith('{"alternatives"'):
+                    outfile.write(separator + line.rstrip("\n"))
+                    separator = ",\n      "
+            outfile.write("\n    ]\n  }\n}\n")
+        os.replace(tmp_json_file, self.output_json_file)
+
+
+# load a transcript in any of the formats (.json, .jsonl or .npz) as a WordTable
+@profiler.timed("load_transcript")
+def load_transcript(transcript_file):
+    profiler.add_bytes_read(file_size(transcript_file))
+    if transcript_file.endswith(".npz"):
+        return WordTable.load_npz(transcript_file)
+    if transcript_file.endswith(".jsonl"):
+        with open(transcript_file) as f:
+            # a file that is still being written may end with an incomplete line
+            items = []
+            for line in f:
+                if not line.endswith("\n"):
+                    break
+                if line.startswith('{"alternatives"'):
+                    items.append(json.loads(line))
+        return WordTable.from_items(items)
+    with open(transcript_file) as f:
+        return WordTable.from_items(json.load(f)["results"]["items"])